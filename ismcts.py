@@ -21,6 +21,11 @@ https://ieeexplore.ieee.org/document/6203567
 
 import copy
 import enum
+import importlib
+import itertools
+import multiprocessing
+import threading
+import time
 import numpy as np
 import pyspiel
 import traceback # <--- Импорт traceback
@@ -28,6 +33,10 @@ import traceback # <--- Импорт traceback
 UNLIMITED_NUM_WORLD_SAMPLES = -1
 UNEXPANDED_VISIT_COUNT = -1
 TIE_TOLERANCE = 1e-5
+# Как часто (в симуляциях) поиск с бюджетом времени проверяет, решен ли уже выбор в корне.
+EARLY_STOP_CHECK_INTERVAL = 16
+# Доля лимита max_nodes, освобождаемая за одно вытеснение (чтобы не сканировать таблицу после каждой симуляции).
+NODE_EVICTION_FRACTION = 0.1
 
 
 class ISMCTSFinalPolicyType(enum.Enum):
@@ -43,6 +52,36 @@ class ChildSelectionPolicy(enum.Enum):
   PUCT = 2
 
 
+class ISMCTSStopReason(enum.Enum):
+  """Why the last ISMCTS search stopped."""
+  NO_SEARCH = 1  # terminal/chance state or a single legal action
+  SIMULATION_LIMIT = 2
+  TIME_BUDGET = 3
+  DECIDED = 4  # the most visited root child can no longer be overtaken
+  EXACT = 5  # action values computed exactly by the state's endgame solver
+  BOOK = 6  # policy taken from the opening book
+
+
+class ISMCTSSearchInfo(object):
+  """Summary of the last search: simulations run, stop reason, wall time and node table size.
+
+  `num_nodes` is the size of the node table after the search (summed over the
+  workers in root-parallel search) and `evicted_nodes` the number of nodes
+  evicted during it to stay under max_nodes.
+  """
+
+  def __init__(self, simulations, stop_reason, elapsed_ms, num_nodes=0, evicted_nodes=0):
+    self.simulations = simulations
+    self.stop_reason = stop_reason
+    self.elapsed_ms = elapsed_ms
+    self.num_nodes = num_nodes
+    self.evicted_nodes = evicted_nodes
+
+  def __repr__(self):
+    return (f"ISMCTSSearchInfo(simulations={self.simulations}, stop_reason={self.stop_reason.name}, elapsed_ms={self.elapsed_ms:.1f}, "
+            f"num_nodes={self.num_nodes}, evicted_nodes={self.evicted_nodes})")
+
+
 class ChildInfo(object):
   """Child node information for the search tree."""
 
@@ -58,13 +97,97 @@ class ChildInfo(object):
     return self.return_sum / self.visits
 
 
+class PathStack(object):
+  """Preallocated path of one descent: (node, node action, player) per step.
+
+  A simulation makes at most max_game_length decisions, so the slots are
+  allocated once with that capacity and a descent only overwrites them.
+  """
+
+  __slots__ = ("nodes", "actions", "players", "depth")
+
+  def __init__(self, capacity):
+    self.nodes = [None] * capacity
+    self.actions = [pyspiel.INVALID_ACTION] * capacity
+    self.players = [0] * capacity
+    self.depth = 0
+
+
 class ISMCTSNode(object):
-  """Node data structure for the search tree."""
+  """Node data structure for the search tree.
+
+  Child statistics live in NumPy arrays indexed by a per-node action id (the
+  position of the action in `actions`), so selection and the final policy are
+  computed with vector operations. Only `expanded` children are part of the
+  tree; the others are registered legal actions waiting for their first visit.
+  `virtual_losses` counts descents through a child whose returns have not been
+  backed up yet (tree-parallel search). `child_keys` holds the keys of the next
+  decision nodes reached from this one, used to prune the tree when reusing it.
+  """
 
   def __init__(self):
-    self.child_info = {}
+    self.actions = []
+    self.action_ids = {}
+    self.visits = np.zeros(0)
+    self.return_sums = np.zeros(0)
+    self.priors = np.zeros(0)
+    self.expanded = np.zeros(0, dtype=bool)
+    self.virtual_losses = np.zeros(0)
+    self.num_expanded = 0
     self.total_visits = 0
+    self.total_virtual_losses = 0
     self.prior_map = {}
+    self.child_keys = set()
+    self.widening_order = None
+
+  def add_actions(self, actions):
+    """Registers unexpanded actions, taking their priors from prior_map."""
+    new_actions = [a for a in actions if a not in self.action_ids]
+    if not new_actions:
+      return
+    first_id = len(self.actions)
+    for offset, action in enumerate(new_actions):
+      self.action_ids[action] = first_id + offset
+    self.actions.extend(new_actions)
+    num_new = len(new_actions)
+    self.visits = np.concatenate([self.visits, np.zeros(num_new)])
+    self.return_sums = np.concatenate([self.return_sums, np.zeros(num_new)])
+    self.priors = np.concatenate([self.priors, [self.prior_map.get(a, 0.0) for a in new_actions]])
+    self.expanded = np.concatenate([self.expanded, np.zeros(num_new, dtype=bool)])
+    self.virtual_losses = np.concatenate([self.virtual_losses, np.zeros(num_new)])
+
+  def action_id(self, action):
+    """Returns the id of `action`, registering it first if needed."""
+    child_id = self.action_ids.get(action)
+    if child_id is None:
+      self.add_actions([action])
+      child_id = self.action_ids[action]
+    return child_id
+
+  def is_expanded(self, action):
+    child_id = self.action_ids.get(action)
+    return child_id is not None and self.expanded[child_id]
+
+  def expanded_ids(self):
+    return np.flatnonzero(self.expanded)
+
+  def values(self, ids):
+    """Mean returns of the children `ids` (0 for unvisited children)."""
+    visits = self.visits[ids]
+    return np.where(visits > 0, self.return_sums[ids] / np.maximum(visits, 1), 0.0)
+
+  def copy(self):
+    new_node = copy.copy(self)
+    new_node.actions = list(self.actions); new_node.action_ids = dict(self.action_ids); new_node.prior_map = dict(self.prior_map)
+    new_node.visits = self.visits.copy(); new_node.return_sums = self.return_sums.copy()
+    new_node.priors = self.priors.copy(); new_node.expanded = self.expanded.copy()
+    new_node.virtual_losses = self.virtual_losses.copy(); new_node.child_keys = set(self.child_keys)
+    return new_node
+
+  @property
+  def child_info(self):
+    """Expanded children as {action: ChildInfo}; a snapshot for inspection."""
+    return {self.actions[i]: ChildInfo(self.visits[i], self.return_sums[i], self.priors[i]) for i in self.expanded_ids()}
 
 
 class ISMCTSBot(pyspiel.Bot):
@@ -80,7 +203,21 @@ class ISMCTSBot(pyspiel.Bot):
                final_policy_type=ISMCTSFinalPolicyType.MAX_VISIT_COUNT,
                use_observation_string=False,
                allow_inconsistent_action_sets=False,
-               child_selection_policy=ChildSelectionPolicy.PUCT):
+               child_selection_policy=ChildSelectionPolicy.PUCT,
+               use_suit_isomorphism=False,
+               num_workers=1,
+               worker_modules=None,
+               num_tree_threads=1,
+               virtual_loss=1.0,
+               reuse_tree=False,
+               time_budget_ms=None,
+               widening_c=None,
+               widening_alpha=0.5,
+               exact_endgame_max_outcomes=100000,
+               eval_batch_size=1,
+               world_pool_size=256,
+               max_nodes=None,
+               opening_book=None):
 
     pyspiel.Bot.__init__(self)
     self._game = game
@@ -97,6 +234,66 @@ class ISMCTSBot(pyspiel.Bot):
     self._random_state = random_state or np.random.RandomState()
     self._child_selection_policy = child_selection_policy
     self._resampler_cb = None
+    # Канонизация по мастям: узлы и действия изоморфных инфостейтов совпадают
+    # (требует canonical_information_state_key/canonical_actions у состояния).
+    self._use_suit_isomorphism = use_suit_isomorphism
+    # Root-параллелизм: num_workers процессов ведут независимые поиски из одного корня,
+    # статистики корня суммируются. Пул создается при первом поиске и переиспользуется.
+    self._num_workers = num_workers
+    self._worker_modules = worker_modules
+    self._worker_pool = None
+    # Tree-параллелизм: num_tree_threads потоков спускаются по общему дереву; каждый
+    # незавершенный спуск через ребенка штрафует его на virtual_loss, разводя потоки
+    # по разным веткам. Изменения дерева - под одной блокировкой, а оценка листьев,
+    # клонирование и apply_action идут вне ее. Потоки делят GIL, поэтому режим
+    # предназначен только для оценщиков, которые отпускают GIL на время оценки
+    # (инференс сети в нативном коде, запросы к серверу оценки) и объявляют это
+    # атрибутом releases_gil = True; оценщик должен быть потокобезопасным. Оценщики
+    # на чистом Python (например, ofc_rollout.OFCRolloutEvaluator) потоками не
+    # ускоряются и отклоняются - для них root-параллелизм (num_workers).
+    if num_tree_threads > 1 and not getattr(evaluator, "releases_gil", False):
+      raise ValueError("num_tree_threads > 1 requires an evaluator that releases the GIL "
+                       "(evaluator.releases_gil = True); use num_workers for pure-Python evaluators")
+    self._num_tree_threads = num_tree_threads
+    self._virtual_loss = virtual_loss
+    self._tree_lock = threading.Lock()
+    # Стеки путей спусков (PathStack) - свои у каждого потока дерева
+    self._path_stacks = threading.local()
+    # Переиспользование дерева между ходами: вместо сброса остается поддерево,
+    # достижимое из инфостейта нового корня. В root-параллельном поиске деревья
+    # воркеров не переиспользуются: процесс пула может выполнить несколько задач
+    # одного поиска, и вторая задача посчитала бы посещения первой повторно.
+    self._reuse_tree = reuse_tree
+    # Anytime-режим: поиск идет до дедлайна (max_simulations <= 0 снимает лимит
+    # симуляций) и прекращается раньше, если выбор по числу посещений уже решен.
+    self._time_budget_ms = time_budget_ms
+    self.last_search_info = None
+    # Прогрессивное расширение: у узла раскрыто не больше ceil(c * (N + 1)^alpha)
+    # детей, в порядке убывания prior (None - раскрывать все легальные действия).
+    self._widening_c = widening_c
+    self._widening_alpha = widening_alpha
+    # Точный эндшпиль: если состояние умеет exact_action_values и перебор не больше
+    # exact_endgame_max_outcomes исходов, политика в корне считается без симуляций (None - выключено).
+    self._exact_endgame_max_outcomes = exact_endgame_max_outcomes
+    # Пакетная оценка листьев: eval_batch_size спусков (с virtual loss на путях)
+    # собирают листья, которые оцениваются одним evaluate_batch, а priors новых
+    # узлов - одним prior_batch (при их отсутствии - поштучными evaluate/prior).
+    self._eval_batch_size = max(1, eval_batch_size)
+    self._pending_prior_nodes = set()
+    # Пул миров: если состояние умеет world_pool, миры корня сэмплируются пачками по
+    # world_pool_size (с max_world_samples - одна пачка из max_world_samples миров)
+    # одной выборкой из self._random_state и материализуются по одному при запросе
+    # (world_pool_size=0 - прежнее поштучное resample_from_infostate).
+    self._world_pool_size = world_pool_size
+    self._world_pool = None
+    self._world_pool_next = 0
+    # Лимит таблицы узлов: когда после симуляции узлов больше max_nodes, вытесняется
+    # доля NODE_EVICTION_FRACTION наименее посещенных узлов вне текущих спусков (None - без лимита).
+    self._max_nodes = max_nodes
+    self._num_evicted = 0
+    # Книга дебютов: объект с lookup(state) -> политика или None; найденная политика
+    # возвращается до поиска (например, ofc_opening_book.OFCOpeningBook).
+    self._opening_book = opening_book
 
   def random_number(self):
     return self._random_state.uniform()
@@ -105,6 +302,34 @@ class ISMCTSBot(pyspiel.Bot):
     self._nodes = {}
     self._node_pool = []
     self._root_samples = []
+    self._world_pool = None
+
+  def _prepare_tree(self, state):
+    """Resets the tree, or with reuse_tree prunes it to the subtree under `state`."""
+    if not self._reuse_tree:
+      self.reset()
+      return
+    # Сэмплы миров относятся к старому корню
+    self._root_samples = []
+    self._world_pool = None
+    root_key = self.get_state_key(state)
+    if root_key not in self._nodes:
+      self.reset()
+      return
+    reachable = {root_key}; frontier = [root_key]
+    while frontier:
+      for child_key in self._nodes[frontier.pop()].child_keys:
+        if child_key not in reachable and child_key in self._nodes:
+          reachable.add(child_key); frontier.append(child_key)
+    self._nodes = {key: self._nodes[key] for key in reachable}
+    self._node_pool = list(self._nodes.values())
+
+  def close(self):
+    """Shuts down the root-parallel worker pool, if one was started."""
+    if self._worker_pool is not None:
+      self._worker_pool.terminate()
+      self._worker_pool.join()
+      self._worker_pool = None
 
   def get_state_key(self, state):
     """Returns a key for the information state."""
@@ -112,12 +337,31 @@ class ISMCTSBot(pyspiel.Bot):
     # ИСПРАВЛЕНО v1: Передаем player в information_state_string/observation_string
     if self._use_observation_string:
       return player, state.observation_string(player)
-    else:
-      return player, state.information_state_string(player)
+    if self._use_suit_isomorphism and hasattr(state, "canonical_information_state_key"):
+      return state.canonical_information_state_key(player)
+    # Компактный целочисленный ключ (уже включает игрока), если состояние его предоставляет
+    information_state_key = getattr(state, "information_state_key", None)
+    if information_state_key is not None:
+      return information_state_key(player)
+    return player, state.information_state_string(player)
+
+  def node_actions(self, state, legal_actions):
+    """Returns the action keys used in the tree and a map back to state actions.
+
+    Without suit isomorphism the tree uses the state's own actions and the map
+    is None. With it, children are keyed by the state's canonical actions, so
+    equivalent actions of isomorphic infostates share statistics.
+    """
+    if self._use_suit_isomorphism and hasattr(state, "canonical_actions"):
+      node_actions = list(state.canonical_actions(state.current_player()))
+      return node_actions, dict(zip(node_actions, legal_actions))
+    return legal_actions, None
 
   def run_search(self, state):
     """Runs an IS-MCTS search from the current state and returns the policy."""
-    self.reset()
+    start_time = time.monotonic()
+    self.last_search_info = ISMCTSSearchInfo(0, ISMCTSStopReason.NO_SEARCH, 0.0)
+    self._num_evicted = 0
     # Проверка на тип игры
     if state.get_game().get_type().dynamics != pyspiel.GameType.Dynamics.SEQUENTIAL:
         raise ValueError("ISMCTS requires sequential games.")
@@ -138,37 +382,39 @@ class ISMCTSBot(pyspiel.Bot):
     if len(legal_actions) == 1:
       return [(legal_actions[0], 1.0)]
 
-    # Создаем корневой узел для текущего инфостейта
-    self._root_node = self.lookup_or_create_node(state) # Используем lookup_or_create_node
-    if not self._root_node:
-        raise RuntimeError("Failed to create root node.") # Не должно происходить
-
-    root_infostate_key = self.get_state_key(state)
-
-    # Основной цикл симуляций
-    for sim_count in range(self._max_simulations):
-      # Сэмплируем полное состояние мира, совместимое с текущим инфостейтом
-      sampled_root_state = self.sample_root_state(state)
-      if not sampled_root_state:
-          raise RuntimeError(f"Simulation {sim_count+1}: Failed to sample root state.")
-
-      # Запускаем одну симуляцию из сэмплированного состояния
-      try:
-          self.run_simulation(sampled_root_state)
-      except Exception as e:
-          print(f"!!! Ошибка в симуляции {sim_count+1} !!!")
-          print(f"Исходное состояние:\n{state}")
-          print(f"Сэмплированное состояние перед симуляцией:\n{sampled_root_state}")
-          print(f"Ошибка: {e}")
-          traceback.print_exc() # Теперь traceback импортирован
-          print("Продолжение поиска после ошибки в симуляции...")
-          continue # Пропустить эту симуляцию
+    if self._opening_book is not None:
+      book_policy = self._opening_book.lookup(state)
+      if book_policy:
+        self.last_search_info = ISMCTSSearchInfo(0, ISMCTSStopReason.BOOK, 1000.0 * (time.monotonic() - start_time))
+        return book_policy
+
+    exact_policy = self._exact_endgame_policy(state, legal_actions)
+    if exact_policy is not None:
+      self.last_search_info = ISMCTSSearchInfo(0, ISMCTSStopReason.EXACT, 1000.0 * (time.monotonic() - start_time))
+      return exact_policy
+
+    num_simulations = self._max_simulations
+    deadline = None
+    if self._time_budget_ms is not None:
+      deadline = start_time + self._time_budget_ms / 1000.0
+      if num_simulations <= 0: num_simulations = np.iinfo(np.int64).max
+    if self._num_workers > 1:
+      self._root_node, simulations, stop_reason, num_nodes = self._run_root_parallel(state, num_simulations, deadline)
+    else:
+      self._prepare_tree(state)
+      # Создаем корневой узел для текущего инфостейта
+      self._root_node = self.lookup_or_create_node(state) # Используем lookup_or_create_node
+      if not self._root_node:
+          raise RuntimeError("Failed to create root node.") # Не должно происходить
+      simulations, stop_reason = self._run_simulations(state, num_simulations, deadline)
+      num_nodes = len(self._nodes)
+    self.last_search_info = ISMCTSSearchInfo(simulations, stop_reason, 1000.0 * (time.monotonic() - start_time), num_nodes, self._num_evicted)
 
     # Формируем финальную политику
     if self._allow_inconsistent_action_sets:
       # Перефильтровываем действия, если набор легальных действий мог измениться
       current_legal_actions = state.legal_actions(current_player_id) # Передаем ID
-      temp_node = self.filter_illegals(self._root_node, current_legal_actions)
+      temp_node = self.filter_illegals(self._root_node, self.node_actions(state, current_legal_actions)[0])
       if temp_node.total_visits <= 0:
           # Если все посещенные действия стали нелегальными, возвращаем равномерную политику
           print("Warning: All visited actions became illegal. Returning uniform policy.")
@@ -185,6 +431,247 @@ class ISMCTSBot(pyspiel.Bot):
       return self.get_final_policy(state, self._root_node)
 
 
+  def _exact_endgame_policy(self, state, legal_actions):
+    """Uniform policy over the best actions by exact values, or None if unavailable."""
+    if self._exact_endgame_max_outcomes is None or not hasattr(state, "exact_action_values"):
+      return None
+    values = state.exact_action_values(state.current_player(), self._exact_endgame_max_outcomes)
+    if values is None:
+      return None
+    best = values >= values.max() - TIE_TOLERANCE
+    prob = 1.0 / int(best.sum())
+    return [(action, prob if is_best else 0.0) for action, is_best in zip(legal_actions, best.tolist())]
+
+  def _run_simulations(self, state, num_simulations, deadline=None, early_stop=True):
+    """Runs up to num_simulations simulations from worlds sampled at the root state.
+
+    With a `deadline` (time.monotonic() seconds) the search also stops when it
+    passes, or (if `early_stop`) once the root decision is settled. Returns the
+    number of simulations run and the ISMCTSStopReason.
+    """
+    if self._num_tree_threads > 1:
+      return self._run_tree_parallel(state, num_simulations, deadline, early_stop)
+    start_time = time.monotonic()
+    for sim_count in range(0, num_simulations, self._eval_batch_size):
+      if deadline is not None:
+        stop_reason = self._check_stop(sim_count, num_simulations, start_time, deadline, early_stop)
+        if stop_reason is not None:
+          return sim_count, stop_reason
+      self._run_batch(state, sim_count, min(self._eval_batch_size, num_simulations - sim_count))
+    return num_simulations, ISMCTSStopReason.SIMULATION_LIMIT
+
+  def _run_batch(self, state, sim_count, num_simulations):
+    if self._eval_batch_size > 1:
+      self._run_simulation_batch(state, sim_count, num_simulations)
+    else:
+      self._run_one_simulation(state, sim_count)
+    if self._max_nodes is not None and len(self._nodes) > self._max_nodes:
+      with self._tree_lock: self._evict_nodes()
+
+  def _evict_nodes(self):
+    """Shrinks the node table below max_nodes by evicting the least-visited nodes (under the tree lock).
+
+    Runs between simulations, so the only descents in flight are those of other
+    tree threads. Their nodes are protected: the root, nodes holding virtual
+    losses, nodes awaiting batched priors and nodes not backed up yet (fewer
+    than one visit). An evicted node is recreated as a new leaf if the search
+    reaches it again, so the search loses its statistics but keeps running;
+    if too few nodes can be evicted the table stays over the limit.
+    """
+    target = max(0, self._max_nodes - int(self._max_nodes * NODE_EVICTION_FRACTION))
+    num_to_evict = len(self._nodes) - target
+    if num_to_evict <= 0:
+      return
+    root = getattr(self, "_root_node", None)
+    keys = [key for key, node in self._nodes.items()
+            if node is not root and node.total_visits >= 1 and node.total_virtual_losses == 0 and node not in self._pending_prior_nodes]
+    if not keys:
+      return
+    if num_to_evict < len(keys):
+      visits = np.fromiter((self._nodes[key].total_visits for key in keys), dtype=np.int64, count=len(keys))
+      keys = [keys[i] for i in np.argpartition(visits, num_to_evict)[:num_to_evict]]
+    for key in keys:
+      del self._nodes[key]
+    self._node_pool = list(self._nodes.values())
+    self._num_evicted += len(keys)
+
+  def _check_stop(self, sim_count, num_simulations, start_time, deadline, early_stop):
+    """Returns the reason to stop before simulation `sim_count`, or None."""
+    now = time.monotonic()
+    if now >= deadline:
+      return ISMCTSStopReason.TIME_BUDGET
+    # Проверка раз в EARLY_STOP_CHECK_INTERVAL симуляций: кратное интервалу попало в последний пакет
+    if (not early_stop or self._final_policy_type != ISMCTSFinalPolicyType.MAX_VISIT_COUNT
+        or sim_count == 0 or sim_count % EARLY_STOP_CHECK_INTERVAL >= self._eval_batch_size):
+      return None
+    root_visits = self._root_node.visits
+    if len(root_visits) < 2:
+      return None
+    # Оставшиеся симуляции: по лимиту и по текущей скорости до дедлайна
+    remaining = min(num_simulations - sim_count, sim_count * (deadline - now) / max(now - start_time, 1e-9))
+    second, first = np.partition(root_visits, -2)[-2:]
+    return ISMCTSStopReason.DECIDED if first - second > remaining else None
+
+  def _sample_simulation_root(self, state, sim_count):
+    # Сэмплируем полное состояние мира, совместимое с текущим инфостейтом
+    if self._num_tree_threads > 1 and (self._max_world_samples != UNLIMITED_NUM_WORLD_SAMPLES or self._uses_world_pool(state)):
+      with self._tree_lock: sampled_root_state = self.sample_root_state(state)
+    else:
+      sampled_root_state = self.sample_root_state(state)
+    if not sampled_root_state:
+        raise RuntimeError(f"Simulation {sim_count+1}: Failed to sample root state.")
+    return sampled_root_state
+
+  def _run_one_simulation(self, state, sim_count):
+    sampled_root_state = self._sample_simulation_root(state, sim_count)
+
+    # Запускаем одну симуляцию из сэмплированного состояния
+    try:
+        self.run_simulation(sampled_root_state)
+    except Exception as e:
+        print(f"!!! Ошибка в симуляции {sim_count+1} !!!")
+        print(f"Исходное состояние:\n{state}")
+        print(f"Сэмплированное состояние на момент ошибки:\n{sampled_root_state}")
+        print(f"Ошибка: {e}")
+        traceback.print_exc() # Теперь traceback импортирован
+        print("Продолжение поиска после ошибки в симуляции...") # Пропустить эту симуляцию
+
+  def _run_simulation_batch(self, state, sim_count, num_simulations):
+    """Runs num_simulations simulations whose leaves are evaluated together.
+
+    The descents are made one after another, each leaving virtual loss on its
+    path so that the next one explores elsewhere. New nodes get their priors
+    from one prior_batch call and the leaves are scored by one evaluate_batch
+    call, then all paths are backed up.
+    """
+    descents = []; new_nodes = []
+    for i in range(num_simulations):
+      try:
+        descents.append(self._descend(self._sample_simulation_root(state, sim_count + i), self._path_stack(len(descents)), new_nodes))
+      except Exception as e:
+        print(f"!!! Ошибка в симуляции {sim_count+i+1} !!!")
+        print(f"Ошибка: {e}")
+        traceback.print_exc()
+    if new_nodes:
+      priors = self._batch_priors([node_state for _, node_state in new_nodes])
+      with self._tree_lock:
+        for (node, node_state), node_priors in zip(new_nodes, priors):
+          self._set_node_priors(node, node_state, node_priors); self._pending_prior_nodes.discard(node)
+    leaves = [i for i, (_, leaf_state, _) in enumerate(descents) if leaf_state is not None]
+    try:
+      leaf_returns = self._batch_evaluate([descents[i][1] for i in leaves])
+    except Exception as e:
+      print(f"Ошибка при пакетной оценке листьев: {e}")
+      traceback.print_exc()
+      with self._tree_lock:
+        for path, _, _ in descents: self._revert_path(path)
+      return
+    returns = [path_returns for _, _, path_returns in descents]
+    for i, leaf_value in zip(leaves, leaf_returns): returns[i] = leaf_value
+    with self._tree_lock:
+      for (path, _, _), path_returns in zip(descents, returns): self._backup_path(path, path_returns, True)
+
+  def _batch_evaluate(self, states):
+    if not states: return []
+    evaluate_batch = getattr(self._evaluator, "evaluate_batch", None)
+    if evaluate_batch is not None: return evaluate_batch(states)
+    return [self._evaluator.evaluate(leaf_state) for leaf_state in states]
+
+  def _batch_priors(self, states):
+    """Priors of `states` from prior_batch (or prior); None entries on failure."""
+    try:
+      prior_batch = getattr(self._evaluator, "prior_batch", None)
+      if prior_batch is not None: return prior_batch(states)
+      return [self._evaluator.prior(node_state) for node_state in states]
+    except Exception as e:
+      print(f"Ошибка при вызове evaluator.prior_batch(): {e}")
+      return [None] * len(states)
+
+  def _run_tree_parallel(self, state, num_simulations, deadline=None, early_stop=True):
+    """Runs the simulations in num_tree_threads threads sharing one tree.
+
+    Only the evaluator's GIL-free time overlaps between threads (hence the
+    releases_gil requirement); descents, backups and state updates stay serial.
+    """
+    # next() на itertools.count атомарен под GIL; потоки берут симуляции пакетами по eval_batch_size
+    batch_counter = itertools.count(); completed_counter = itertools.count(); stop_reasons = []
+    start_time = time.monotonic(); batch_size = self._eval_batch_size
+
+    def worker():
+      for batch_index in iter(batch_counter.__next__, None):
+        sim_count = batch_index * batch_size
+        if sim_count >= num_simulations or stop_reasons:
+          return
+        if deadline is not None:
+          stop_reason = self._check_stop(sim_count, num_simulations, start_time, deadline, early_stop)
+          if stop_reason is not None:
+            stop_reasons.append(stop_reason)
+            return
+        num_batch = min(batch_size, num_simulations - sim_count)
+        self._run_batch(state, sim_count, num_batch)
+        for _ in range(num_batch): next(completed_counter)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(self._num_tree_threads)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    return next(completed_counter), stop_reasons[0] if stop_reasons else ISMCTSStopReason.SIMULATION_LIMIT
+
+  def _worker_config(self):
+    """Constructor arguments for the single-process bots run by pool workers."""
+    return dict(evaluator=self._evaluator, uct_c=self._uct_c, max_simulations=0,
+                max_world_samples=self._max_world_samples, final_policy_type=self._final_policy_type,
+                use_observation_string=self._use_observation_string,
+                allow_inconsistent_action_sets=self._allow_inconsistent_action_sets,
+                child_selection_policy=self._child_selection_policy,
+                use_suit_isomorphism=self._use_suit_isomorphism,
+                num_tree_threads=self._num_tree_threads, virtual_loss=self._virtual_loss,
+                reuse_tree=False, widening_c=self._widening_c, widening_alpha=self._widening_alpha,
+                eval_batch_size=self._eval_batch_size, world_pool_size=self._world_pool_size, max_nodes=self._max_nodes)
+
+  def _get_worker_pool(self, state):
+    if self._worker_pool is None:
+      worker_modules = self._worker_modules
+      if worker_modules is None:
+        worker_modules = sorted({type(state).__module__, type(self._evaluator).__module__} - {"__main__", "builtins"})
+      self._worker_pool = multiprocessing.Pool(
+          self._num_workers, initializer=_init_root_parallel_worker,
+          initargs=(list(worker_modules), self._worker_config(), self._resampler_cb))
+    return self._worker_pool
+
+  def _run_root_parallel(self, state, num_simulations, deadline=None):
+    """Runs independent searches in the worker pool and merges their roots.
+
+    Returns the merged root, the total number of simulations and the stop reason.
+    """
+    pool = self._get_worker_pool(state)
+    shares = [num_simulations // self._num_workers] * self._num_workers
+    for i in range(num_simulations % self._num_workers):
+      shares[i] += 1
+    seeds = self._random_state.randint(np.iinfo(np.int32).max, size=self._num_workers)
+    # time.monotonic() общий для процессов, поэтому дедлайн передается как есть
+    results = pool.starmap(_root_parallel_search, [(state, n, int(seed), deadline) for n, seed in zip(shares, seeds) if n > 0])
+
+    merged = ISMCTSNode(); simulations = 0; stop_reason = ISMCTSStopReason.SIMULATION_LIMIT; num_nodes = 0
+    for (actions, visits, return_sums, priors, total_visits), worker_simulations, worker_stop_reason, (worker_nodes, worker_evicted) in results:
+      simulations += worker_simulations; num_nodes += worker_nodes; self._num_evicted += worker_evicted
+      if worker_stop_reason == ISMCTSStopReason.TIME_BUDGET: stop_reason = worker_stop_reason
+      merged.prior_map.update(zip(actions, priors))
+      merged.add_actions(actions)
+      ids = np.array([merged.action_ids[a] for a in actions], dtype=np.int64)
+      np.add.at(merged.visits, ids, visits)
+      np.add.at(merged.return_sums, ids, return_sums)
+      merged.priors[ids] = priors
+      merged.expanded[ids] = True
+      merged.total_visits += total_visits
+    merged.num_expanded = int(merged.expanded.sum())
+    return merged, simulations, stop_reason, num_nodes
+
+  def root_statistics(self):
+    """Returns (actions, visits, return_sums, priors, total_visits) of the root's expanded children."""
+    root = self._root_node
+    ids = root.expanded_ids()
+    return ([root.actions[i] for i in ids], root.visits[ids], root.return_sums[ids], root.priors[ids], max(0, root.total_visits))
+
   def step(self, state):
     """Returns the action selected by the bot."""
     policy = self.run_search(state)
@@ -232,45 +719,39 @@ class ISMCTSBot(pyspiel.Bot):
     current_player_id = state.current_player()
     legal_actions = state.legal_actions(current_player_id) if current_player_id >= 0 else []
     num_legal = len(legal_actions)
+    legal_node_actions, to_state_action = self.node_actions(state, legal_actions)
 
     if node.total_visits <= 0:
         print("Warning: get_final_policy called on node with zero visits. Returning uniform policy.")
         return [(a, 1.0 / num_legal) for a in legal_actions] if num_legal > 0 else []
 
-    policy = []
+    ids = node.expanded_ids(); visits = node.visits[ids]
     if (self._final_policy_type == ISMCTSFinalPolicyType.NORMALIZED_VISITED_COUNT):
-      total_visits = node.total_visits
-      policy = [(action, child.visits / total_visits) for action, child in node.child_info.items() if child.visits > 0]
+      visited = visits > 0
+      ids, probs = ids[visited], visits[visited] / node.total_visits
     elif self._final_policy_type == ISMCTSFinalPolicyType.MAX_VISIT_COUNT:
-      max_visits = -1; best_actions = []
-      for action, child in node.child_info.items():
-          if child.visits > max_visits: max_visits = child.visits; best_actions = [action]
-          elif child.visits == max_visits: best_actions.append(action)
-      count = len(best_actions)
-      policy = [(action, 1. / count if action in best_actions else 0.0) for action, child in node.child_info.items()]
+      best = visits == visits.max() if len(ids) else visits > 0
+      probs = best / max(1, best.sum())
     elif self._final_policy_type == ISMCTSFinalPolicyType.MAX_VALUE:
-      max_value = -float('inf'); best_actions = []
-      for action, child in node.child_info.items():
-          if child.visits > 0:
-              val = child.value()
-              if val > max_value: max_value = val
-      for action, child in node.child_info.items():
-           if child.visits > 0 and child.value() >= max_value - TIE_TOLERANCE: best_actions.append(action)
-      count = len(best_actions)
-      policy = [(action, 1. / count if action in best_actions else 0.0) for action, child in node.child_info.items()]
+      visited = visits > 0; values = node.values(ids)
+      best = visited & (values >= values[visited].max() - TIE_TOLERANCE) if visited.any() else visited
+      probs = best / max(1, best.sum())
+    policy = [(node.actions[i], p) for i, p in zip(ids.tolist(), probs.tolist())]
 
     policy_actions = {a for a, p in policy}
-    for action in legal_actions:
+    for action in legal_node_actions:
         if action not in policy_actions: policy.append((action, 0.0))
 
     prob_sum = sum(p for a, p in policy)
     if prob_sum > 0 and not np.isclose(prob_sum, 1.0): policy = [(a, p / prob_sum) for a, p in policy]
-    elif prob_sum == 0 and num_legal > 0: policy = [(a, 1.0 / num_legal) for a in legal_actions]
+    elif prob_sum == 0 and num_legal > 0: policy = [(a, 1.0 / num_legal) for a in legal_node_actions]
 
+    if to_state_action is not None: policy = [(to_state_action[a], p) for a, p in policy if a in to_state_action]
     return policy
 
   def sample_root_state(self, state):
     """Samples a world state consistent with the information state."""
+    if self._uses_world_pool(state): return self._sample_from_world_pool(state)
     if self._max_world_samples == UNLIMITED_NUM_WORLD_SAMPLES: return self.resample_from_infostate(state)
     elif len(self._root_samples) < self._max_world_samples:
       new_sample = self.resample_from_infostate(state); self._root_samples.append(new_sample); return new_sample.clone()
@@ -278,6 +759,27 @@ class ISMCTSBot(pyspiel.Bot):
       idx = self._random_state.randint(len(self._root_samples)); return self._root_samples[idx].clone()
     else: raise pyspiel.SpielError('Case not handled (badly set max_world_samples..?)')
 
+  def _uses_world_pool(self, state):
+    return self._resampler_cb is None and self._world_pool_size > 0 and hasattr(state, "world_pool")
+
+  def _sample_from_world_pool(self, state):
+    """Next world of the pool for `state`, drawing a new pool when it runs out.
+
+    With max_world_samples the pool holds exactly that many worlds: they are
+    handed out in order once, then uniformly at random, as with _root_samples.
+    """
+    limited = self._max_world_samples != UNLIMITED_NUM_WORLD_SAMPLES
+    pool = self._world_pool
+    if pool is None or pool.state is not state or (not limited and self._world_pool_next >= len(pool)):
+      pool_size = self._max_world_samples if limited else self._world_pool_size
+      pool = self._world_pool = state.world_pool(state.current_player(), pool_size, self._random_state)
+      self._world_pool_next = 0
+    if self._world_pool_next < len(pool):
+      idx = self._world_pool_next; self._world_pool_next += 1
+    else:
+      idx = self._random_state.randint(len(pool))
+    return pool.world(idx)
+
   def resample_from_infostate(self, state):
     """Calls the state's resample method or a custom callback."""
     if self._resampler_cb: return self._resampler_cb(state, state.current_player())
@@ -286,52 +788,74 @@ class ISMCTSBot(pyspiel.Bot):
       except AttributeError: print(f"Ошибка: Объект состояния {type(state)} не имеет метода resample_from_infostate."); raise
       except Exception as e: print(f"Ошибка при вызове state.resample_from_infostate: {e}"); raise
 
-  def create_new_node(self, state):
-    """Creates a new node in the tree."""
+  def create_new_node(self, state, defer_priors=False):
+    """Creates a new node in the tree.
+
+    With `defer_priors` the node is left without priors and actions; the caller
+    sets them later with _set_node_priors (batched leaf evaluation).
+    """
     infostate_key = self.get_state_key(state)
     if infostate_key in self._nodes: print(f"Warning: Node for key {infostate_key} already exists in create_new_node."); return self._nodes[infostate_key]
     new_node = ISMCTSNode(); self._node_pool.append(new_node); self._nodes[infostate_key] = new_node; new_node.total_visits = UNEXPANDED_VISIT_COUNT
-    if not state.is_terminal():
-        try:
-            priors = self._evaluator.prior(state)
-            if not isinstance(priors, list) or not all(isinstance(p, tuple) and len(p) == 2 for p in priors):
-                 print(f"Warning: Evaluator prior() returned unexpected format: {priors}. Expected list of (action, prob) tuples.")
-                 if isinstance(priors, list) and all(isinstance(a, int) for a in priors):
-                     num_actions = len(priors); priors = [(a, 1.0/num_actions) for a in priors] if num_actions > 0 else []
-                 else: priors = []
-            new_node.prior_map = {action: prob for action, prob in priors}
-            prob_sum = sum(new_node.prior_map.values())
-            if prob_sum > 0 and not np.isclose(prob_sum, 1.0):
-                print(f"Warning: Priors sum to {prob_sum}, renormalizing.")
-                for action in new_node.prior_map: new_node.prior_map[action] /= prob_sum
-        except Exception as e:
-            print(f"Ошибка при вызове evaluator.prior(): {e}")
-            # ИСПРАВЛЕНО v2: Передаем player_id в legal_actions
-            current_player_id = state.current_player()
-            legal_actions = state.legal_actions(current_player_id) if current_player_id >= 0 else []
-            num_legal = len(legal_actions)
-            new_node.prior_map = {action: 1.0 / num_legal for action in legal_actions} if num_legal > 0 else {}
+    if not state.is_terminal() and not defer_priors:
+        try: priors = self._evaluator.prior(state)
+        except Exception as e: print(f"Ошибка при вызове evaluator.prior(): {e}"); priors = None
+        self._set_node_priors(new_node, state, priors)
     return new_node
 
+  def _set_node_priors(self, new_node, state, priors):
+    """Fills the node's prior_map (uniform if `priors` is None) and registers the legal actions."""
+    if state.is_terminal(): return
+    if priors is not None:
+        try: new_node.prior_map = self._prior_map(state, priors)
+        except Exception as e: print(f"Ошибка при разборе priors: {e}"); priors = None
+    if priors is None:
+        # ИСПРАВЛЕНО v2: Передаем player_id в legal_actions
+        current_player_id = state.current_player()
+        legal_actions = state.legal_actions(current_player_id) if current_player_id >= 0 else []
+        legal_actions = self.node_actions(state, legal_actions)[0]; num_legal = len(legal_actions)
+        new_node.prior_map = {action: 1.0 / num_legal for action in legal_actions} if num_legal > 0 else {}
+    current_player_id = state.current_player()
+    if current_player_id >= 0:
+        new_node.add_actions(self.node_actions(state, state.legal_actions(current_player_id))[0])
+
+  def _prior_map(self, state, priors):
+    """Validates the evaluator's [(action, prob)] priors and returns them as {node action: prob}."""
+    if not isinstance(priors, list) or not all(isinstance(p, tuple) and len(p) == 2 for p in priors):
+         print(f"Warning: Evaluator prior() returned unexpected format: {priors}. Expected list of (action, prob) tuples.")
+         if isinstance(priors, list) and all(isinstance(a, int) for a in priors):
+             num_actions = len(priors); priors = [(a, 1.0/num_actions) for a in priors] if num_actions > 0 else []
+         else: priors = []
+    if self._use_suit_isomorphism and hasattr(state, "canonical_actions"):
+        to_node_action = dict(zip(state.legal_actions(state.current_player()), state.canonical_actions(state.current_player())))
+        priors = [(to_node_action[action], prob) for action, prob in priors if action in to_node_action]
+    prior_map = {action: prob for action, prob in priors}
+    prob_sum = sum(prior_map.values())
+    if prob_sum > 0 and not np.isclose(prob_sum, 1.0):
+        print(f"Warning: Priors sum to {prob_sum}, renormalizing.")
+        for action in prior_map: prior_map[action] /= prob_sum
+    return prior_map
+
   def set_resampler(self, cb): self._resampler_cb = cb
   def lookup_node(self, state): key = self.get_state_key(state); return self._nodes.get(key, None)
   def lookup_or_create_node(self, state): node = self.lookup_node(state); return node if node else self.create_new_node(state)
 
   def filter_illegals(self, node, legal_actions):
-    new_node = copy.deepcopy(node); legal_action_set = set(legal_actions); actions_to_remove = []
-    for action, child in node.child_info.items():
-      if action not in legal_action_set: new_node.total_visits -= child.visits; actions_to_remove.append(action)
-    for action in actions_to_remove:
-         del new_node.child_info[action]
-         if action in new_node.prior_map: del new_node.prior_map[action]
+    new_node = node.copy(); legal_action_set = set(legal_actions)
+    for child_id in node.expanded_ids():
+      action = node.actions[child_id]
+      if action not in legal_action_set:
+        new_node.total_visits -= node.visits[child_id]; new_node.expanded[child_id] = False; new_node.num_expanded -= 1
+        if action in new_node.prior_map: del new_node.prior_map[action]
     new_node.total_visits = max(0, new_node.total_visits); return new_node
 
   def expand_if_necessary(self, node, action):
-    if action not in node.child_info:
+    child_id = node.action_id(action)
+    if not node.expanded[child_id]:
       prior = node.prior_map.get(action, 0.0)
       if prior == 0.0 and node.prior_map: print(f"Warning: Action {action} not found in prior_map during expansion. Using prior=0.")
-      elif not node.prior_map and not node.child_info: num_children = len(node.child_info) if node.child_info else 1; prior = 1.0 / num_children if num_children > 0 else 1.0
-      node.child_info[action] = ChildInfo(0.0, 0.0, prior)
+      elif not node.prior_map and node.num_expanded == 0: prior = 1.0
+      node.priors[child_id] = prior; node.expanded[child_id] = True; node.num_expanded += 1
 
   def select_action_tree_policy(self, node, legal_actions):
     if self._allow_inconsistent_action_sets:
@@ -341,116 +865,261 @@ class ISMCTSBot(pyspiel.Bot):
       else: return self.select_action(temp_node)
     else: return self.select_action(node)
 
-  def _action_value(self, node, child):
-    if child.visits == 0:
-        if self._child_selection_policy == ChildSelectionPolicy.PUCT: sqrt_total_visits = np.sqrt(max(1, node.total_visits)); return self._uct_c * child.prior * sqrt_total_visits
-        else: return 0.0
-    action_value = child.value(); exploration_term = 0.0
-    if self._child_selection_policy == ChildSelectionPolicy.UCT: exploration_term = self._uct_c * np.sqrt(np.log(node.total_visits) / child.visits)
-    elif self._child_selection_policy == ChildSelectionPolicy.PUCT: exploration_term = (self._uct_c * child.prior * np.sqrt(node.total_visits) / (1 + child.visits))
+  def _action_values(self, node, ids):
+    """UCT/PUCT scores of the children `ids`, computed as one vector operation.
+
+    Pending descents count as visits that returned -virtual_loss each, so
+    concurrent simulations are pushed towards different children.
+    """
+    visits = node.visits[ids]; total_visits = node.total_visits
+    if node.total_virtual_losses:
+      pending = node.virtual_losses[ids]
+      visits = visits + pending; total_visits += node.total_virtual_losses
+      values = np.where(visits > 0, (node.return_sums[ids] - self._virtual_loss * pending) / np.maximum(visits, 1), 0.0)
+    else:
+      values = node.values(ids)
+    unvisited = visits == 0
+    if self._child_selection_policy == ChildSelectionPolicy.PUCT:
+      exploration = self._uct_c * node.priors[ids] * np.sqrt(max(1, total_visits)) / (1 + visits)
+    elif self._child_selection_policy == ChildSelectionPolicy.UCT:
+      exploration = np.where(unvisited, 0.0, self._uct_c * np.sqrt(np.log(max(1, total_visits)) / np.maximum(visits, 1)))
     else: raise pyspiel.SpielError('Child selection policy unrecognized.')
-    return action_value + exploration_term
+    return values + exploration
 
   def _select_candidate_actions(self, node):
-    """Selects the best action(s) based on the policy value."""
-    candidates = []
-    max_action_value = -float('inf')
-
-    # Находим максимальное значение среди всех дочерних узлов
-    for child in node.child_info.values():
-        value = self._action_value(node, child)
-        # ИСПРАВЛЕН ОТСТУП v3:
-        if value > max_action_value:
-            max_action_value = value
-
-    # Выбираем все действия, значение которых близко к максимальному
-    for action, child in node.child_info.items():
-      if self._action_value(node, child) >= max_action_value - TIE_TOLERANCE:
-        candidates.append(action)
-
-    # Если кандидатов нет (например, все значения -inf), возвращаем пустой список
-    return candidates
-
+    """Selects the ids of the best child(ren) based on the policy value."""
+    ids = node.expanded_ids()
+    if len(ids) == 0:
+      return ids
+    values = self._action_values(node, ids)
+    return ids[values >= values.max() - TIE_TOLERANCE]
 
   def select_action(self, node):
     """Selects an action from the node, breaking ties randomly."""
-    if not node.child_info:
+    if node.num_expanded == 0:
         print("Warning: select_action called on node with no children.")
         return pyspiel.INVALID_ACTION
     candidates = self._select_candidate_actions(node)
-    if not candidates:
+    if len(candidates) == 0:
         print("Warning: No candidate actions found in select_action. Selecting random child.")
-        candidates = list(node.child_info.keys())
-        # ИСПРАВЛЕН ОТСТУП v4:
-        if not candidates: # Check if still empty after getting all keys
-            return pyspiel.INVALID_ACTION
-    return candidates[self._random_state.randint(len(candidates))]
-
+        candidates = node.expanded_ids()
+    return node.actions[candidates[self._random_state.randint(len(candidates))]]
 
   def check_expand(self, node, legal_actions):
     """Checks if the node needs expansion and returns an action to expand."""
+    if self._widening_c is not None:
+      return self._check_expand_widening(node, legal_actions)
     if not self._allow_inconsistent_action_sets:
-        if len(node.child_info) == len(legal_actions): return pyspiel.INVALID_ACTION
-    legal_actions_set = set(legal_actions); current_actions_set = set(node.child_info.keys()); missing_actions = list(legal_actions_set - current_actions_set)
+        if node.num_expanded == len(legal_actions): return pyspiel.INVALID_ACTION
+        if len(node.actions) == len(legal_actions):
+          # Все легальные действия уже зарегистрированы в узле: выбираем среди нераскрытых без построения множеств
+          unexpanded = np.flatnonzero(~node.expanded & (node.priors > 0)) if self._skips_zero_priors(node) else np.flatnonzero(~node.expanded)
+          if len(unexpanded) == 0: return pyspiel.INVALID_ACTION
+          return node.actions[unexpanded[self._random_state.randint(len(unexpanded))]]
+    missing_actions = [a for a in legal_actions if not node.is_expanded(a)]
+    if self._skips_zero_priors(node): missing_actions = [a for a in missing_actions if node.prior_map.get(a, 0.0) > 0]
     if not missing_actions: return pyspiel.INVALID_ACTION
-    else: return missing_actions[self._random_state.randint(len(missing_actions))]
-
-  def run_simulation(self, state):
-    """Runs a simulation from the given state, updating the tree."""
-    if state.is_terminal(): return state.returns()
-    if state.is_chance_node():
-      # ИСПРАВЛЕНО v3: Используем try-except для chance_outcomes
-      try:
-          outcomes_with_probs = state.chance_outcomes()
-      except Exception as e:
-          print(f"Ошибка при вызове state.chance_outcomes(): {e}")
-          print(f"Состояние:\n{state}")
-          # Возвращаем 0, так как не можем продолжить
-          return np.zeros(self._game.num_players())
-
-      if not outcomes_with_probs: print(f"Warning: Chance node with no outcomes at state:\n{state}"); return np.zeros(self._game.num_players())
-      action_list, prob_list = zip(*outcomes_with_probs); prob_sum = sum(prob_list)
-      if not np.isclose(prob_sum, 1.0): print(f"Warning: Chance outcome probabilities sum to {prob_sum}, renormalizing."); prob_list = np.array(prob_list) / prob_sum
-      chance_action = self._random_state.choice(action_list, p=prob_list)
-      next_state = state.clone(); next_state.apply_action(chance_action); return self.run_simulation(next_state)
-
-    cur_player = state.current_player()
-    # ИСПРАВЛЕНО v2: Передаем player_id в legal_actions
-    legal_actions = state.legal_actions(cur_player)
-    if not legal_actions: print(f"Warning: No legal actions for player {cur_player} in non-terminal state:\n{state}"); return np.zeros(self._game.num_players())
-
-    node = self.lookup_or_create_node(state)
-    if not node: raise RuntimeError(f"Failed to lookup or create node for state:\n{state}")
-
-    returns = np.zeros(self._game.num_players())
+    return missing_actions[self._random_state.randint(len(missing_actions))]
+
+  def _skips_zero_priors(self, node):
+    """PUCT never explores children without prior, so they are not expanded either.
+
+    This lets an evaluator give priors to a few of many legal actions (e.g. the
+    Fantasyland solver's arrangements among about a million placements).
+    """
+    return self._child_selection_policy == ChildSelectionPolicy.PUCT and bool(node.prior_map)
+
+  def _check_expand_widening(self, node, legal_actions):
+    """Progressive widening: returns the next child by prior while under the limit."""
+    limit = int(np.ceil(self._widening_c * (max(0, node.total_visits) + 1) ** self._widening_alpha))
+    if node.num_expanded >= min(limit, len(legal_actions)): return pyspiel.INVALID_ACTION
+    if self._allow_inconsistent_action_sets or len(node.actions) < len(legal_actions): node.add_actions(legal_actions)
+    if node.widening_order is None or len(node.widening_order) != len(node.actions):
+      # Порядок по убыванию prior, равные prior - в случайном порядке
+      node.widening_order = np.lexsort((self._random_state.random_sample(len(node.actions)), -node.priors))
+    legal_action_set = set(legal_actions) if self._allow_inconsistent_action_sets else None
+    for child_id in node.widening_order:
+      if not node.expanded[child_id] and (legal_action_set is None or node.actions[child_id] in legal_action_set):
+        return node.actions[child_id]
+    return pyspiel.INVALID_ACTION
+
+  def _apply_chance_outcome(self, state):
+    """Advances the chance node `state` in place by a sampled outcome; False if it has none.
+
+    A state with sample_chance_outcome(rng) draws the outcome itself (e.g. from
+    its deck) with the bot's random state; otherwise it is sampled from
+    chance_outcomes().
+    """
+    sample_chance_outcome = getattr(state, "sample_chance_outcome", None)
+    if sample_chance_outcome is not None:
+      state.apply_action(sample_chance_outcome(self._random_state)); return True
+    # ИСПРАВЛЕНО v3: Используем try-except для chance_outcomes
+    try:
+        outcomes_with_probs = state.chance_outcomes()
+    except Exception as e:
+        print(f"Ошибка при вызове state.chance_outcomes(): {e}")
+        print(f"Состояние:\n{state}")
+        return False
+
+    if not outcomes_with_probs: print(f"Warning: Chance node with no outcomes at state:\n{state}"); return False
+    action_list, prob_list = zip(*outcomes_with_probs); prob_sum = sum(prob_list)
+    if not np.isclose(prob_sum, 1.0): print(f"Warning: Chance outcome probabilities sum to {prob_sum}, renormalizing."); prob_list = np.array(prob_list) / prob_sum
+    state.apply_action(self._random_state.choice(action_list, p=prob_list)); return True
+
+  def _select_step(self, state, legal_actions, parent, use_virtual_loss, new_nodes=None):
+    """Tree part of a simulation step at a decision node, done under the tree lock.
+
+    Returns (node, chosen_action, is_new_leaf, expanding); chosen_action is a
+    node action (INVALID_ACTION at a new leaf) and carries a virtual loss if
+    `use_virtual_loss`. With `new_nodes` a created node gets no priors yet: it
+    is appended there with its state, and until its priors are set further
+    descents into it stop at it as at a new leaf.
+    """
     chosen_action = pyspiel.INVALID_ACTION # Инициализация
-
-    if node.total_visits == UNEXPANDED_VISIT_COUNT:
-      node.total_visits = 0
-      returns = self._evaluator.evaluate(state)
-    else:
-      chosen_action = self.check_expand(node, legal_actions)
-      if chosen_action != pyspiel.INVALID_ACTION:
-        self.expand_if_necessary(node, chosen_action)
-        next_state = state.clone(); next_state.apply_action(chosen_action)
-        returns = self._evaluator.evaluate(next_state)
+    is_new_leaf = expanding = False
+    # Выбор под блокировкой дерева (при одном потоке она не конкурентна)
+    with self._tree_lock:
+      infostate_key = self.get_state_key(state)
+      node = self._nodes.get(infostate_key)
+      if node is None:
+        node = self.create_new_node(state, defer_priors=new_nodes is not None)
+        if new_nodes is not None:
+          new_nodes.append((node, state)); self._pending_prior_nodes.add(node)
+      if self._reuse_tree and parent is not None: parent.child_keys.add(infostate_key)
+      if not node: raise RuntimeError(f"Failed to lookup or create node for state:\n{state}")
+      if node.total_visits == UNEXPANDED_VISIT_COUNT:
+        node.total_visits = 0; is_new_leaf = True
+      elif node in self._pending_prior_nodes:
+        is_new_leaf = True
       else:
-        chosen_action = self.select_action_tree_policy(node, legal_actions)
-        if chosen_action == pyspiel.INVALID_ACTION:
-             print(f"Warning: select_action_tree_policy returned INVALID_ACTION for node:\n{state}")
-             chosen_action = self._random_state.choice(legal_actions)
-             self.expand_if_necessary(node, chosen_action)
-        next_state = state.clone(); next_state.apply_action(chosen_action)
-        returns = self.run_simulation(next_state)
-
-    # Обратное распространение
+        chosen_action = self.check_expand(node, legal_actions)
+        expanding = chosen_action != pyspiel.INVALID_ACTION
+        if expanding:
+          self.expand_if_necessary(node, chosen_action)
+        else:
+          chosen_action = self.select_action_tree_policy(node, legal_actions)
+          if chosen_action == pyspiel.INVALID_ACTION:
+               print(f"Warning: select_action_tree_policy returned INVALID_ACTION for node:\n{state}")
+               chosen_action = legal_actions[self._random_state.randint(len(legal_actions))]
+               self.expand_if_necessary(node, chosen_action)
+        if use_virtual_loss:
+          node.virtual_losses[node.action_ids[chosen_action]] += 1; node.total_virtual_losses += 1
+    return node, chosen_action, is_new_leaf, expanding
+
+  def _remove_virtual_loss(self, node, chosen_action):
+    node.virtual_losses[node.action_ids[chosen_action]] -= 1; node.total_virtual_losses -= 1
+
+  def _revert_path(self, path):
+    """Removes the virtual losses of an abandoned descent (under the tree lock)."""
+    for i in range(path.depth):
+      if path.actions[i] != pyspiel.INVALID_ACTION: self._remove_virtual_loss(path.nodes[i], path.actions[i])
+
+  def _backup_path(self, path, returns, use_virtual_loss):
+    """Backs up `returns` along the path, leaf first (under the tree lock)."""
+    nodes = path.nodes; actions = path.actions; players = path.players
+    for i in range(path.depth - 1, -1, -1):
+      self._backup_step(nodes[i], actions[i], players[i], returns, use_virtual_loss)
+
+  def _path_stack(self, index=0):
+    """The calling thread's index-th PathStack (a batch keeps several descents alive)."""
+    stacks = getattr(self._path_stacks, "stacks", None)
+    if stacks is None: stacks = self._path_stacks.stacks = []
+    while len(stacks) <= index: stacks.append(PathStack(self._game.max_game_length()))
+    return stacks[index]
+
+  def _backup_step(self, node, chosen_action, cur_player, returns, use_virtual_loss):
+    """Backs up `returns` into one node of the path (under the tree lock)."""
     node.total_visits += 1
     if chosen_action != pyspiel.INVALID_ACTION:
-        if chosen_action not in node.child_info:
+        if not node.is_expanded(chosen_action):
              print(f"Warning: Child info for action {chosen_action} not found during backpropagation. Creating with prior=0.")
              self.expand_if_necessary(node, chosen_action)
-        node.child_info[chosen_action].visits += 1
-        if len(returns) > cur_player: node.child_info[chosen_action].return_sum += returns[cur_player]
+        child_id = node.action_ids[chosen_action]
+        if use_virtual_loss:
+          node.virtual_losses[child_id] -= 1; node.total_virtual_losses -= 1
+        node.visits[child_id] += 1
+        if len(returns) > cur_player: node.return_sums[child_id] += returns[cur_player]
         else: print(f"Warning: 'returns' array too short ({len(returns)}) for player {cur_player}. Using 0.")
 
+  def _descend(self, state, path, new_nodes=None, parent=None, use_virtual_loss=True):
+    """Selection part of a simulation: walks from a sampled world to a leaf.
+
+    The world `state` is advanced in place, so it must not be shared. The
+    (node, action, player) steps to back up are written into the PathStack
+    `path`, with virtual loss on their actions if `use_virtual_loss`. Returns
+    (path, leaf_state, returns): either leaf_state still has to be evaluated,
+    or returns are already known (terminal state). `parent` is the node the
+    walk continues from, if any.
+    """
+    path.depth = 0; capacity = len(path.nodes)
+    try:
+      while True:
+        if state.is_terminal(): return path, None, state.returns()
+        if state.is_chance_node():
+          if not self._apply_chance_outcome(state): return path, None, self._zero_returns
+          continue
+        cur_player = state.current_player()
+        legal_actions = state.legal_actions(cur_player)
+        if not legal_actions: print(f"Warning: No legal actions for player {cur_player} in non-terminal state:\n{state}"); return path, None, self._zero_returns
+        if path.depth == capacity: raise ValueError(f"Simulation is longer than max_game_length ({capacity} decisions)")
+        legal_actions, to_state_action = self.node_actions(state, legal_actions)
+        node, chosen_action, is_new_leaf, expanding = self._select_step(state, legal_actions, parent, use_virtual_loss, new_nodes)
+        depth = path.depth; path.nodes[depth] = node; path.actions[depth] = chosen_action; path.players[depth] = cur_player; path.depth = depth + 1
+        if is_new_leaf: return path, state, None
+        state.apply_action(to_state_action[chosen_action] if to_state_action is not None else chosen_action)
+        if expanding: return path, state, None
+        parent = node
+    except Exception:
+      if use_virtual_loss:
+        with self._tree_lock: self._revert_path(path)
+      raise
+
+  @property
+  def _zero_returns(self):
+    return (0.0,) * self._game.num_players()
+
+  def run_simulation(self, state, parent=None):
+    """Runs a simulation from the given state, updating the tree.
+
+    The state is played forward in place (pass a fresh world or a clone).
+    `parent` is the decision node the simulation came from; with reuse_tree the
+    edge to this state's node is recorded in its child_keys.
+    """
+    use_virtual_loss = self._num_tree_threads > 1
+    path, leaf_state, returns = self._descend(state, self._path_stack(), None, parent, use_virtual_loss)
+    if leaf_state is not None:
+      try:
+        returns = self._evaluator.evaluate(leaf_state)
+      except Exception:
+        if use_virtual_loss:
+          with self._tree_lock: self._revert_path(path)
+        raise
+
+    # Обратное распространение
+    with self._tree_lock: self._backup_path(path, returns, use_virtual_loss)
     return returns
+
+
+# Бот процесса-воркера root-параллельного поиска (создается один раз на процесс).
+_root_parallel_bot = None
+
+
+def _init_root_parallel_worker(worker_modules, bot_config, resampler_cb):
+  global _root_parallel_bot
+  for module_name in worker_modules:
+    importlib.import_module(module_name)
+  _root_parallel_bot = ISMCTSBot(None, **bot_config)
+  if resampler_cb is not None:
+    _root_parallel_bot.set_resampler(resampler_cb)
+
+
+def _root_parallel_search(state, num_simulations, seed, deadline=None):
+  bot = _root_parallel_bot
+  bot._game = state.get_game()
+  bot._random_state = np.random.RandomState(seed)
+  bot._num_evicted = 0
+  bot._prepare_tree(state)
+  bot._root_node = bot.lookup_or_create_node(state)
+  # Ранняя остановка по лидеру отключена: лидер одного воркера не решает суммарный выбор
+  simulations, stop_reason = bot._run_simulations(state, num_simulations, deadline, early_stop=False)
+  return bot.root_statistics(), simulations, stop_reason, (len(bot._nodes), bot._num_evicted)
@@ -0,0 +1,105 @@
+# Пакетный (NumPy) движок обычной руки OFC Pineapple: N независимых игр в массивах.
+# Правила совпадают с OFCPineappleState в режиме row_actions=True: карта кладется в ряд, конкретный слот -
+# первый свободный слот ряда; руки отсортированы; колода сдается с конца (как _deck.pop()).
+# Все игры идут в одной последовательности фаз (в обычной руке она одинакова), поэтому фаза общая.
+# Fantasyland не моделируется: партия заканчивается на STREET_REGULAR_SHOWDOWN.
+
+import itertools
+from typing import Optional, Tuple
+import numpy as np
+import pyspiel
+
+import ofc_pineapple as ofc
+
+_ROW_STARTS = np.array([slots[0] for slots in ofc.ROW_SLOTS], dtype=np.int64)
+_ROW_SIZES = np.array([len(slots) for slots in ofc.ROW_SLOTS], dtype=np.int64)
+# Все назначения k карт по рядам и сколько карт каждое кладет в каждый ряд
+_ROW_TUPLES = {k: np.array(list(itertools.product(range(ofc.NUM_ROWS), repeat=k)), dtype=np.int64) for k in (2, 5)}
+_ROW_TUPLE_COUNTS = {k: np.stack([(rows == r).sum(axis=1) for r in range(ofc.NUM_ROWS)], axis=1) for k, rows in _ROW_TUPLES.items()}
+
+
+class OFCBatch(object):
+    """N партий обычной руки в массивах: доски (N, 2, 13), колоды (N, 52), руки, сбросы.
+
+    Ход всех игр за один вызов: deal() сдает карты текущему игроку, apply(rows, discard_idx) раскладывает
+    его руку. rows[:, j] - ряд j-й размещаемой карты руки (в порядке отсортированной руки без сброшенной),
+    discard_idx - индекс сбрасываемой карты (на первой улице не используется).
+    """
+
+    def __init__(self, num_games: int, rng=None, dealer_button: int = 0, decks: Optional[np.ndarray] = None):
+        rng = rng if rng is not None else np.random
+        self.num_games = num_games; self.dealer_button = dealer_button
+        self.first_player = (dealer_button + 1) % ofc.NUM_PLAYERS
+        self.decks = np.asarray(decks, dtype=np.int8) if decks is not None else np.argsort(rng.random_sample((num_games, ofc.NUM_CARDS)), axis=1).astype(np.int8)
+        self.deck_size = ofc.NUM_CARDS
+        self.boards = np.full((num_games, ofc.NUM_PLAYERS, ofc.TOTAL_CARDS_PLACED), -1, dtype=np.int8)
+        self.row_counts = np.zeros((num_games, ofc.NUM_PLAYERS, ofc.NUM_ROWS), dtype=np.int8)
+        self.hands = np.full((num_games, ofc.NUM_PLAYERS, 5), -1, dtype=np.int8); self.hand_sizes = np.zeros(ofc.NUM_PLAYERS, dtype=np.int64)
+        self.discards = np.full((num_games, ofc.NUM_PLAYERS, 4), -1, dtype=np.int8); self.discard_counts = np.zeros(ofc.NUM_PLAYERS, dtype=np.int64)
+        self.phase = ofc.STREET_FIRST_DEAL_P1
+
+    # --- Фазы ---
+    def current_player(self) -> int:
+        """Игрок, которому сдают (фаза сдачи) или который раскладывает карты; TERMINAL на шоудауне."""
+        if self.phase >= ofc.STREET_REGULAR_SHOWDOWN: return pyspiel.PlayerId.TERMINAL
+        is_p1_phase = (self.phase - ofc.STREET_FIRST_DEAL_P1) // 2 % ofc.NUM_PLAYERS == 0
+        return self.first_player if is_p1_phase else 1 - self.first_player
+    def is_deal_phase(self) -> bool: return self.phase < ofc.STREET_REGULAR_SHOWDOWN and self.phase % 2 == 1
+    def is_showdown(self) -> bool: return self.phase == ofc.STREET_REGULAR_SHOWDOWN
+    def cards_to_deal(self) -> int: return 5 if self.phase in (ofc.STREET_FIRST_DEAL_P1, ofc.STREET_FIRST_DEAL_P2) else 3
+
+    # --- Ходы ---
+    def deal(self):
+        """Сдает текущему игроку 5 или 3 карты с конца колоды каждой игры (рука сортируется)."""
+        if not self.is_deal_phase(): raise ValueError(f"Сдача вне фазы сдачи: {self.phase}")
+        player = self.current_player(); num_cards = self.cards_to_deal()
+        dealt = self.decks[:, self.deck_size - num_cards:self.deck_size]; self.deck_size -= num_cards
+        self.hands[:, player, :] = -1; self.hands[:, player, :num_cards] = np.sort(dealt, axis=1); self.hand_sizes[player] = num_cards
+        self.phase += 1
+
+    def apply(self, rows: np.ndarray, discard_idx: Optional[np.ndarray] = None):
+        """Раскладывает руку текущего игрока во всех играх (см. описание класса)."""
+        if self.is_deal_phase() or self.is_showdown(): raise ValueError(f"Размещение вне фазы размещения: {self.phase}")
+        player = self.current_player(); hand = self.hands[:, player, :self.hand_sizes[player]]; games = np.arange(self.num_games)
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.hand_sizes[player] == 3:
+            if discard_idx is None: raise ValueError("На улицах 2-5 нужен discard_idx")
+            discard_idx = np.asarray(discard_idx, dtype=np.int64); keep = np.ones(hand.shape, dtype=bool); keep[games, discard_idx] = False
+            self.discards[games, player, self.discard_counts[player]] = hand[games, discard_idx]; self.discard_counts[player] += 1
+            self.discards[:, player, :self.discard_counts[player]].sort(axis=1)
+            hand = hand[keep].reshape(self.num_games, 2)
+        if rows.shape != hand.shape: raise ValueError(f"Неверная форма rows: {rows.shape}, ожидалось {hand.shape}")
+        for j in range(hand.shape[1]):
+            row = rows[:, j]; filled = self.row_counts[games, player, row].astype(np.int64)
+            if (filled >= _ROW_SIZES[row]).any(): raise ValueError(f"Ряд уже заполнен в играх {np.flatnonzero(filled >= _ROW_SIZES[row]).tolist()}")
+            self.boards[games, player, _ROW_STARTS[row] + filled] = hand[:, j]; self.row_counts[games, player, row] += 1
+        self.hands[:, player, :] = -1; self.hand_sizes[player] = 0
+        self.phase += 1
+
+    def random_actions(self, rng=None) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Равномерно случайное легальное действие в каждой игре: (rows, discard_idx)."""
+        rng = rng if rng is not None else np.random
+        player = self.current_player(); num_cards = self.hand_sizes[player]; num_placed = 5 if num_cards == 5 else 2
+        free = (_ROW_SIZES[None, :] - self.row_counts[:, player, :]).astype(np.int64)
+        legal = (_ROW_TUPLE_COUNTS[num_placed][None, :, :] <= free[:, None, :]).all(axis=2)
+        choice = np.argmax(np.where(legal, rng.random_sample(legal.shape), -1.0), axis=1)
+        discard_idx = rng.randint(num_cards, size=self.num_games) if num_cards == 3 else None
+        return _ROW_TUPLES[num_placed][choice], discard_idx
+
+    def play_random(self, rng=None) -> np.ndarray:
+        """Доигрывает все партии случайными легальными действиями и возвращает showdown()."""
+        while not self.is_showdown():
+            if self.is_deal_phase(): self.deal()
+            else: self.apply(*self.random_actions(rng))
+        return self.showdown()
+
+    # --- Подсчет ---
+    def row_evals(self) -> np.ndarray:
+        """Силы рядов заполненных досок: (N, 2, 3)."""
+        return ofc.evaluate_boards_np(self.boards.astype(np.int64))
+
+    def showdown(self) -> np.ndarray:
+        """Очки P0 - P1 за руку в каждой игре (правила _calculate_final_returns)."""
+        if not self.is_showdown(): raise ValueError(f"Подсчет очков до шоудауна: фаза {self.phase}")
+        evals = self.row_evals()
+        return ofc.showdown_diff_np(evals[:, 0], evals[:, 1])
@@ -0,0 +1,238 @@
+# Бенчмарки горячих путей OFC Pineapple и ISMCTS.
+# Запуск: python ofc_benchmarks.py [имя_бенчмарка ...]
+
+import copy
+import itertools
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pyspiel
+
+import ismcts
+import ofc_batch
+import ofc_pineapple as ofc
+import ofc_rollout
+
+
+def _random_boards(num_hands, seed=0):
+    rng = np.random.RandomState(seed)
+    return [[list(map(int, deal[:ofc.TOTAL_CARDS_PLACED])), list(map(int, deal[ofc.TOTAL_CARDS_PLACED:2 * ofc.TOTAL_CARDS_PLACED]))]
+            for deal in (rng.permutation(ofc.NUM_CARDS) for _ in range(num_hands))]
+
+
+def bench_showdown(num_hands=50000):
+    """Пропускная способность подсчета очков на шоудауне (рук/сек)."""
+    boards = _random_boards(num_hands)
+    start = time.perf_counter()
+    for board_p0, board_p1 in boards:
+        ofc.showdown_diff(ofc.evaluate_board(board_p0), ofc.evaluate_board(board_p1))
+    elapsed = time.perf_counter() - start
+    return {"hands_per_sec": num_hands / elapsed}
+
+
+def _mid_hand_state(row_actions=True, seed=0, phase=ofc.STREET_THIRD_PLACE_P1):
+    """Состояние в фазе phase (по умолчанию третья улица, P1 ходит) - типичная точка клонирования в ISMCTS."""
+    np.random.seed(seed); rng = np.random.RandomState(seed)
+    state = pyspiel.load_game("ofc_pineapple", {"row_actions": row_actions}).new_initial_state()
+    while state._phase != phase:
+        if state.is_chance_node(): state.apply_action(0)
+        else: legal = state.legal_actions(); state.apply_action(legal[rng.randint(len(legal))])
+    state.legal_actions()
+    return state
+
+
+def _baseline_clone(state):
+    """Прежний clone (до быстрого пути): полный __init__ с тасовкой колоды и copy.deepcopy досок, рук и сбросов."""
+    cloned = type(state)(state.get_game()); cloned.__dict__.update(state.__dict__)
+    cloned._deck = state._deck[:]; cloned._cards_to_place_count = state._cards_to_place_count[:]; cloned._cards_to_discard_count = state._cards_to_discard_count[:]
+    cloned._total_cards_placed = state._total_cards_placed[:]; cloned._cumulative_returns = state._cumulative_returns[:]; cloned._current_hand_returns = state._current_hand_returns[:]
+    cloned._board = copy.deepcopy(state._board); cloned._current_cards = copy.deepcopy(state._current_cards); cloned._discards = copy.deepcopy(state._discards)
+    cloned._next_fantasy_players = state._next_fantasy_players[:]; cloned._cached_legal_action_ids = None
+    return cloned
+
+
+def bench_clone(num_clones=20000):
+    """Скорость OFCPineappleState.clone против прежнего пути _baseline_clone (клонов/сек)."""
+    state = _mid_hand_state()
+    start = time.perf_counter()
+    for _ in range(num_clones): _baseline_clone(state)
+    baseline_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(num_clones): state.clone()
+    elapsed = time.perf_counter() - start
+    return {"baseline_clones_per_sec": num_clones / baseline_elapsed, "clones_per_sec": num_clones / elapsed, "speedup": baseline_elapsed / elapsed}
+
+
+def _baseline_resample(state, player, rng):
+    """Прежняя детерминизация: состояние -> OFCCompactState -> determinize -> to_state с пересчетом Zobrist и статистик рядов."""
+    compact = state.to_compact(); unknown_cards = rng.permutation(ofc.mask_to_cards(compact.unknown_mask(player))).tolist()
+    world = compact.determinize(player, unknown_cards)
+    return world.to_state(state.get_game(), deck_order=unknown_cards[len(unknown_cards) - world.masks[ofc.MASK_DECK].bit_count():])
+
+
+def bench_resample(num_samples=20000):
+    """Сэмплирование мира resample_from_infostate против прежнего пути через OFCCompactState (миров/сек)."""
+    state = _mid_hand_state(); player = state.current_player(); rng = np.random.RandomState(0)
+    start = time.perf_counter()
+    for _ in range(num_samples): _baseline_resample(state, player, rng)
+    baseline_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(num_samples): state.resample_from_infostate(player, None, rng)
+    elapsed = time.perf_counter() - start
+    return {"baseline_worlds_per_sec": num_samples / baseline_elapsed, "worlds_per_sec": num_samples / elapsed, "speedup": baseline_elapsed / elapsed}
+
+
+def bench_legal_actions(num_calls=200):
+    """Генерация легальных действий без кэша (вызовов/сек): первая улица (13 * 12 * 11 * 10 * 9 действий в режиме
+    слотов) и третья улица в обоих режимах действий."""
+    result = {}
+    for row_actions in (False, True):
+        mode = "rows" if row_actions else "slots"
+        for street, phase in (("street1", ofc.STREET_FIRST_PLACE_P1), ("street3", ofc.STREET_THIRD_PLACE_P1)):
+            state = _mid_hand_state(row_actions, phase=phase); calls = num_calls if street == "street3" or row_actions else num_calls // 20
+            start = time.perf_counter()
+            for _ in range(calls): state._clear_cache(); state.legal_actions()
+            result[f"{mode}_{street}_per_sec"] = calls / (time.perf_counter() - start)
+    return result
+
+
+def bench_batch_rollouts(num_games=20000):
+    """Случайные партии пакетного движка OFCBatch (рук/сек)."""
+    rng = np.random.RandomState(0)
+    start = time.perf_counter()
+    ofc_batch.OFCBatch(num_games, rng).play_random(rng)
+    elapsed = time.perf_counter() - start
+    return {"hands_per_sec": num_games / elapsed}
+
+
+def _baseline_solve_fantasyland(cards):
+    """Прежний солвер Fantasy: векторизованный полный перебор пар (низ, середина) и топов без отсечений по очкам."""
+    n = len(cards); cards_np = np.array(cards, dtype=np.int64); bits = 1 << np.arange(n, dtype=np.int64)
+    subsets5 = np.array(list(itertools.combinations(range(n), 5)), dtype=np.int64); masks5 = bits[subsets5].sum(axis=1)
+    subsets3 = np.array(list(itertools.combinations(range(n), 3)), dtype=np.int64); masks3 = bits[subsets3].sum(axis=1)
+    strength5 = ofc.evaluate_rows5_np(cards_np[subsets5]); strength3 = ofc.evaluate_rows3_np(cards_np[subsets3])
+    index3 = np.full(1 << n, -1, dtype=np.int64); index3[masks3] = np.arange(len(masks3))
+    bottom_idx, middle_idx = np.nonzero(((masks5[:, None] & masks5[None, :]) == 0) & (strength5[None, :] <= strength5[:, None]))
+    rest = (1 << n) - 1 ^ masks5[bottom_idx] ^ masks5[middle_idx]
+    rest_positions = np.nonzero((rest[:, None] & bits[None, :]) != 0)[1].reshape(len(rest), n - 10)
+    top_choices = np.array(list(itertools.combinations(range(n - 10), 3)), dtype=np.int64)
+    top_idx = index3[bits[rest_positions[:, top_choices]].sum(axis=2)]
+    bottom_idx = np.repeat(bottom_idx, len(top_choices)); middle_idx = np.repeat(middle_idx, len(top_choices)); top_idx = top_idx.ravel()
+    alive = strength3[top_idx] <= strength5[middle_idx]; bottom_idx, middle_idx, top_idx = bottom_idx[alive], middle_idx[alive], top_idx[alive]
+    top_strength = strength3[top_idx]; middle_strength = strength5[middle_idx]; bottom_strength = strength5[bottom_idx]
+    repeats = (ofc.hand_category_np(top_strength) == ofc.THREE_OF_A_KIND) | (ofc.hand_category_np(middle_strength) >= ofc.FULL_HOUSE) | (ofc.hand_category_np(bottom_strength) >= ofc.FOUR_OF_A_KIND)
+    scores = (ofc.TOP_ROYALTY_NP[top_strength >> ofc.STRENGTH_PRIMARY_SHIFT] + ofc.MIDDLE_ROYALTY_NP[middle_strength >> ofc.STRENGTH_PRIMARY_SHIFT]
+              + ofc.BOTTOM_ROYALTY_NP[bottom_strength >> ofc.STRENGTH_PRIMARY_SHIFT] + ofc.FANTASY_REPEAT_BONUS * repeats)
+    return np.lexsort((-top_strength, -middle_strength, -bottom_strength, -scores))[:1]
+
+
+def bench_fantasy_solver(num_hands=30):
+    """solve_fantasyland (поиск с отсечениями) против прежнего полного перебора на случайных 14-карточных руках:
+    время на руку и пик памяти (tracemalloc, отдельным проходом - он замедляет выделения)."""
+    rng = np.random.RandomState(0); hands = [rng.permutation(ofc.NUM_CARDS)[:ofc.FANTASY_HAND_SIZE].tolist() for _ in range(num_hands)]
+    result = {}
+    for name, solve in (("baseline", _baseline_solve_fantasyland), ("pruned", ofc.solve_fantasyland)):
+        start = time.perf_counter()
+        for hand in hands: solve(hand)
+        result[f"{name}_ms_per_hand"] = 1000.0 * (time.perf_counter() - start) / num_hands
+        tracemalloc.start(); solve(hands[0]); result[f"{name}_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20; tracemalloc.stop()
+    result["speedup"] = result["baseline_ms_per_hand"] / result["pruned_ms_per_hand"]
+    return result
+
+
+def bench_rollout_evaluator(num_evaluations=2000):
+    """Оценки листа OFCRolloutEvaluator (эвристическое доигрывание руки) с первой улицы (оценок/сек)."""
+    evaluator = ofc_rollout.OFCRolloutEvaluator(random_state=np.random.RandomState(0))
+    state = _mid_hand_state(phase=ofc.STREET_FIRST_PLACE_P1)
+    start = time.perf_counter()
+    for _ in range(num_evaluations): evaluator.evaluate(state)
+    elapsed = time.perf_counter() - start
+    return {"evaluations_per_sec": num_evaluations / elapsed}
+
+
+class _ZeroEvaluator(object):
+    """Нулевая оценка и равномерный prior: в бенчмарке поиска остается только его собственный цикл."""
+    def evaluate(self, state): return [0.0] * ofc.NUM_PLAYERS
+    def prior(self, state): legal = state.legal_actions(); return [(action, 1.0 / len(legal)) for action in legal]
+
+
+class _RecursiveISMCTSBot(ismcts.ISMCTSBot):
+    """Прежний цикл симуляции: рекурсия на каждом узле, clone перед каждым apply_action, сдача через
+    chance_outcomes() и rng.choice, np.zeros вместо общего нулевого кортежа."""
+
+    def run_simulation(self, state, parent=None):
+        if state.is_terminal(): return state.returns()
+        if state.is_chance_node():
+            outcomes, probs = zip(*state.chance_outcomes())
+            next_state = state.clone(); next_state.apply_action(self._random_state.choice(outcomes, p=probs))
+            return self.run_simulation(next_state, parent)
+        cur_player = state.current_player(); legal_actions = state.legal_actions(cur_player)
+        if not legal_actions: return np.zeros(self._game.num_players())
+        legal_actions, to_state_action = self.node_actions(state, legal_actions)
+        node, chosen_action, is_new_leaf, expanding = self._select_step(state, legal_actions, parent, False)
+        if is_new_leaf: returns = self._evaluator.evaluate(state)
+        else:
+            next_state = state.clone(); next_state.apply_action(to_state_action[chosen_action] if to_state_action is not None else chosen_action)
+            returns = self._evaluator.evaluate(next_state) if expanding else self.run_simulation(next_state, node)
+        with self._tree_lock: self._backup_step(node, chosen_action, cur_player, returns, False)
+        return returns
+
+
+def bench_ismcts_simulations(num_simulations=2000):
+    """Симуляции ISMCTSBot с нулевым оценщиком со второй улицы (симуляций/сек): спуск, сдачи и обратный проход.
+    Сравнение с прежним рекурсивным циклом (_RecursiveISMCTSBot) на том же поиске."""
+    state = _mid_hand_state(phase=ofc.STREET_SECOND_PLACE_P1); result = {}
+    for name, bot_class in (("baseline", _RecursiveISMCTSBot), ("iterative", ismcts.ISMCTSBot)):
+        bot = bot_class(state.get_game(), _ZeroEvaluator(), 2.0, num_simulations, random_state=np.random.RandomState(0),
+                        child_selection_policy=ismcts.ChildSelectionPolicy.UCT, exact_endgame_max_outcomes=None)
+        start = time.perf_counter()
+        bot.run_search(state)
+        result[f"{name}_simulations_per_sec"] = num_simulations / (time.perf_counter() - start)
+    result["speedup"] = result["iterative_simulations_per_sec"] / result["baseline_simulations_per_sec"]
+    return result
+
+
+class _RemoteEvaluator(_ZeroEvaluator):
+    """Нулевая оценка с задержкой на лист, как у запроса к серверу оценки; ожидание отпускает GIL."""
+    releases_gil = True
+    def __init__(self, latency_s): self._latency_s = latency_s
+    def evaluate(self, state): time.sleep(self._latency_s); return [0.0] * ofc.NUM_PLAYERS
+
+
+def bench_tree_parallel(num_simulations=400, num_threads=4, latency_ms=2.0):
+    """Tree-параллельный ISMCTS: симуляций/сек с 1 и num_threads потоками при оценке с задержкой latency_ms,
+    отпускающей GIL (с оценщиками на чистом Python режим недоступен, см. ISMCTSBot)."""
+    state = _mid_hand_state(phase=ofc.STREET_SECOND_PLACE_P1); result = {}
+    for threads in (1, num_threads):
+        bot = ismcts.ISMCTSBot(state.get_game(), _RemoteEvaluator(latency_ms / 1000.0), 2.0, num_simulations, random_state=np.random.RandomState(0),
+                               child_selection_policy=ismcts.ChildSelectionPolicy.UCT, exact_endgame_max_outcomes=None, num_tree_threads=threads)
+        start = time.perf_counter()
+        bot.run_search(state)
+        result[f"threads{threads}_simulations_per_sec"] = num_simulations / (time.perf_counter() - start)
+    result["speedup"] = result[f"threads{num_threads}_simulations_per_sec"] / result["threads1_simulations_per_sec"]
+    return result
+
+
+BENCHMARKS = {
+    "showdown": bench_showdown,
+    "clone": bench_clone,
+    "resample": bench_resample,
+    "legal_actions": bench_legal_actions,
+    "batch_rollouts": bench_batch_rollouts,
+    "fantasy_solver": bench_fantasy_solver,
+    "rollout_evaluator": bench_rollout_evaluator,
+    "ismcts_simulations": bench_ismcts_simulations,
+    "tree_parallel": bench_tree_parallel,
+}
+
+
+def main(argv):
+    names = argv or list(BENCHMARKS)
+    for name in names:
+        result = BENCHMARKS[name]()
+        print(f"{name}: " + ", ".join(f"{k}={v:,.1f}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,178 @@
+# Книга дебютов OFC Pineapple: политики первой улицы первого игрока (STREET_FIRST_PLACE_P1) для всех
+# классов 5-карточных рук с точностью до перестановки мастей, посчитанные офлайн глубоким поиском ISMCTS.
+# Решение P1 на первой улице зависит только от его пяти карт (доска соперника еще пуста), поэтому ключ -
+# каноническая рука. Решение P2 зависит и от видимой доски P1 - такие позиции в книгу не входят.
+#
+# Книга - каталог из файлов .npy, открываемых через np.load(mmap_mode='r'): в память подгружаются только
+# прочитанные страницы, поэтому старт бота не требует загрузки таблицы целиком.
+#   index.npy   (C(52, 5),) int32  - строка таблицы по colex-номеру канонической руки (-1 - не класс)
+#   hands.npy   (N, 5) int8        - канонические руки (отсортированы)
+#   actions.npy (N, K) uint32      - номера действий лучших K ходов для канонической руки
+#   probs.npy   (N, K) float32     - их вероятности (все нули - строка еще не посчитана)
+#   meta.json                      - row_actions, K и параметры поиска
+# Запуск построения: python ofc_opening_book.py КАТАЛОГ [--simulations N] [--start I] [--stop J]
+# (диапазоны строк позволяют строить книгу частями и продолжать прерванное построение).
+
+import argparse
+import itertools
+import json
+import math
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import pyspiel
+
+import ismcts
+import ofc_pineapple as ofc
+import ofc_rollout
+
+BOOK_VERSION = 2 # 2 - номера действий по рангам осуществимых размещений
+DEFAULT_TOP_K = 8
+HAND_SIZE = 5
+_BINOMIALS = [[math.comb(n, k) for n in range(ofc.NUM_CARDS + 1)] for k in range(HAND_SIZE + 1)]
+NUM_HANDS = _BINOMIALS[HAND_SIZE][ofc.NUM_CARDS]
+
+
+def hand_index(sorted_cards: Sequence[int]) -> int:
+    """Colex-номер отсортированной 5-карточной руки в [0, C(52, 5))."""
+    return sum(_BINOMIALS[i + 1][card] for i, card in enumerate(sorted_cards))
+
+
+def canonical_suit_permutation(cards: Sequence[int]) -> Tuple[int, ...]:
+    """Перестановка мастей (perm[старая] = новая) по тем же правилам, что OFCPineappleState.canonical_suit_permutation
+    для одной руки: масти упорядочиваются по убыванию списка рангов своих карт."""
+    signatures = [[] for _ in range(ofc.NUM_SUITS)]
+    for card in cards: signatures[card % ofc.NUM_SUITS].append(card // ofc.NUM_SUITS)
+    for suit_signature in signatures: suit_signature.sort()
+    order = sorted(range(ofc.NUM_SUITS), key=lambda suit: signatures[suit], reverse=True)
+    perm = [0] * ofc.NUM_SUITS
+    for new_suit, old_suit in enumerate(order): perm[old_suit] = new_suit
+    return tuple(perm)
+
+
+def canonical_hand(cards: Sequence[int]) -> Tuple[int, ...]:
+    """Каноническая (отсортированная) рука класса изоморфизма мастей."""
+    card_map = ofc.SUIT_PERMUTATION_CARD_MAPS[canonical_suit_permutation(cards)]
+    return tuple(sorted(card_map[card] for card in cards))
+
+
+def canonical_hands() -> np.ndarray:
+    """Все классы 5-карточных рук (N, 5) в порядке возрастания colex-номера.
+
+    Векторизованный canonical_hand по всем C(52, 5) рукам: подпись масти — возрастающие ранги, упакованные
+    цифрами (rank + 1) по основанию 14 с нулями в хвосте, поэтому сравнение чисел совпадает со сравнением списков.
+    """
+    hands = np.fromiter(itertools.chain.from_iterable(itertools.combinations(range(ofc.NUM_CARDS), HAND_SIZE)),
+                        dtype=np.int8, count=NUM_HANDS * HAND_SIZE).reshape(NUM_HANDS, HAND_SIZE)
+    ranks = (hands // ofc.NUM_SUITS).astype(np.int32); suits = (hands % ofc.NUM_SUITS).astype(np.intp); rows = np.arange(NUM_HANDS)
+    signatures = np.zeros((NUM_HANDS, ofc.NUM_SUITS), dtype=np.int32); position = np.zeros(NUM_HANDS, dtype=np.int32)
+    for j in range(HAND_SIZE):
+        position[:] = 0
+        for i in range(j): position += suits[:, i] == suits[:, j] # карты отсортированы, так что это номер карты внутри масти
+        signatures[rows, suits[:, j]] += (ranks[:, j] + 1) * (ofc.NUM_RANKS + 1) ** (HAND_SIZE - 1 - position)
+    perm = np.argsort(np.argsort(-signatures, axis=1, kind="stable"), axis=1) # как sorted(..., reverse=True): равные подписи сохраняют порядок
+    canonical = np.sort(ranks * ofc.NUM_SUITS + perm[rows[:, None], suits], axis=1)
+    index = np.array(_BINOMIALS, dtype=np.int64)[np.arange(1, HAND_SIZE + 1), canonical].sum(axis=1)
+    _, first = np.unique(index, return_index=True)
+    return canonical[first].astype(np.int8)
+
+
+def first_street_state(game, hand: Sequence[int]) -> 'ofc.OFCPineappleState':
+    """Состояние STREET_FIRST_PLACE_P1, в котором первому игроку сдана рука hand (остальная колода случайна)."""
+    state = game.new_initial_state()
+    if state._phase != ofc.STREET_FIRST_DEAL_P1: raise ValueError(f"Неожиданная фаза начального состояния: {state._phase}")
+    hand_cards = set(hand); state._deck = [card for card in state._deck if card not in hand_cards] + list(hand)
+    state.apply_action(hand[-1]) # сдача снимает карты с конца колоды, куда переложена рука
+    return state
+
+
+class OFCOpeningBook(object):
+    """Книга дебютов, открытая только на чтение (memory-mapped). Используется как ISMCTSBot(opening_book=...).
+
+    lookup(state) за O(1) возвращает политику [(действие, вероятность)] для решения P1 на первой улице
+    или None, если позиция не из книги (другая фаза, другой режим действий, строка не посчитана).
+    """
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as f: self.meta = json.load(f)
+        if self.meta.get("version") != BOOK_VERSION: raise ValueError(f"Неподдерживаемая версия книги: {self.meta.get('version')}")
+        self.row_actions = bool(self.meta["row_actions"])
+        self.index = np.load(os.path.join(path, "index.npy"), mmap_mode="r")
+        self.actions = np.load(os.path.join(path, "actions.npy"), mmap_mode="r")
+        self.probs = np.load(os.path.join(path, "probs.npy"), mmap_mode="r")
+
+    def __len__(self) -> int: return len(self.actions)
+
+    def lookup(self, state) -> Optional[List[Tuple[int, float]]]:
+        if state._phase != ofc.STREET_FIRST_PLACE_P1 or state._row_actions != self.row_actions: return None
+        hand = state._current_cards[state.current_player()]
+        if len(hand) != HAND_SIZE: return None
+        card_map = ofc.SUIT_PERMUTATION_CARD_MAPS[canonical_suit_permutation(hand)]
+        mapped = [card_map[card] for card in hand]; canonical = sorted(mapped)
+        row = int(self.index[hand_index(canonical)])
+        if row < 0: return None
+        probs = self.probs[row].tolist(); prob_sum = sum(probs)
+        if prob_sum <= 0: return None
+        # Цели хранятся в порядке канонической руки; карта i реальной руки стоит в ней на позиции positions[i]
+        positions = [canonical.index(card) for card in mapped]; policy = []
+        for action, prob in zip(self.actions[row].tolist(), probs):
+            if prob <= 0: continue
+            targets, _ = ofc.decode_action(action, self.row_actions)
+            policy.append((ofc.encode_action([targets[pos] for pos in positions], -1, self.row_actions), prob / prob_sum))
+        return policy
+
+
+def _create_book(path: str, row_actions: bool, top_k: int, params: Dict) -> None:
+    os.makedirs(path, exist_ok=True); hands = canonical_hands()
+    index = np.full(NUM_HANDS, -1, dtype=np.int32); index[[hand_index(hand) for hand in hands.tolist()]] = np.arange(len(hands), dtype=np.int32)
+    np.save(os.path.join(path, "index.npy"), index); np.save(os.path.join(path, "hands.npy"), hands)
+    np.lib.format.open_memmap(os.path.join(path, "actions.npy"), mode="w+", dtype=np.uint32, shape=(len(hands), top_k)).flush()
+    np.lib.format.open_memmap(os.path.join(path, "probs.npy"), mode="w+", dtype=np.float32, shape=(len(hands), top_k)).flush()
+    with open(os.path.join(path, "meta.json"), "w") as f: json.dump(dict(version=BOOK_VERSION, row_actions=row_actions, top_k=top_k, **params), f, indent=1)
+
+
+def build_opening_book(path: str, num_simulations: int = 20000, row_actions: bool = True, top_k: int = DEFAULT_TOP_K,
+                       start: int = 0, stop: Optional[int] = None, seed: int = 0, uct_c: float = 2.0,
+                       evaluator=None, bot_kwargs: Optional[Dict] = None, flush_every: int = 100, verbose: bool = True) -> int:
+    """Считает строки [start, stop) книги в каталоге path поиском ISMCTS по num_simulations симуляций.
+
+    Книга создается при первом вызове; уже посчитанные строки пропускаются. Возвращает число посчитанных строк.
+    """
+    if not os.path.exists(os.path.join(path, "meta.json")): _create_book(path, row_actions, top_k, dict(num_simulations=num_simulations, uct_c=uct_c))
+    with open(os.path.join(path, "meta.json")) as f: meta = json.load(f)
+    if bool(meta["row_actions"]) != row_actions: raise ValueError(f"Книга в {path} построена для row_actions={meta['row_actions']}")
+    hands = np.load(os.path.join(path, "hands.npy"))
+    actions = np.load(os.path.join(path, "actions.npy"), mmap_mode="r+"); probs = np.load(os.path.join(path, "probs.npy"), mmap_mode="r+")
+    top_k = actions.shape[1]; stop = len(hands) if stop is None else min(stop, len(hands))
+    rng = np.random.RandomState(seed); game = pyspiel.load_game("ofc_pineapple", {"row_actions": row_actions})
+    evaluator = evaluator if evaluator is not None else ofc_rollout.OFCRolloutEvaluator(random_state=rng)
+    bot = ismcts.ISMCTSBot(game, evaluator, uct_c, num_simulations, random_state=rng, exact_endgame_max_outcomes=None, **(bot_kwargs or {}))
+    num_built = 0; start_time = time.monotonic()
+    for row in range(start, stop):
+        if probs[row].sum() > 0: continue
+        np.random.seed(rng.randint(np.iinfo(np.int32).max)) # колода нового состояния тасуется глобальным np.random
+        policy = sorted(bot.run_search(first_street_state(game, hands[row].tolist())), key=lambda entry: -entry[1])[:top_k]
+        actions[row] = 0; probs[row] = 0
+        actions[row, :len(policy)] = [action for action, _ in policy]; probs[row, :len(policy)] = [prob for _, prob in policy]
+        num_built += 1
+        if num_built % flush_every == 0:
+            actions.flush(); probs.flush()
+            if verbose: print(f"{row + 1}/{stop}: {num_built} рук за {time.monotonic() - start_time:.0f} с")
+    actions.flush(); probs.flush()
+    return num_built
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Построение книги дебютов первой улицы OFC Pineapple")
+    parser.add_argument("path"); parser.add_argument("--simulations", type=int, default=20000)
+    parser.add_argument("--slot-actions", action="store_true", help="действия-слоты вместо действий-рядов")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K); parser.add_argument("--start", type=int, default=0)
+    parser.add_argument("--stop", type=int, default=None); parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    num_built = build_opening_book(args.path, args.simulations, not args.slot_actions, args.top_k, args.start, args.stop, args.seed)
+    print(f"Посчитано рук: {num_built}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -3,11 +3,14 @@
 
 import pyspiel
 import numpy as np
-from typing import List, Tuple, Any, Dict, Optional, Set
+from typing import List, Tuple, Any, Dict, Optional, NamedTuple
 import itertools
+import bisect
+import heapq
+import math
+from array import array
 from collections import Counter
-import copy
-import random # Используется в resample_from_infostate
+import random # Используется для таблиц Zobrist-хэширования инфостейтов
 
 # --- Константы ---
 # ... (Без изменений) ...
@@ -27,6 +30,9 @@ PHASE_FANTASY_N_DEAL_2 = 33; PHASE_FANTASY_N_PLACE_2 = 34; PHASE_FANTASY_N_DEAL_
 PHASE_FANTASY_N_DEAL_4 = 37; PHASE_FANTASY_N_PLACE_4 = 38; PHASE_FANTASY_N_DEAL_5 = 39; PHASE_FANTASY_N_PLACE_5 = 40
 PHASE_FANTASY_F_DEAL = 41; PHASE_FANTASY_F_PLACE = 42; PHASE_FANTASY_SHOWDOWN = 43
 DISCARD_SLOT = -1; RANKS = "23456789TJQKA"; SUITS = "shdc"; FANTASY_TRIGGER_RANK = 10
+# Ряды доски (для режима действий "карта -> ряд", параметр игры row_actions)
+ROW_TOP = 0; ROW_MIDDLE = 1; ROW_BOTTOM = 2; NUM_ROWS = 3; ROW_NAMES = ("top", "middle", "bottom")
+ROW_SLOTS = (TOP_SLOTS, MIDDLE_SLOTS, BOTTOM_SLOTS); ROW_SIZES = (TOP_ROW_SIZE, MIDDLE_ROW_SIZE, BOTTOM_ROW_SIZE); SLOT_ROW = [ROW_TOP] * TOP_ROW_SIZE + [ROW_MIDDLE] * MIDDLE_ROW_SIZE + [ROW_BOTTOM] * BOTTOM_ROW_SIZE
 
 # --- Функции для карт ---
 # ... (Без изменений) ...
@@ -56,82 +62,440 @@ def string_to_card(card_str: str) -> int:
 def cards_to_strings(card_ints: List[Optional[int]]) -> List[str]: return [card_to_string(c) if c is not None else "NN" for c in card_ints]
 def strings_to_cards(card_strs: List[str]) -> List[int]: return [string_to_card(s) for s in card_strs]
 
+# --- Битовые маски карт (бит c соответствует карте c) ---
+FULL_DECK_MASK = (1 << NUM_CARDS) - 1
+def cards_to_mask(card_ints) -> int:
+    mask = 0
+    for c in card_ints:
+        if c != -1: mask |= 1 << c
+    return mask
+def mask_to_cards(mask: int) -> List[int]:
+    cards = []
+    while mask: low = mask & -mask; cards.append(low.bit_length() - 1); mask ^= low
+    return cards
+
 # --- Оценка Комбинаций ---
-# ... (Без изменений) ...
+# Табличный оценщик: сила ряда - одно целое число вида
+# (категория << 20) | (k0 << 16) | (k1 << 12) | (k2 << 8) | (k3 << 4) | k4,
+# где k0..k4 - ранги кикеров в порядке старшинства (недостающие кикеры = 0).
+# Такие числа сравниваются напрямую, в том числе топ (3 карты) со средним рядом (5 карт).
 HIGH_CARD = 0; PAIR = 1; TWO_PAIR = 2; THREE_OF_A_KIND = 3; STRAIGHT = 4; FLUSH = 5; FULL_HOUSE = 6; FOUR_OF_A_KIND = 7; STRAIGHT_FLUSH = 8
-def evaluate_hand(card_ints: List[Optional[int]]) -> Tuple[int, List[int]]:
-    cards = [c for c in card_ints if c is not None and c != -1]; n = len(cards)
-    if n == 0: return (HIGH_CARD, [])
-    ranks = sorted([card_rank(c) for c in cards], reverse=True)
-    if n < 3: return (HIGH_CARD, ranks)
-    if n == 4: return (HIGH_CARD, ranks)
-    if n not in [3, 5]: return (HIGH_CARD, ranks)
-    suits = [card_suit(c) for c in cards]; rank_counts = Counter(ranks); most_common_ranks = rank_counts.most_common()
-    is_flush = False; is_straight = False; straight_high_card_rank = -1
+NUM_HAND_CATEGORIES = 9; STRENGTH_CATEGORY_SHIFT = 20; STRENGTH_PRIMARY_SHIFT = 16
+# Ключ ряда по рангам аддитивен: сумма 5**rank по картам (в каждой "цифре" - число карт этого ранга, 0..4)
+CARD_RANK_KEY = [5 ** (c // NUM_SUITS) for c in range(NUM_CARDS)]
+CARD_RANK_BIT = [1 << (c // NUM_SUITS) for c in range(NUM_CARDS)]
+CARD_SUIT_BIT = [1 << (c % NUM_SUITS) for c in range(NUM_CARDS)]
+
+def encode_strength(hand_type: int, kickers: List[int]) -> int:
+    strength = hand_type
+    for i in range(5): strength = (strength << 4) | (kickers[i] if i < len(kickers) else 0)
+    return strength
+def hand_category(strength: int) -> int: return strength >> STRENGTH_CATEGORY_SHIFT
+def hand_primary_rank(strength: int) -> int: return (strength >> STRENGTH_PRIMARY_SHIFT) & 0xF
+def decode_strength(strength: int) -> Tuple[int, List[int]]:
+    """Обратное преобразование в (категория, кикеры) - для отладки и вывода."""
+    return (hand_category(strength), [(strength >> (4 * (4 - i))) & 0xF for i in range(5)])
+
+def _rank_strength(ranks: List[int], is_flush: bool = False) -> int:
+    """Эталонная (медленная) оценка по списку рангов; используется только для построения таблиц."""
+    ranks = sorted(ranks, reverse=True); n = len(ranks)
+    if n not in [3, 5]: return encode_strength(HIGH_CARD, ranks)
+    most_common_ranks = Counter(ranks).most_common(); is_straight = False; straight_high_card_rank = -1
     if n == 5:
-        is_flush = len(set(suits)) == 1; unique_ranks = sorted(list(set(ranks)), reverse=True)
-        if len(unique_ranks) >= 5:
-            for i in range(len(unique_ranks) - 4):
-                if all(unique_ranks[i+j] == unique_ranks[i] - j for j in range(5)): is_straight = True; straight_high_card_rank = unique_ranks[i]; break
-            if not is_straight and set(unique_ranks).issuperset({12, 3, 2, 1, 0}): is_straight = True; straight_high_card_rank = 3
-        if is_straight and is_flush: return (STRAIGHT_FLUSH, [straight_high_card_rank])
-        if most_common_ranks[0][1] == 4: kicker = most_common_ranks[1][0] if len(most_common_ranks) > 1 else -1; return (FOUR_OF_A_KIND, [most_common_ranks[0][0], kicker])
-        if len(most_common_ranks) > 1 and most_common_ranks[0][1] == 3 and most_common_ranks[1][1] >= 2: return (FULL_HOUSE, [most_common_ranks[0][0], most_common_ranks[1][0]])
-        if is_flush: return (FLUSH, ranks)
-        if is_straight: return (STRAIGHT, [straight_high_card_rank])
-    if most_common_ranks[0][1] == 3: set_rank = most_common_ranks[0][0]; other_ranks = sorted([r for r in ranks if r != set_rank], reverse=True); return (THREE_OF_A_KIND, [set_rank] + other_ranks)
-    if n == 5 and len(most_common_ranks) > 1 and most_common_ranks[0][1] == 2 and most_common_ranks[1][1] == 2: high_pair_rank = most_common_ranks[0][0]; low_pair_rank = most_common_ranks[1][0]; kicker_rank = most_common_ranks[2][0] if len(most_common_ranks) > 2 else -1; return (TWO_PAIR, [high_pair_rank, low_pair_rank, kicker_rank])
-    if most_common_ranks[0][1] == 2: pair_rank = most_common_ranks[0][0]; other_ranks = sorted([r for r in ranks if r != pair_rank], reverse=True); return (PAIR, [pair_rank] + other_ranks)
-    return (HIGH_CARD, ranks)
+        unique_ranks = sorted(set(ranks), reverse=True)
+        if len(unique_ranks) == 5:
+            if unique_ranks[0] - unique_ranks[4] == 4: is_straight = True; straight_high_card_rank = unique_ranks[0]
+            elif unique_ranks == [12, 3, 2, 1, 0]: is_straight = True; straight_high_card_rank = 3
+        if is_straight and is_flush: return encode_strength(STRAIGHT_FLUSH, [straight_high_card_rank])
+        if most_common_ranks[0][1] == 4: return encode_strength(FOUR_OF_A_KIND, [most_common_ranks[0][0], most_common_ranks[1][0]])
+        if most_common_ranks[0][1] == 3 and most_common_ranks[1][1] == 2: return encode_strength(FULL_HOUSE, [most_common_ranks[0][0], most_common_ranks[1][0]])
+        if is_flush: return encode_strength(FLUSH, ranks)
+        if is_straight: return encode_strength(STRAIGHT, [straight_high_card_rank])
+    if most_common_ranks[0][1] == 3: set_rank = most_common_ranks[0][0]; return encode_strength(THREE_OF_A_KIND, [set_rank] + [r for r in ranks if r != set_rank])
+    if n == 5 and most_common_ranks[0][1] == 2 and most_common_ranks[1][1] == 2: return encode_strength(TWO_PAIR, [most_common_ranks[0][0], most_common_ranks[1][0], most_common_ranks[2][0]])
+    if most_common_ranks[0][1] == 2: pair_rank = most_common_ranks[0][0]; return encode_strength(PAIR, [pair_rank] + [r for r in ranks if r != pair_rank])
+    return encode_strength(HIGH_CARD, ranks)
+
+def _build_strength_tables():
+    row3 = {}; row5 = {}; flush5 = [0] * (1 << NUM_RANKS)
+    for ranks in itertools.combinations_with_replacement(range(NUM_RANKS), 3):
+        row3[sum(5 ** r for r in ranks)] = _rank_strength(list(ranks))
+    for ranks in itertools.combinations_with_replacement(range(NUM_RANKS), 5):
+        if max(Counter(ranks).values()) > NUM_SUITS: continue
+        row5[sum(5 ** r for r in ranks)] = _rank_strength(list(ranks))
+    for ranks in itertools.combinations(range(NUM_RANKS), 5):
+        flush5[sum(1 << r for r in ranks)] = _rank_strength(list(ranks), is_flush=True)
+    return row3, row5, flush5
+_ROW3_STRENGTH, _ROW5_STRENGTH, _FLUSH5_STRENGTH = _build_strength_tables()
+
+def evaluate_row3(c0: int, c1: int, c2: int) -> int:
+    return _ROW3_STRENGTH[CARD_RANK_KEY[c0] + CARD_RANK_KEY[c1] + CARD_RANK_KEY[c2]]
+def evaluate_row5(c0: int, c1: int, c2: int, c3: int, c4: int) -> int:
+    if CARD_SUIT_BIT[c0] & CARD_SUIT_BIT[c1] & CARD_SUIT_BIT[c2] & CARD_SUIT_BIT[c3] & CARD_SUIT_BIT[c4]:
+        return _FLUSH5_STRENGTH[CARD_RANK_BIT[c0] | CARD_RANK_BIT[c1] | CARD_RANK_BIT[c2] | CARD_RANK_BIT[c3] | CARD_RANK_BIT[c4]]
+    return _ROW5_STRENGTH[CARD_RANK_KEY[c0] + CARD_RANK_KEY[c1] + CARD_RANK_KEY[c2] + CARD_RANK_KEY[c3] + CARD_RANK_KEY[c4]]
+ALL_SUITS_MASK = (1 << NUM_SUITS) - 1
+ROW_STAT_COUNT = 0; ROW_STAT_RANK_KEY = 1; ROW_STAT_RANK_BITS = 2; ROW_STAT_SUIT_MASK = 3; ROW_STAT_EVAL = 4; NUM_ROW_STATS = 5
+def finalize_row_strength(row: int, rank_key: int, rank_bits: int, suit_mask: int) -> int:
+    """Сила заполненного ряда по накопленным статистикам: сумме CARD_RANK_KEY, OR рангов и AND мастей."""
+    if row == ROW_TOP: return _ROW3_STRENGTH[rank_key]
+    if suit_mask: return _FLUSH5_STRENGTH[rank_bits]
+    return _ROW5_STRENGTH[rank_key]
+def evaluate_hand(card_ints: List[Optional[int]]) -> int:
+    """Возвращает силу ряда одним целым числом (см. encode_strength)."""
+    cards = [c for c in card_ints if c is not None and c != -1]; n = len(cards)
+    if n == 5: return evaluate_row5(*cards)
+    if n == 3: return evaluate_row3(*cards)
+    return encode_strength(HIGH_CARD, sorted([card_rank(c) for c in cards], reverse=True))
 
 # --- Роялти и Мертвая Рука ---
-# ... (Без изменений) ...
 TOP_ROYALTIES_PAIR = { 4: 1, 5: 2, 6: 3, 7: 4, 8: 5, 9: 6, 10: 7, 11: 8, 12: 9 }
 TOP_ROYALTIES_SET = { r: 10 + r for r in range(NUM_RANKS) }
 MIDDLE_ROYALTIES = { THREE_OF_A_KIND: 2, STRAIGHT: 4, FLUSH: 8, FULL_HOUSE: 12, FOUR_OF_A_KIND: 20, STRAIGHT_FLUSH: 30 }
 BOTTOM_ROYALTIES = { STRAIGHT: 2, FLUSH: 4, FULL_HOUSE: 6, FOUR_OF_A_KIND: 10, STRAIGHT_FLUSH: 15 }
 ROYAL_FLUSH_RANK = 12
-def calculate_royalties(hand_type: int, ranks: List[int], row_type: str) -> int:
-    if not ranks: return 0;
-    if any(r is None for r in ranks): raise TypeError(f"calculate_royalties получила None в списке рангов: {ranks}")
-    if row_type == 'top':
-        if hand_type == THREE_OF_A_KIND: return TOP_ROYALTIES_SET.get(ranks[0], 0)
-        elif hand_type == PAIR: return TOP_ROYALTIES_PAIR.get(ranks[0], 0)
-        else: return 0
-    elif row_type == 'middle':
-        if hand_type == STRAIGHT_FLUSH and ranks[0] == ROYAL_FLUSH_RANK: return 50
-        return MIDDLE_ROYALTIES.get(hand_type, 0)
-    elif row_type == 'bottom':
-        if hand_type == STRAIGHT_FLUSH and ranks[0] == ROYAL_FLUSH_RANK: return 25
-        return BOTTOM_ROYALTIES.get(hand_type, 0)
-    else: raise ValueError(f"Неизвестный тип ряда: {row_type}")
-def compare_evals(eval1: Tuple[int, List[int]], eval2: Tuple[int, List[int]]) -> int:
-    if eval1 is None or eval2 is None: raise TypeError("compare_evals получила None")
-    type1, kickers1 = eval1; type2, kickers2 = eval2
-    if type1 is None or type2 is None: raise TypeError("compare_evals получила None в типе руки")
-    if kickers1 is None or kickers2 is None: raise TypeError("compare_evals получила None в кикерах")
-    if any(k is None for k in kickers1) or any(k is None for k in kickers2): raise TypeError("compare_evals получила None в списке кикеров")
-    if type1 > type2: return 1;
-    if type1 < type2: return -1
-    len_kickers = min(len(kickers1), len(kickers2))
-    for i in range(len_kickers):
-        if kickers1[i] > kickers2[i]: return 1
-        if kickers1[i] < kickers2[i]: return -1
-    return 0
-def is_dead_hand(top_eval: Tuple[int, List[int]], middle_eval: Tuple[int, List[int]], bottom_eval: Tuple[int, List[int]]) -> bool:
-    if compare_evals(top_eval, middle_eval) > 0: return True
-    if compare_evals(middle_eval, bottom_eval) > 0: return True
-    return False
+def _build_royalty_tables() -> Dict[str, List[int]]:
+    """Роялти зависят только от категории и старшего ранга: таблица по индексу strength >> 16."""
+    tables = {'top': [0] * (NUM_HAND_CATEGORIES << 4), 'middle': [0] * (NUM_HAND_CATEGORIES << 4), 'bottom': [0] * (NUM_HAND_CATEGORIES << 4)}
+    for hand_type in range(NUM_HAND_CATEGORIES):
+        for rank in range(NUM_RANKS):
+            idx = (hand_type << 4) | rank
+            if hand_type == THREE_OF_A_KIND: tables['top'][idx] = TOP_ROYALTIES_SET.get(rank, 0)
+            elif hand_type == PAIR: tables['top'][idx] = TOP_ROYALTIES_PAIR.get(rank, 0)
+            is_royal = hand_type == STRAIGHT_FLUSH and rank == ROYAL_FLUSH_RANK
+            tables['middle'][idx] = 50 if is_royal else MIDDLE_ROYALTIES.get(hand_type, 0)
+            tables['bottom'][idx] = 25 if is_royal else BOTTOM_ROYALTIES.get(hand_type, 0)
+    return tables
+ROYALTY_TABLES = _build_royalty_tables()
+TOP_ROYALTY_TABLE = ROYALTY_TABLES['top']; MIDDLE_ROYALTY_TABLE = ROYALTY_TABLES['middle']; BOTTOM_ROYALTY_TABLE = ROYALTY_TABLES['bottom']
+def calculate_royalties(strength: int, row_type: str) -> int:
+    table = ROYALTY_TABLES.get(row_type)
+    if table is None: raise ValueError(f"Неизвестный тип ряда: {row_type}")
+    return table[strength >> STRENGTH_PRIMARY_SHIFT]
+def compare_evals(eval1: int, eval2: int) -> int: return (eval1 > eval2) - (eval1 < eval2)
+def is_dead_hand(top_eval: int, middle_eval: int, bottom_eval: int) -> bool: return top_eval > middle_eval or middle_eval > bottom_eval
+
+# --- Подсчет очков на шоудауне ---
+def evaluate_board(board: List[int]) -> Tuple[int, int, int]:
+    """Силы (топ, середина, низ) полностью заполненной доски из 13 слотов."""
+    return (evaluate_row3(board[0], board[1], board[2]),
+            evaluate_row5(board[3], board[4], board[5], board[6], board[7]),
+            evaluate_row5(board[8], board[9], board[10], board[11], board[12]))
+def board_royalties(evals: Tuple[int, int, int]) -> int:
+    return TOP_ROYALTY_TABLE[evals[0] >> STRENGTH_PRIMARY_SHIFT] + MIDDLE_ROYALTY_TABLE[evals[1] >> STRENGTH_PRIMARY_SHIFT] + BOTTOM_ROYALTY_TABLE[evals[2] >> STRENGTH_PRIMARY_SHIFT]
+def showdown_diff(evals_p0: Tuple[int, int, int], evals_p1: Tuple[int, int, int]) -> int:
+    """Разница очков P0 - P1 за руку: линии, скуп (+3), роялти и штраф за мертвую руку."""
+    dead_p0 = is_dead_hand(*evals_p0); dead_p1 = is_dead_hand(*evals_p1)
+    if dead_p0 and dead_p1: return 0
+    if dead_p0: return -6 - (6 + board_royalties(evals_p1))
+    if dead_p1: return 6 + board_royalties(evals_p0) + 6
+    comp_t = compare_evals(evals_p0[0], evals_p1[0]); comp_m = compare_evals(evals_p0[1], evals_p1[1]); comp_b = compare_evals(evals_p0[2], evals_p1[2])
+    line_score = comp_t + comp_m + comp_b; scoop_bonus = 0
+    if comp_t == 1 and comp_m == 1 and comp_b == 1: scoop_bonus = 3
+    elif comp_t == -1 and comp_m == -1 and comp_b == -1: scoop_bonus = -3
+    return 2 * line_score + scoop_bonus + board_royalties(evals_p0) - board_royalties(evals_p1)
+
+# --- Векторизованный подсчет (NumPy) ---
+# Те же таблицы в виде массивов: ключ ряда по рангам ищется через searchsorted в отсортированных ключах,
+# флеши - прямым индексом по маске рангов. Карты - int-массивы любой формы с последней осью по картам ряда.
+CARD_RANK_KEY_NP = np.array(CARD_RANK_KEY, dtype=np.int64); CARD_RANK_BIT_NP = np.array(CARD_RANK_BIT, dtype=np.int64)
+_ROW3_KEYS_NP = np.array(sorted(_ROW3_STRENGTH), dtype=np.int64); _ROW3_VALUES_NP = np.array([_ROW3_STRENGTH[k] for k in _ROW3_KEYS_NP.tolist()], dtype=np.int64)
+_ROW5_KEYS_NP = np.array(sorted(_ROW5_STRENGTH), dtype=np.int64); _ROW5_VALUES_NP = np.array([_ROW5_STRENGTH[k] for k in _ROW5_KEYS_NP.tolist()], dtype=np.int64)
+_FLUSH5_STRENGTH_NP = np.array(_FLUSH5_STRENGTH, dtype=np.int64)
+TOP_ROYALTY_NP = np.array(TOP_ROYALTY_TABLE, dtype=np.int64); MIDDLE_ROYALTY_NP = np.array(MIDDLE_ROYALTY_TABLE, dtype=np.int64); BOTTOM_ROYALTY_NP = np.array(BOTTOM_ROYALTY_TABLE, dtype=np.int64)
+
+def evaluate_rows3_np(cards: np.ndarray) -> np.ndarray:
+    """Силы топов: cards[..., 3] -> int64[...]."""
+    return _ROW3_VALUES_NP[np.searchsorted(_ROW3_KEYS_NP, CARD_RANK_KEY_NP[cards].sum(axis=-1))]
+def evaluate_rows5_np(cards: np.ndarray) -> np.ndarray:
+    """Силы 5-карточных рядов: cards[..., 5] -> int64[...]."""
+    cards = np.asarray(cards); suits = cards % NUM_SUITS
+    is_flush = (suits == suits[..., :1]).all(axis=-1)
+    strength = _ROW5_VALUES_NP[np.searchsorted(_ROW5_KEYS_NP, CARD_RANK_KEY_NP[cards].sum(axis=-1))]
+    flush_strength = _FLUSH5_STRENGTH_NP[np.bitwise_or.reduce(CARD_RANK_BIT_NP[cards], axis=-1)]
+    return np.where(is_flush, flush_strength, strength)
+def evaluate_boards_np(boards: np.ndarray) -> np.ndarray:
+    """Силы (топ, середина, низ) заполненных досок: boards[..., 13] -> int64[..., 3]."""
+    boards = np.asarray(boards)
+    return np.stack([evaluate_rows3_np(boards[..., TOP_SLOTS[0]:MIDDLE_SLOTS[0]]), evaluate_rows5_np(boards[..., MIDDLE_SLOTS[0]:BOTTOM_SLOTS[0]]),
+                     evaluate_rows5_np(boards[..., BOTTOM_SLOTS[0]:])], axis=-1)
+def hand_category_np(strengths: np.ndarray) -> np.ndarray: return strengths >> STRENGTH_CATEGORY_SHIFT
+def board_royalties_np(evals: np.ndarray) -> np.ndarray:
+    return TOP_ROYALTY_NP[evals[..., 0] >> STRENGTH_PRIMARY_SHIFT] + MIDDLE_ROYALTY_NP[evals[..., 1] >> STRENGTH_PRIMARY_SHIFT] + BOTTOM_ROYALTY_NP[evals[..., 2] >> STRENGTH_PRIMARY_SHIFT]
+def showdown_diff_np(evals_p0: np.ndarray, evals_p1: np.ndarray) -> np.ndarray:
+    """showdown_diff для массивов сил [..., 3] (с broadcasting)."""
+    evals_p0 = np.asarray(evals_p0); evals_p1 = np.asarray(evals_p1)
+    dead_p0 = (evals_p0[..., 0] > evals_p0[..., 1]) | (evals_p0[..., 1] > evals_p0[..., 2])
+    dead_p1 = (evals_p1[..., 0] > evals_p1[..., 1]) | (evals_p1[..., 1] > evals_p1[..., 2])
+    royalties_p0 = board_royalties_np(evals_p0); royalties_p1 = board_royalties_np(evals_p1)
+    comps = np.sign(evals_p0 - evals_p1)
+    scoop_bonus = 3 * (comps == 1).all(axis=-1) - 3 * (comps == -1).all(axis=-1)
+    live_diff = 2 * comps.sum(axis=-1) + scoop_bonus + royalties_p0 - royalties_p1
+    return np.where(dead_p0 & dead_p1, 0, np.where(dead_p0, -12 - royalties_p1, np.where(dead_p1, 12 + royalties_p0, live_diff)))
+
+class BoardScores(NamedTuple):
+    """Результат score_boards для N рук."""
+    diffs: np.ndarray # (N,) очки P0 - P1 (правила _calculate_final_returns)
+    row_evals: np.ndarray # (N, 2, 3) силы рядов (топ, середина, низ)
+    royalties: np.ndarray # (N, 2, 3) роялти по рядам (без учета мертвой руки)
+    fouls: np.ndarray # (N, 2) мертвая рука
+    fantasy: np.ndarray # (N, 2) выход в Fantasyland (условия _check_and_setup_fantasy)
+
+def score_boards(boards: np.ndarray) -> BoardScores:
+    """Пакетный подсчет завершенных рук: boards - (N, 2, 13) карт (int8 или любой целый тип)."""
+    boards = np.asarray(boards)
+    if boards.ndim != 3 or boards.shape[1:] != (NUM_PLAYERS, TOTAL_CARDS_PLACED): raise ValueError(f"Ожидается массив (N, {NUM_PLAYERS}, {TOTAL_CARDS_PLACED}), получено {boards.shape}")
+    if ((boards < 0) | (boards >= NUM_CARDS)).any(): raise ValueError("Доски должны быть полностью заполнены картами 0..51")
+    row_evals = evaluate_boards_np(boards.astype(np.int64)); royalty_idx = row_evals >> STRENGTH_PRIMARY_SHIFT
+    royalties = np.stack([TOP_ROYALTY_NP[royalty_idx[..., 0]], MIDDLE_ROYALTY_NP[royalty_idx[..., 1]], BOTTOM_ROYALTY_NP[royalty_idx[..., 2]]], axis=-1)
+    fouls = (row_evals[..., 0] > row_evals[..., 1]) | (row_evals[..., 1] > row_evals[..., 2])
+    top_category = hand_category_np(row_evals[..., 0]); top_rank = (row_evals[..., 0] >> STRENGTH_PRIMARY_SHIFT) & 0xF
+    fantasy = ~fouls & (((top_category == PAIR) & (top_rank >= FANTASY_TRIGGER_RANK)) | (top_category == THREE_OF_A_KIND))
+    return BoardScores(showdown_diff_np(row_evals[:, 0], row_evals[:, 1]), row_evals, royalties, fouls, fantasy)
+
+# --- Fantasyland: расстановка 14 карт ---
+# Повторная Fantasy (стандартные правила): сет на топе, фулл-хаус и выше в середине или каре и выше внизу.
+# В подсчете очков игры она пока не реализована, поэтому солвер учитывает ее бонусом - оценкой ценности
+# еще одной Fantasy-руки в очках.
+FANTASY_REPEAT_BONUS = 10.0
+FANTASY_HAND_SIZE = 14 # Карт в Fantasy-руке (игра сдает столько всегда; больше солвер не принимает)
+FANTASY_PRIOR_TOP_N = 8 # Сколько лучших расстановок солвера получают вес в fantasy_prior
+FANTASY_PRIOR_TEMPERATURE = 2.0 # Температура softmax по очкам расстановок в fantasy_prior
+
+def solve_fantasyland(cards: List[int], top_n: int = 1, repeat_bonus: float = FANTASY_REPEAT_BONUS) -> List[Tuple[float, Tuple[int, ...], Tuple[int, ...], Tuple[int, ...], Tuple[int, ...]]]:
+    """Лучшие расстановки Fantasy-руки из 13-14 карт: список (очки, топ, середина, низ, сброшенные карты).
+
+    Очки - роялти плюс repeat_bonus за повторную Fantasy; мертвые расстановки отбрасываются. Равные по очкам
+    расстановки упорядочены по силе низа, середины и топа. Поиск с отсечениями: низ перебирается от сильного
+    к слабому, середина - только не сильнее низа, топ - только не сильнее середины, так что мертвые частичные
+    расстановки не строятся. Роялти и условия повторной Fantasy не убывают с силой ряда, поэтому очки низа,
+    середины и лучшего топа не сильнее ее ограничивают сверху всю ветку: как только граница не выше худшей
+    из top_n найденных расстановок, перебор на этом уровне прекращается (дальше ряды только слабее).
+    """
+    cards = list(cards); n = len(cards)
+    if n < TOTAL_CARDS_PLACED or n > FANTASY_HAND_SIZE: raise ValueError(f"Fantasy-солвер ожидает от {TOTAL_CARDS_PLACED} до {FANTASY_HAND_SIZE} карт, получено {n}")
+    # 5- и 3-карточные подмножества руки (маски позиций) по убыванию силы
+    cards_np = np.array(cards, dtype=np.int64); bits = 1 << np.arange(n, dtype=np.int64)
+    subsets5 = np.array(list(itertools.combinations(range(n), 5)), dtype=np.int64); strength5 = evaluate_rows5_np(cards_np[subsets5])
+    subsets3 = np.array(list(itertools.combinations(range(n), 3)), dtype=np.int64); strength3 = evaluate_rows3_np(cards_np[subsets3])
+    order5 = np.argsort(-strength5, kind="stable"); order3 = np.argsort(-strength3, kind="stable")
+    strength5 = strength5[order5]; strength3 = strength3[order3]; masks5 = bits[subsets5].sum(axis=1)[order5].tolist(); masks3 = bits[subsets3].sum(axis=1)[order3].tolist()
+    royalty_bottom = BOTTOM_ROYALTY_NP[strength5 >> STRENGTH_PRIMARY_SHIFT]; royalty_middle = MIDDLE_ROYALTY_NP[strength5 >> STRENGTH_PRIMARY_SHIFT]; royalty_top = TOP_ROYALTY_NP[strength3 >> STRENGTH_PRIMARY_SHIFT]
+    repeat_bottom = hand_category_np(strength5) >= FOUR_OF_A_KIND; repeat_middle = hand_category_np(strength5) >= FULL_HOUSE; repeat_top = hand_category_np(strength3) == THREE_OF_A_KIND
+    # Граница ряда - его роялти плюс бонус, если ряд сам дает повторную Fantasy (сумма по рядам не меньше очков)
+    bound_bottom = (royalty_bottom + repeat_bonus * repeat_bottom).tolist(); bound_middle = (royalty_middle + repeat_bonus * repeat_middle).tolist(); bound_top = (royalty_top + repeat_bonus * repeat_top).tolist()
+    royalty_bottom = royalty_bottom.tolist(); royalty_middle = royalty_middle.tolist(); royalty_top = royalty_top.tolist()
+    repeat_bottom = repeat_bottom.tolist(); repeat_middle = repeat_middle.tolist(); repeat_top = repeat_top.tolist()
+    strength5 = strength5.tolist(); strength3 = strength3.tolist(); neg_strength5 = [-s for s in strength5]; neg_strength3 = [-s for s in strength3]
+    top_by_mask = {mask: i for i, mask in enumerate(masks3)}; rest_choices = list(itertools.combinations(range(n - 10), 3)); full_mask = (1 << n) - 1
+
+    best = []; threshold = None # Мин-куча ((очки, силы низа, середины, топа), индексы рядов) и худший ключ полной кучи
+    for b, bottom_strength in enumerate(strength5):
+        m_first = bisect.bisect_left(neg_strength5, -bottom_strength); t_first = bisect.bisect_left(neg_strength3, -bottom_strength)
+        if t_first == len(strength3): continue
+        bound = bound_bottom[b] + bound_middle[m_first] + bound_top[t_first]
+        if threshold is not None and (bound, bottom_strength, bottom_strength, bottom_strength) <= threshold: break
+        bottom_mask = masks5[b]
+        for m in range(m_first, len(strength5)):
+            middle_mask = masks5[m]
+            if middle_mask & bottom_mask: continue
+            middle_strength = strength5[m]; t_first = bisect.bisect_left(neg_strength3, -middle_strength)
+            if t_first == len(strength3): break
+            bound = bound_bottom[b] + bound_middle[m] + bound_top[t_first]
+            if threshold is not None and (bound, bottom_strength, middle_strength, middle_strength) <= threshold: break
+            rest = full_mask ^ bottom_mask ^ middle_mask; positions = [j for j in range(n) if rest >> j & 1]
+            for choice in rest_choices:
+                t = top_by_mask[(1 << positions[choice[0]]) | (1 << positions[choice[1]]) | (1 << positions[choice[2]])]
+                if strength3[t] > middle_strength: continue
+                score = royalty_bottom[b] + royalty_middle[m] + royalty_top[t] + repeat_bonus * (repeat_bottom[b] or repeat_middle[m] or repeat_top[t])
+                key = (score, bottom_strength, middle_strength, strength3[t])
+                if threshold is not None and key <= threshold: continue
+                if len(best) < top_n: heapq.heappush(best, (key, b, m, t))
+                else: heapq.heapreplace(best, (key, b, m, t))
+                if len(best) == top_n: threshold = best[0][0]
+    solutions = []
+    for (score, *_), b, m, t in sorted(best, reverse=True):
+        used = masks5[b] | masks5[m] | masks3[t]
+        solutions.append((float(score), *(tuple(cards[j] for j in range(n) if mask >> j & 1) for mask in (masks3[t], masks5[m], masks5[b])),
+                          tuple(cards[j] for j in range(n) if not used >> j & 1)))
+    return solutions
+
+def fantasy_prior(state: 'OFCPineappleState', top_n: int = FANTASY_PRIOR_TOP_N, temperature: float = FANTASY_PRIOR_TEMPERATURE) -> List[Tuple[int, float]]:
+    """Prior для Fantasy-игрока в PHASE_FANTASY_F_PLACE: softmax очков top_n лучших расстановок солвера
+    в формате evaluator.prior ([(действие, вероятность)]); вне этой фазы - пустой список.
+    Легальных расстановок в Fantasy около миллиона, поэтому оценщикам стоит брать prior отсюда, а не перебирать их."""
+    solutions = state.fantasy_solver_actions(top_n)
+    if not solutions: return []
+    scores = np.array([score for score, _ in solutions]) / max(temperature, 1e-9)
+    probs = np.exp(scores - scores.max()); probs /= probs.sum()
+    return [(action, prob) for (_, action), prob in zip(solutions, probs.tolist())]
+
+# --- Zobrist-хэширование инфостейтов ---
+# Ключ инфостейта - XOR 64-битных случайных чисел по всем его компонентам. Карточные компоненты
+# (доски, руки, сбросы) поддерживаются инкрементально в OFCPineappleState._zobrist, остальные
+# (фаза, счетчики, статус Fantasy) добавляются при запросе ключа.
+Z_BOARD = 0; Z_OPP_BOARD = Z_BOARD + NUM_PLAYERS; Z_HAND = Z_OPP_BOARD + NUM_PLAYERS; Z_DISCARD = Z_HAND + NUM_PLAYERS; NUM_ZOBRIST_PARTS = Z_DISCARD + NUM_PLAYERS
+_ZOBRIST_RNG = random.Random(0x0FC0FC)
+def _zobrist_table(size: int) -> List[int]: return [_ZOBRIST_RNG.getrandbits(64) for _ in range(size)]
+ZOBRIST_BOARD = _zobrist_table(TOTAL_CARDS_PLACED * NUM_CARDS); ZOBRIST_OPP_BOARD = _zobrist_table(TOTAL_CARDS_PLACED * NUM_CARDS)
+ZOBRIST_HAND = _zobrist_table(NUM_CARDS); ZOBRIST_OPP_HAND = _zobrist_table(NUM_CARDS); ZOBRIST_DISCARD = _zobrist_table(NUM_CARDS)
+ZOBRIST_PLAYER = _zobrist_table(NUM_PLAYERS); ZOBRIST_PHASE = _zobrist_table(PHASE_FANTASY_SHOWDOWN + 1)
+ZOBRIST_PLACE_COUNT = _zobrist_table(16); ZOBRIST_DISCARD_COUNT = _zobrist_table(4)
+ZOBRIST_NEXT_FANTASY = _zobrist_table(NUM_PLAYERS); ZOBRIST_CUR_FANTASY = _zobrist_table(NUM_PLAYERS); ZOBRIST_CUR_NORMAL = _zobrist_table(NUM_PLAYERS)
+ZOBRIST_FANTASY_HAND, ZOBRIST_OPP_HIDDEN, ZOBRIST_GAME_OVER = _zobrist_table(3)
+
+# --- Изоморфизм мастей ---
+# Исход OFC не зависит от перестановки мастей. Для каждой из 24 перестановок perm (perm[старая] = новая)
+# заранее строится отображение карт, чтобы перемаркировка инфостейта и действий была табличной.
+SUIT_PERMUTATIONS = list(itertools.permutations(range(NUM_SUITS)))
+SUIT_PERMUTATION_CARD_MAPS = {perm: [(c // NUM_SUITS) * NUM_SUITS + perm[c % NUM_SUITS] for c in range(NUM_CARDS)] for perm in SUIT_PERMUTATIONS}
+IDENTITY_SUIT_PERMUTATION = tuple(range(NUM_SUITS))
+
+# --- Глобальные номера действий ---
+# Номер действия не зависит от состояния: он кодирует цели размещаемых карт отсортированной руки и индекс
+# сбрасываемой карты в ней, причем нумеруются только осуществимые размещения. Блоки номеров:
+#   улица 1 (5 карт)       - ранг целей: кортежи рядов, помещающиеся на пустую доску (row_actions), или
+#                            упорядоченные наборы различных слотов (13 * 12 * 11 * 10 * 9);
+#   улицы 2-5 (2 карты)    - индекс сброса * число целей 2 карт + ранг целей (9 кортежей рядов или 13 * 12 пар слотов);
+#   Fantasy F (13 карт)    - индекс сброса * C(13, 3) * C(10, 5) + ранг разбиения руки на ряды (топ - 3 позиции руки,
+#                            середина - 5 из оставшихся; цели всегда ряды, карты ряда занимают его слоты в порядке руки).
+# Ранги возрастают в порядке itertools.product/permutations/combinations, поэтому номера легальных действий
+# получаются уже отсортированными. Таблицы целей (TARGET_TABLES) - массивы NumPy, по которым legal_actions
+# отбирает цели, помещающиеся на текущую доску, без перебора и кодирования каждого действия.
+class ActionLayout(NamedTuple):
+    num_place5: int # целей улицы 1
+    num_place2: int # целей улиц 2-5 (на один индекс сброса)
+    place2_offset: int # начало блока улиц 2-5
+    fantasy_offset: int # начало блока Fantasy F
+    num_actions: int # всего номеров
+
+def _fits_empty_board(rows) -> bool: return all(rows.count(row) <= ROW_SIZES[row] for row in range(NUM_ROWS))
+ROW_TARGETS = {num_cards: [rows for rows in itertools.product(range(NUM_ROWS), repeat=num_cards) if _fits_empty_board(rows)] for num_cards in (5, 2)}
+ROW_TARGET_RANKS = {num_cards: {rows: rank for rank, rows in enumerate(targets)} for num_cards, targets in ROW_TARGETS.items()}
+FANTASY_TOP_CHOICES = list(itertools.combinations(range(TOTAL_CARDS_PLACED), TOP_ROW_SIZE))
+FANTASY_MIDDLE_CHOICES = list(itertools.combinations(range(MIDDLE_ROW_SIZE + BOTTOM_ROW_SIZE), MIDDLE_ROW_SIZE))
+FANTASY_TOP_RANKS = {positions: rank for rank, positions in enumerate(FANTASY_TOP_CHOICES)}; FANTASY_MIDDLE_RANKS = {positions: rank for rank, positions in enumerate(FANTASY_MIDDLE_CHOICES)}
+NUM_FANTASY_PARTITIONS = len(FANTASY_TOP_CHOICES) * len(FANTASY_MIDDLE_CHOICES)
+
+def _action_layout(row_actions: bool) -> ActionLayout:
+    num_place5 = len(ROW_TARGETS[5]) if row_actions else math.perm(TOTAL_CARDS_PLACED, 5)
+    num_place2 = len(ROW_TARGETS[2]) if row_actions else math.perm(TOTAL_CARDS_PLACED, 2)
+    fantasy_offset = num_place5 + 3 * num_place2
+    return ActionLayout(num_place5, num_place2, num_place5, fantasy_offset, fantasy_offset + FANTASY_HAND_SIZE * NUM_FANTASY_PARTITIONS)
+ACTION_LAYOUTS = {row_actions: _action_layout(row_actions) for row_actions in (False, True)}
+def num_distinct_actions(row_actions: bool) -> int: return ACTION_LAYOUTS[row_actions].num_actions
+
+def _rank_slots(slots) -> int:
+    """Ранг упорядоченного набора различных слотов: смешанная система счисления (13, 12, ...) по номерам среди свободных."""
+    rank = 0; used = 0
+    for i, slot in enumerate(slots):
+        if not 0 <= slot < TOTAL_CARDS_PLACED or used >> slot & 1: raise ValueError(f"Неверные слоты: {slots}")
+        rank = rank * (TOTAL_CARDS_PLACED - i) + slot - bin(used & ((1 << slot) - 1)).count("1"); used |= 1 << slot
+    return rank
+
+def _rank_targets(targets, row_actions: bool) -> int:
+    num_targets = len(targets)
+    if row_actions:
+        rank = ROW_TARGET_RANKS[num_targets].get(tuple(targets))
+        if rank is None: raise ValueError(f"Ряды {targets} не помещаются на доску")
+        return rank
+    return _rank_slots(targets)
+def _unrank_targets(rank: int, num_targets: int, row_actions: bool) -> Tuple[int, ...]:
+    # Таблица перестановок слотов упорядочена по рангу (см. TARGET_TABLES), поэтому обратный ранг - строка таблицы
+    return ROW_TARGETS[num_targets][rank] if row_actions else tuple(TARGET_TABLES[num_targets, False][rank].tolist())
+
+def _rank_fantasy_rows(rows) -> int:
+    top = tuple(i for i, row in enumerate(rows) if row == ROW_TOP); rest = [row for row in rows if row != ROW_TOP]
+    middle = tuple(i for i, row in enumerate(rest) if row == ROW_MIDDLE)
+    top_rank = FANTASY_TOP_RANKS.get(top); middle_rank = FANTASY_MIDDLE_RANKS.get(middle)
+    if top_rank is None or middle_rank is None or len(rows) != TOTAL_CARDS_PLACED or not all(0 <= row < NUM_ROWS for row in rows): raise ValueError(f"Ряды {rows} не разбивают руку на топ, середину и низ")
+    return top_rank * len(FANTASY_MIDDLE_CHOICES) + middle_rank
+def _unrank_fantasy_rows(rank: int) -> Tuple[int, ...]:
+    top_rank, middle_rank = divmod(rank, len(FANTASY_MIDDLE_CHOICES)); rows = [ROW_BOTTOM] * TOTAL_CARDS_PLACED
+    for i in FANTASY_TOP_CHOICES[top_rank]: rows[i] = ROW_TOP
+    rest = [i for i in range(TOTAL_CARDS_PLACED) if rows[i] != ROW_TOP]
+    for j in FANTASY_MIDDLE_CHOICES[middle_rank]: rows[rest[j]] = ROW_MIDDLE
+    return tuple(rows)
+
+def encode_action(targets, discard_idx: int, row_actions: bool) -> int:
+    """Номер действия: targets - цели размещаемых карт руки по порядку (без сброшенной), discard_idx - индекс сброса в руке или -1."""
+    layout = ACTION_LAYOUTS[row_actions]; num_targets = len(targets)
+    if num_targets == 5 and discard_idx == -1: return _rank_targets(targets, row_actions)
+    if num_targets == 2 and 0 <= discard_idx < 3: return layout.place2_offset + discard_idx * layout.num_place2 + _rank_targets(targets, row_actions)
+    if num_targets == TOTAL_CARDS_PLACED and 0 <= discard_idx < FANTASY_HAND_SIZE: return layout.fantasy_offset + discard_idx * NUM_FANTASY_PARTITIONS + _rank_fantasy_rows(targets)
+    raise ValueError(f"Нет номера для действия: цели {targets}, сброс {discard_idx}")
+
+def decode_action(action_id: int, row_actions: bool) -> Tuple[Tuple[int, ...], int]:
+    """Обратное к encode_action: (цели, индекс сброса или -1)."""
+    layout = ACTION_LAYOUTS[row_actions]
+    if not 0 <= action_id < layout.num_actions: raise ValueError(f"Номер действия вне диапазона [0, {layout.num_actions}): {action_id}")
+    if action_id < layout.place2_offset: return _unrank_targets(action_id, 5, row_actions), -1
+    if action_id < layout.fantasy_offset: discard_idx, rank = divmod(action_id - layout.place2_offset, layout.num_place2); return _unrank_targets(rank, 2, row_actions), discard_idx
+    discard_idx, rank = divmod(action_id - layout.fantasy_offset, NUM_FANTASY_PARTITIONS)
+    return _unrank_fantasy_rows(rank), discard_idx
+
+# Таблицы целей по рангу для legal_actions: слоты целей (слотовый режим) или число карт в каждом ряду (row_actions)
+def _target_table(num_cards: int, row_actions: bool) -> np.ndarray:
+    if row_actions: return np.array([[rows.count(row) for row in range(NUM_ROWS)] for rows in ROW_TARGETS[num_cards]], dtype=np.int8)
+    # Перестановки слотов в лексикографическом порядке (как itertools.permutations), достраиваемые по одной позиции
+    slots = np.arange(TOTAL_CARDS_PLACED, dtype=np.int8); perms = slots[:, None]
+    for _ in range(num_cards - 1):
+        prefix_idx, next_slot = np.nonzero((perms[:, :, None] != slots).all(axis=1))
+        perms = np.concatenate([perms[prefix_idx], slots[next_slot, None]], axis=1)
+    return perms
+TARGET_TABLES = {(num_cards, row_actions): _target_table(num_cards, row_actions) for num_cards in (5, 2) for row_actions in (False, True)}
+
+def fitting_target_ranks(num_cards: int, row_actions: bool, board: List[int]) -> np.ndarray:
+    """Ранги (по возрастанию) целей num_cards карт, помещающихся на доску board."""
+    table = TARGET_TABLES[num_cards, row_actions]
+    if row_actions: free = np.array([sum(1 for slot in row_slots if board[slot] == -1) for row_slots in ROW_SLOTS]); return np.flatnonzero((table <= free).all(axis=1))
+    free = np.array(board) == -1
+    return np.arange(len(table)) if free.all() else np.flatnonzero(free[table].all(axis=1))
+
+# Ряды карт отсортированной 13-карточной руки для каждого ранга разбиения Fantasy F и обратные таблицы рангов
+# по маскам позиций топа (из 13) и середины (из 10 оставшихся) - для канонических действий Fantasy F.
+def _fantasy_rows_table() -> np.ndarray:
+    top = np.array(FANTASY_TOP_CHOICES); middle = np.array(FANTASY_MIDDLE_CHOICES)
+    rest = np.array([[i for i in range(TOTAL_CARDS_PLACED) if i not in positions] for positions in FANTASY_TOP_CHOICES])
+    rows = np.full((len(top), len(middle), TOTAL_CARDS_PLACED), ROW_BOTTOM, dtype=np.int8)
+    np.put_along_axis(rows, np.broadcast_to(top[:, None, :], (len(top), len(middle), TOP_ROW_SIZE)), ROW_TOP, axis=2)
+    np.put_along_axis(rows, rest[:, middle], ROW_MIDDLE, axis=2)
+    return rows.reshape(NUM_FANTASY_PARTITIONS, TOTAL_CARDS_PLACED)
+FANTASY_ROWS_TABLE = _fantasy_rows_table()
+FANTASY_TOP_RANK_BY_MASK = np.full(1 << TOTAL_CARDS_PLACED, -1, dtype=np.int64); FANTASY_TOP_RANK_BY_MASK[[sum(1 << i for i in positions) for positions in FANTASY_TOP_CHOICES]] = np.arange(len(FANTASY_TOP_CHOICES))
+FANTASY_MIDDLE_RANK_BY_MASK = np.full(1 << (MIDDLE_ROW_SIZE + BOTTOM_ROW_SIZE), -1, dtype=np.int64); FANTASY_MIDDLE_RANK_BY_MASK[[sum(1 << i for i in positions) for positions in FANTASY_MIDDLE_CHOICES]] = np.arange(len(FANTASY_MIDDLE_CHOICES))
+
+def fantasy_action_ids(hand_size: int, row_actions: bool, positions: Optional[List[int]] = None) -> np.ndarray:
+    """Номера всех действий Fantasy F для руки из hand_size карт, по возрастанию. С positions (positions[i] - новая
+    позиция i-й карты руки) - номера тех же расстановок, пересчитанные к переставленной руке (в том же порядке)."""
+    offset = ACTION_LAYOUTS[row_actions].fantasy_offset
+    if positions is None: return np.arange(offset, offset + hand_size * NUM_FANTASY_PARTITIONS)
+    top_bits = 1 << np.arange(TOTAL_CARDS_PLACED); middle_bits = 1 << np.arange(MIDDLE_ROW_SIZE + BOTTOM_ROW_SIZE); blocks = []
+    for discard_idx in range(hand_size):
+        moved = np.empty((NUM_FANTASY_PARTITIONS, hand_size), dtype=np.int8); moved[:, positions] = np.insert(FANTASY_ROWS_TABLE, discard_idx, NUM_ROWS, axis=1)
+        new_discard_idx = positions[discard_idx]; rows = np.delete(moved, new_discard_idx, axis=1); is_top = rows == ROW_TOP
+        top_rank = FANTASY_TOP_RANK_BY_MASK[is_top @ top_bits]
+        middle_rank = FANTASY_MIDDLE_RANK_BY_MASK[(rows[~is_top].reshape(NUM_FANTASY_PARTITIONS, -1) == ROW_MIDDLE) @ middle_bits]
+        blocks.append(offset + new_discard_idx * NUM_FANTASY_PARTITIONS + top_rank * len(FANTASY_MIDDLE_CHOICES) + middle_rank)
+    return np.concatenate(blocks)
 
 # --- Классы Игры и Состояния ---
 # ... (GameType и OFCPineappleGame без изменений) ...
-_GAME_TYPE = pyspiel.GameType(short_name="ofc_pineapple", long_name="Open Face Chinese Poker Pineapple", dynamics=pyspiel.GameType.Dynamics.SEQUENTIAL, chance_mode=pyspiel.GameType.ChanceMode.EXPLICIT_STOCHASTIC, information=pyspiel.GameType.Information.IMPERFECT_INFORMATION, utility=pyspiel.GameType.Utility.ZERO_SUM, reward_model=pyspiel.GameType.RewardModel.TERMINAL, max_num_players=NUM_PLAYERS, min_num_players=NUM_PLAYERS, provides_information_state_string=True, provides_information_state_tensor=False, provides_observation_string=True, provides_observation_tensor=False, parameter_specification={"num_players": NUM_PLAYERS})
+_GAME_TYPE = pyspiel.GameType(short_name="ofc_pineapple", long_name="Open Face Chinese Poker Pineapple", dynamics=pyspiel.GameType.Dynamics.SEQUENTIAL, chance_mode=pyspiel.GameType.ChanceMode.EXPLICIT_STOCHASTIC, information=pyspiel.GameType.Information.IMPERFECT_INFORMATION, utility=pyspiel.GameType.Utility.ZERO_SUM, reward_model=pyspiel.GameType.RewardModel.TERMINAL, max_num_players=NUM_PLAYERS, min_num_players=NUM_PLAYERS, provides_information_state_string=True, provides_information_state_tensor=True, provides_observation_string=True, provides_observation_tensor=True, parameter_specification={"num_players": NUM_PLAYERS, "row_actions": False})
 class OFCPineappleGame(pyspiel.Game):
     def __init__(self, params: Dict[str, Any] = None):
-        game_info = pyspiel.GameInfo(num_distinct_actions=-1, max_chance_outcomes=NUM_CARDS, num_players=NUM_PLAYERS, min_utility=-250.0, max_utility=250.0, max_game_length=150) # Увеличено для Fantasy
+        row_actions = bool((params or {}).get("row_actions", _GAME_TYPE.parameter_specification["row_actions"]))
+        game_info = pyspiel.GameInfo(num_distinct_actions=num_distinct_actions(row_actions), max_chance_outcomes=NUM_CARDS, num_players=NUM_PLAYERS, min_utility=-250.0, max_utility=250.0, max_game_length=150) # Увеличено для Fantasy
         super().__init__(_GAME_TYPE, game_info, params or {})
+        # row_actions=True: действие - назначение "карта -> ряд" (слоты одного ряда взаимозаменяемы),
+        # конкретный слот выбирается детерминированно в apply_action.
+        self.row_actions = bool(self.get_parameters().get("row_actions", False))
     def new_initial_state(self): return OFCPineappleState(self)
-    def make_py_observer(self, iig_obs_type=None, params=None): return None
+    def make_py_observer(self, iig_obs_type=None, params=None): return OFCPineappleObserver(iig_obs_type or pyspiel.IIGObservationType(perfect_recall=False), params)
+
+def _new_uninitialized_state(cls, game):
+    """Создает объект состояния без вызова __init__ (инициализируется только базовый pyspiel.State)."""
+    state = cls.__new__(cls); pyspiel.State.__init__(state, game); return state
 
 class OFCPineappleState(pyspiel.State):
     # ... (__init__ без изменений) ...
@@ -146,13 +510,14 @@ class OFCPineappleState(pyspiel.State):
         self._cards_to_place_count = [0] * NUM_PLAYERS; self._cards_to_discard_count = [0] * NUM_PLAYERS
         self._total_cards_placed = [0] * NUM_PLAYERS; self._game_over = False
         self._cumulative_returns = [0.0] * NUM_PLAYERS; self._current_hand_returns = [0.0] * NUM_PLAYERS
-        self._cached_legal_actions: Optional[List[Any]] = None
+        self._cached_legal_action_ids: Optional[Tuple[int, ...]] = None; self._cached_canonical_actions: Optional[Tuple[Any, ...]] = None
         self._is_fantasy_hand = False; self._next_fantasy_players: List[int] = []
         self._current_fantasy_player: Optional[int] = None; self._current_normal_player: Optional[int] = None
-        self._fantasy_cards_count = 14
+        self._fantasy_cards_count = FANTASY_HAND_SIZE; self._row_actions = game.row_actions
+        self._zobrist = [0] * NUM_ZOBRIST_PARTS; self._reset_row_stats()
         self._go_to_next_phase()
 
-    def _clear_cache(self): self._cached_legal_actions = None
+    def _clear_cache(self): self._cached_legal_action_ids = None; self._cached_canonical_actions = None
 
     # ИСПРАВЛЕНО v14: Возвращена корректная логика завершения игры
     def _go_to_next_phase(self):
@@ -245,18 +610,53 @@ class OFCPineappleState(pyspiel.State):
         self._current_cards = [[] for _ in range(NUM_PLAYERS)]; self._discards = [[] for _ in range(NUM_PLAYERS)]
         self._cards_to_place_count = [0] * NUM_PLAYERS; self._cards_to_discard_count = [0] * NUM_PLAYERS
         self._total_cards_placed = [0] * NUM_PLAYERS; self._current_hand_returns = [0.0] * NUM_PLAYERS
-        self._cached_legal_actions = None; self._is_fantasy_hand = False
-        self._current_fantasy_player = None; self._current_normal_player = None
+        self._cached_legal_action_ids = None; self._cached_canonical_actions = None; self._is_fantasy_hand = False
+        self._current_fantasy_player = None; self._current_normal_player = None; self._zobrist = [0] * NUM_ZOBRIST_PARTS
+        self._reset_row_stats()
         if not keep_fantasy_status:
             self._next_fantasy_players = []
 
+    # Статистики рядов копятся по мере выкладки карт в apply_action в одном плоском списке _row_stats
+    # (ряд player * NUM_ROWS + row занимает NUM_ROW_STATS элементов, см. ROW_STAT_*), чтобы clone копировал
+    # один список. Когда ряд заполнен, его сила сохраняется в ROW_STAT_EVAL и переиспользуется шоудауном,
+    # проверкой Fantasy и эвристиками.
+    def _reset_row_stats(self):
+        self._row_stats = [0, 0, 0, ALL_SUITS_MASK, None] * (NUM_PLAYERS * NUM_ROWS)
+
+    def _add_card_to_row_stats(self, player: int, slot_idx: int, card: int):
+        row = SLOT_ROW[slot_idx]; base = (player * NUM_ROWS + row) * NUM_ROW_STATS; stats = self._row_stats
+        stats[base + ROW_STAT_COUNT] += 1; stats[base + ROW_STAT_RANK_KEY] += CARD_RANK_KEY[card]; stats[base + ROW_STAT_RANK_BITS] |= CARD_RANK_BIT[card]; stats[base + ROW_STAT_SUIT_MASK] &= CARD_SUIT_BIT[card]
+        if stats[base + ROW_STAT_COUNT] == ROW_SIZES[row]: stats[base + ROW_STAT_EVAL] = finalize_row_strength(row, stats[base + ROW_STAT_RANK_KEY], stats[base + ROW_STAT_RANK_BITS], stats[base + ROW_STAT_SUIT_MASK])
+
+    def _recompute_row_stats(self):
+        """Пересчитывает статистики рядов по доскам (после материализации из компактного состояния)."""
+        self._reset_row_stats()
+        for p in range(NUM_PLAYERS):
+            for slot_idx, card in enumerate(self._board[p]):
+                if card != -1: self._add_card_to_row_stats(p, slot_idx, card)
+
+    def row_stats(self, player: int, row: int) -> Tuple[int, int, int, int, Optional[int]]:
+        """(число карт, сумма CARD_RANK_KEY, OR CARD_RANK_BIT, AND CARD_SUIT_BIT, сила или None) ряда."""
+        base = (player * NUM_ROWS + row) * NUM_ROW_STATS
+        return tuple(self._row_stats[base:base + NUM_ROW_STATS])
+
+    def row_eval(self, player: int, row: int) -> Optional[int]:
+        """Сила ряда, если он заполнен (иначе None)."""
+        return self._row_stats[(player * NUM_ROWS + row) * NUM_ROW_STATS + ROW_STAT_EVAL]
+
+    def board_evals(self, player: int) -> Optional[Tuple[int, int, int]]:
+        """Силы (топ, середина, низ) заполненной доски player или None, если доска не заполнена."""
+        base = player * NUM_ROWS * NUM_ROW_STATS + ROW_STAT_EVAL
+        evals = self._row_stats[base:base + NUM_ROWS * NUM_ROW_STATS:NUM_ROW_STATS]
+        return None if None in evals else tuple(evals)
+
     def current_player(self): return self._current_player
     def is_chance_node(self): return self._current_player == pyspiel.PlayerId.CHANCE
     def is_terminal(self): return self._game_over
 
     # ИСПРАВЛЕНО v15: Корректная проверка player_for_actions
     def legal_actions(self, player: Optional[int] = None) -> List[int]:
-        """Возвращает список индексов легальных действий."""
+        """Возвращает отсортированный список глобальных номеров легальных действий (см. encode_action)."""
         current_player = self.current_player()
 
         if player is None:
@@ -276,69 +676,68 @@ class OFCPineappleState(pyspiel.State):
             return []
 
         # Используем кэш, если он есть (он всегда для текущего игрока)
-        if self._cached_legal_actions is not None:
-            return list(range(len(self._cached_legal_actions)))
+        if self._cached_legal_action_ids is not None:
+            return list(self._cached_legal_action_ids)
 
-        # Генерируем кортежи действий для player_for_actions (который равен current_player)
-        actions_tuples = self._generate_legal_actions_tuples(player_for_actions)
-        self._cached_legal_actions = actions_tuples
-        return list(range(len(actions_tuples)))
+        self._cached_legal_action_ids = self._generate_legal_action_ids(player_for_actions)
+        return list(self._cached_legal_action_ids)
 
     # ИЗМЕНЕНО v15: Добавлена обработка фаз Fantasyland N
-    def _generate_legal_actions_tuples(self, player):
-        actions = []
+    def _generate_legal_action_ids(self, player) -> Tuple[int, ...]:
+        """Отсортированные глобальные номера легальных действий: ранги целей, помещающихся на доску (см. TARGET_TABLES)."""
         is_normal_place_phase = (self._phase >= STREET_FIRST_PLACE_P1 and self._phase <= STREET_FIFTH_PLACE_P2 and self._phase % 2 == 0)
         is_fantasy_n_place_phase = (self._phase >= PHASE_FANTASY_N_PLACE_1 and self._phase <= PHASE_FANTASY_N_PLACE_5 and self._phase % 2 == 0)
         is_fantasy_f_place_phase = (self._phase == PHASE_FANTASY_F_PLACE)
 
-        if not (is_normal_place_phase or is_fantasy_n_place_phase or is_fantasy_f_place_phase): return []
+        if not (is_normal_place_phase or is_fantasy_n_place_phase or is_fantasy_f_place_phase): return ()
 
-        my_cards = self._current_cards[player]; num_cards_in_hand = len(my_cards)
+        num_cards_in_hand = len(self._current_cards[player]); board = self._board[player]; layout = ACTION_LAYOUTS[self._row_actions]
         num_to_place = self._cards_to_place_count[player]; num_to_discard = self._cards_to_discard_count[player]
-        if num_cards_in_hand != num_to_place + num_to_discard: return []
-        free_slots_indices = [i for i, card in enumerate(self._board[player]) if card == -1]; num_free_slots = len(free_slots_indices)
-        if num_free_slots < num_to_place: return []
+        if num_cards_in_hand != num_to_place + num_to_discard: return ()
+        if board.count(-1) < num_to_place: return ()
 
         if is_normal_place_phase or is_fantasy_n_place_phase:
             if num_to_discard == 0: # Улица 1 (обычная или N в Fantasy)
-                if num_cards_in_hand != 5 or num_to_place != 5: return []
-                for slots in itertools.permutations(free_slots_indices, num_to_place):
-                     action = tuple((my_cards[i], slots[i]) for i in range(num_to_place)); actions.append(action)
-            else: # Улицы 2-5 (обычная или N в Fantasy)
-                if num_cards_in_hand != 3 or num_to_place != 2 or num_to_discard != 1: return []
-                for discard_idx in range(num_cards_in_hand):
-                    card_discard = my_cards[discard_idx]; cards_to_place = my_cards[:discard_idx] + my_cards[discard_idx+1:]
-                    for slots in itertools.permutations(free_slots_indices, num_to_place):
-                        placement = tuple((cards_to_place[i], slots[i]) for i in range(num_to_place)); action = (placement, card_discard); actions.append(action)
-        elif is_fantasy_f_place_phase:
-             if num_cards_in_hand != self._fantasy_cards_count or num_to_place != 13 or num_to_discard != 1: print(f"Warning: Несоответствие карт для Fantasy F: рука={num_cards_in_hand}, надо_мест={num_to_place}, надо_сброс={num_to_discard}"); return []
-             print("Warning: Генерация действий Fantasyland F не реализована, возвращено фиктивное действие.")
-             if free_slots_indices and len(free_slots_indices) >= 13 and my_cards:
-                 placement = tuple((my_cards[i], free_slots_indices[i]) for i in range(13)); discard = my_cards[13]; actions.append((placement, discard))
-             else: return []
+                if num_cards_in_hand != 5 or num_to_place != 5: return ()
+                return tuple(fitting_target_ranks(5, self._row_actions, board).tolist())
+            # Улицы 2-5 (обычная или N в Fantasy): блоки по индексу сброса
+            if num_cards_in_hand != 3 or num_to_place != 2 or num_to_discard != 1: return ()
+            ranks = fitting_target_ranks(2, self._row_actions, board) + layout.place2_offset
+            return tuple(np.concatenate([ranks + discard_idx * layout.num_place2 for discard_idx in range(num_cards_in_hand)]).tolist())
+        if num_cards_in_hand != self._fantasy_cards_count or num_to_place != 13 or num_to_discard != 1: print(f"Warning: Несоответствие карт для Fantasy F: рука={num_cards_in_hand}, надо_мест={num_to_place}, надо_сброс={num_to_discard}"); return ()
+        if board.count(-1) != TOTAL_CARDS_PLACED: return ()
+        # Все разбиения руки на ряды при каждом сбросе (около миллиона номеров; prior для поиска - fantasy_prior)
+        return tuple(fantasy_action_ids(num_cards_in_hand, self._row_actions).tolist())
+
+    def fantasy_solver_actions(self, top_n: int = 1) -> List[Tuple[float, int]]:
+        """Лучшие расстановки solve_fantasyland для Fantasy-игрока в PHASE_FANTASY_F_PLACE: [(очки, номер действия)]
+        по убыванию очков; в других фазах - пустой список."""
+        if self._phase != PHASE_FANTASY_F_PLACE or self._current_player < 0: return []
+        hand = self._current_cards[self._current_player]; actions = []
+        for score, top, middle, bottom, discarded in solve_fantasyland(hand, top_n):
+            row_of = {card: row for row, row_cards in enumerate((top, middle, bottom)) for card in row_cards}
+            actions.append((score, encode_action([row_of[card] for card in hand if card not in discarded], hand.index(discarded[0]), self._row_actions)))
         return actions
 
     # ИЗМЕНЕНО v15: Добавлена обработка фаз Fantasyland
     def apply_action(self, action_index_or_outcome):
         if self.is_chance_node():
-            player = self._player_to_deal_to; num_cards_to_deal = 0
-            # Определяем, сколько карт сдавать в зависимости от фазы
-            if self._phase in [STREET_FIRST_DEAL_P1, STREET_FIRST_DEAL_P2, PHASE_FANTASY_N_DEAL_1]: num_cards_to_deal = 5
-            elif (self._phase >= STREET_SECOND_DEAL_P1 and self._phase <= STREET_FIFTH_PLACE_P2 and self._phase % 2 != 0) or \
-                 (self._phase >= PHASE_FANTASY_N_DEAL_2 and self._phase <= PHASE_FANTASY_N_PLACE_5 and self._phase % 2 != 0): num_cards_to_deal = 3
-            elif self._phase == PHASE_FANTASY_F_DEAL: num_cards_to_deal = self._fantasy_cards_count
+            player = self._player_to_deal_to; num_cards_to_deal = self._num_cards_to_deal()
 
             if num_cards_to_deal > 0:
                  if len(self._deck) < num_cards_to_deal: raise Exception(f"Недостаточно карт в колоде ({len(self._deck)}) для сдачи {num_cards_to_deal} карт!")
-                 self._current_cards[player] = [self._deck.pop() for _ in range(num_cards_to_deal)]
+                 # Рука хранится отсортированной: порядок сдачи не несет информации, а инфостейт не зависит от него
+                 self._current_cards[player] = sorted(self._deck.pop() for _ in range(num_cards_to_deal))
+                 hand_key = 0
+                 for card in self._current_cards[player]: hand_key ^= ZOBRIST_HAND[card]
+                 self._zobrist[Z_HAND + player] = hand_key
             self._go_to_next_phase(); return
 
         if self.is_terminal(): raise ValueError("Cannot apply action on terminal node")
         if self.is_chance_node(): raise ValueError("Cannot apply player action on chance node")
-        player = self._current_player; action_index = action_index_or_outcome
-        if self._cached_legal_actions is None: self.legal_actions(player)
-        if self._cached_legal_actions is None or action_index < 0 or action_index >= len(self._cached_legal_actions): raise ValueError(f"Неверный индекс действия: {action_index} (доступно: {len(self._cached_legal_actions) if self._cached_legal_actions is not None else 'кэш пуст'}) для P{player} в фазе {self._phase}")
-        action_tuple = self._cached_legal_actions[action_index]
+        player = self._current_player; action_id = action_index_or_outcome
+        # Номер разбирается напрямую, без генерации легальных действий
+        action_tuple = self._action_tuple(player, action_id)
         placement = []; card_discard = -1; num_placed = 0
 
         # Разбираем кортеж действия в зависимости от фазы
@@ -359,76 +758,121 @@ class OFCPineappleState(pyspiel.State):
         else: raise ValueError(f"Применение действия в неизвестной или неверной фазе: {self._phase}")
 
         # Размещаем карты на доске
-        for card, slot_idx in placement:
-            if not (0 <= slot_idx < TOTAL_CARDS_PLACED): raise ValueError(f"Неверный индекс слота: {slot_idx} в действии {action_tuple}")
+        if self._row_actions: placement = self._resolve_row_placement(player, placement)
+        # Проверка до изменения доски: нелегальный номер не должен оставлять частично примененное действие
+        placed_slots = [slot_idx for _, slot_idx in placement]
+        if len(set(placed_slots)) != len(placed_slots): raise ValueError(f"Повторяющиеся слоты в действии {action_tuple}")
+        for slot_idx in placed_slots:
             if self._board[player][slot_idx] != -1: raise ValueError(f"Слот {slot_idx} уже занят! Доска: {cards_to_strings(self._board[player])}, Действие: {action_tuple}")
-            self._board[player][slot_idx] = card
-        if card_discard != -1: self._discards[player].append(card_discard)
+        for card, slot_idx in placement:
+            self._board[player][slot_idx] = card; self._add_card_to_row_stats(player, slot_idx, card)
+            self._zobrist[Z_BOARD + player] ^= ZOBRIST_BOARD[slot_idx * NUM_CARDS + card]; self._zobrist[Z_OPP_BOARD + player] ^= ZOBRIST_OPP_BOARD[slot_idx * NUM_CARDS + card]
+        if card_discard != -1: pile = self._discards[player][:]; bisect.insort(pile, card_discard); self._discards[player] = pile; self._zobrist[Z_DISCARD + player] ^= ZOBRIST_DISCARD[card_discard]
+        self._zobrist[Z_HAND + player] = 0
         self._current_cards[player] = []; self._total_cards_placed[player] += num_placed; self._cards_to_place_count[player] = 0; self._cards_to_discard_count[player] = 0
         self._go_to_next_phase()
 
-    def action_to_string(self, player: int, action_index: int) -> str:
-        # ... (Без изменений) ...
-        action_tuple = None
-        if self._cached_legal_actions is not None and 0 <= action_index < len(self._cached_legal_actions): action_tuple = self._cached_legal_actions[action_index]
-        elif self._current_player == player:
-             self.legal_actions(player)
-             if self._cached_legal_actions is not None and 0 <= action_index < len(self._cached_legal_actions): action_tuple = self._cached_legal_actions[action_index]
-        if action_tuple is None: return f"InvalidActionIndex({action_index})"
+    def _action_tuple(self, player: int, action_id: int):
+        """Кортеж действия ((карта, слот/ряд), ...) или (размещение, сброс) по глобальному номеру для текущей руки player."""
+        targets, discard_idx = decode_action(action_id, self._row_actions); hand = self._current_cards[player]
+        if len(hand) != len(targets) + (discard_idx >= 0) or discard_idx >= len(hand): raise ValueError(f"Действие {action_id} не соответствует руке P{player} из {len(hand)} карт")
+        cards = hand[:discard_idx] + hand[discard_idx + 1:] if discard_idx >= 0 else hand
+        if len(targets) == TOTAL_CARDS_PLACED and not self._row_actions: # Fantasy F в режиме слотов: ряды -> слоты по порядку руки
+            next_slot = [row_slots[0] for row_slots in ROW_SLOTS]; slots = []
+            for row in targets:
+                if next_slot[row] > ROW_SLOTS[row][-1]: raise ValueError(f"Ряд {ROW_NAMES[row]} переполнен в действии {action_id}")
+                slots.append(next_slot[row]); next_slot[row] += 1
+            targets = slots
+        placement = tuple(zip(cards, targets))
+        return placement if discard_idx < 0 else (placement, hand[discard_idx])
+
+    def _resolve_row_placement(self, player: int, placement) -> List[Tuple[int, int]]:
+        """Переводит назначения (карта, ряд) в (карта, слот): первый свободный слот ряда по возрастанию."""
+        resolved = []; taken = set()
+        for card, row in placement:
+            if not (0 <= row < NUM_ROWS): raise ValueError(f"Неверный индекс ряда: {row} в размещении {placement}")
+            slot_idx = next((s for s in ROW_SLOTS[row] if self._board[player][s] == -1 and s not in taken), None)
+            if slot_idx is None: raise ValueError(f"Ряд {ROW_NAMES[row]} уже заполнен! Доска: {cards_to_strings(self._board[player])}, Размещение: {placement}")
+            taken.add(slot_idx); resolved.append((card, slot_idx))
+        return resolved
+
+    def action_to_string(self, player: int, action_id: int) -> str:
+        try: action_tuple = self._action_tuple(player, action_id)
+        except (ValueError, IndexError): return f"InvalidAction({action_id})"
         try:
             if isinstance(action_tuple, tuple) and len(action_tuple) == 2 and isinstance(action_tuple[0], tuple):
                  placement_tuple = action_tuple[0]; discard_card = action_tuple[1]
                  if all(isinstance(item, tuple) and len(item) == 2 for item in placement_tuple):
-                     placement_str = " ".join([f"{card_to_string(c)}({s})" for c,s in placement_tuple]); discard_str = card_to_string(discard_card)
+                     placement_str = " ".join([f"{card_to_string(c)}({ROW_NAMES[s] if self._row_actions else s})" for c,s in placement_tuple]); discard_str = card_to_string(discard_card)
                      if len(placement_tuple) == 2: return f"Place2 {placement_str} Discard {discard_str}"
                      elif len(placement_tuple) == 13: return f"FantasyF {placement_str} Discard {discard_str}" # Для Fantasyland
             elif isinstance(action_tuple, tuple) and len(action_tuple) == 5 and all(isinstance(item, tuple) and len(item) == 2 for item in action_tuple):
-                 return "Place1 " + " ".join([f"{card_to_string(c)}({s})" for c,s in action_tuple])
+                 return "Place1 " + " ".join([f"{card_to_string(c)}({ROW_NAMES[s] if self._row_actions else s})" for c,s in action_tuple])
         except Exception as e: return f"ErrorFormattingAction({action_tuple})"
         return f"UnknownActionFormat({action_tuple})"
 
     def _calculate_final_returns(self):
-        # ... (Без изменений) ...
         if not all(count == TOTAL_CARDS_PLACED for count in self._total_cards_placed): self._current_hand_returns = [0.0] * NUM_PLAYERS; return
-        scores = [0] * NUM_PLAYERS; royalties = [0] * NUM_PLAYERS; is_dead = [False] * NUM_PLAYERS; evals = [{}, {}, {}]
-        for p in range(NUM_PLAYERS):
-            top_hand = self._board[p][TOP_SLOTS[0]:TOP_SLOTS[-1]+1]; middle_hand = self._board[p][MIDDLE_SLOTS[0]:MIDDLE_SLOTS[-1]+1]; bottom_hand = self._board[p][BOTTOM_SLOTS[0]:BOTTOM_SLOTS[-1]+1]
-            evals[p]['top'] = evaluate_hand(top_hand); evals[p]['middle'] = evaluate_hand(middle_hand); evals[p]['bottom'] = evaluate_hand(bottom_hand)
-            is_dead[p] = is_dead_hand(evals[p]['top'], evals[p]['middle'], evals[p]['bottom'])
-            if not is_dead[p]:
-                royalties[p] += calculate_royalties(evals[p]['top'][0], evals[p]['top'][1], 'top'); royalties[p] += calculate_royalties(evals[p]['middle'][0], evals[p]['middle'][1], 'middle'); royalties[p] += calculate_royalties(evals[p]['bottom'][0], evals[p]['bottom'][1], 'bottom')
-        p0 = 0; p1 = 1; line_scores = [0, 0]; scoop_bonus = [0, 0]
-        if is_dead[p0] and is_dead[p1]: pass
-        elif is_dead[p0]: scores[p0] = -6; scores[p1] = 6 + royalties[p1]
-        elif is_dead[p1]: scores[p0] = 6 + royalties[p0]; scores[p1] = -6
-        else:
-            comp_t = compare_evals(evals[p0]['top'], evals[p1]['top']); comp_m = compare_evals(evals[p0]['middle'], evals[p1]['middle']); comp_b = compare_evals(evals[p0]['bottom'], evals[p1]['bottom'])
-            line_scores[p0] = comp_t + comp_m + comp_b; line_scores[p1] = -line_scores[p0]
-            if comp_t == 1 and comp_m == 1 and comp_b == 1: scoop_bonus[p0] = 3
-            elif comp_t == -1 and comp_m == -1 and comp_b == -1: scoop_bonus[p1] = 3
-            scores[p0] = line_scores[p0] + scoop_bonus[p0] + royalties[p0]; scores[p1] = line_scores[p1] + scoop_bonus[p1] + royalties[p1]
-        diff = scores[p0] - scores[p1]; self._current_hand_returns = [diff, -diff]; self._cumulative_returns[0] += diff; self._cumulative_returns[1] -= diff
+        diff = showdown_diff(self.board_evals(0), self.board_evals(1))
+        self._current_hand_returns = [diff, -diff]; self._cumulative_returns = [self._cumulative_returns[0] + diff, self._cumulative_returns[1] - diff]
 
     # ИЗМЕНЕНО v15: Реализация _check_and_setup_fantasy
     def _check_and_setup_fantasy(self) -> bool:
         """Проверяет условия для Fantasyland и устанавливает флаги для *следующей* руки."""
-        self._next_fantasy_players = [] # Очищаем список перед проверкой
+        next_fantasy_players = [] # Список собирается заново и присваивается целиком (clone разделяет его между копиями)
         triggered = False
         evals = [{}, {}]; is_dead = [False, False]
         for p in range(self._num_players):
-            top_hand = self._board[p][TOP_SLOTS[0]:TOP_SLOTS[-1]+1]; middle_hand = self._board[p][MIDDLE_SLOTS[0]:MIDDLE_SLOTS[-1]+1]; bottom_hand = self._board[p][BOTTOM_SLOTS[0]:BOTTOM_SLOTS[-1]+1]
-            evals[p]['top'] = evaluate_hand(top_hand); evals[p]['middle'] = evaluate_hand(middle_hand); evals[p]['bottom'] = evaluate_hand(bottom_hand)
+            # Силы заполненных рядов уже посчитаны в apply_action; незаполненные оцениваются как есть
+            for row, row_name in enumerate(ROW_NAMES):
+                row_eval = self.row_eval(p, row)
+                evals[p][row_name] = row_eval if row_eval is not None else evaluate_hand(self._board[p][ROW_SLOTS[row][0]:ROW_SLOTS[row][-1]+1])
             is_dead[p] = is_dead_hand(evals[p]['top'], evals[p]['middle'], evals[p]['bottom'])
         for p in range(self._num_players):
             if not is_dead[p]: # Проверяем только живые руки
                 top_eval = evals[p]['top']
                 # Проверяем QQ+ или сет на топе
-                if (top_eval[0] == PAIR and top_eval[1][0] >= FANTASY_TRIGGER_RANK) or \
-                   (top_eval[0] == THREE_OF_A_KIND):
-                    self._next_fantasy_players.append(p)
+                if (hand_category(top_eval) == PAIR and hand_primary_rank(top_eval) >= FANTASY_TRIGGER_RANK) or \
+                   (hand_category(top_eval) == THREE_OF_A_KIND):
+                    next_fantasy_players.append(p)
                     triggered = True
+        self._next_fantasy_players = next_fantasy_players
         return triggered
 
+    def exact_action_values(self, player: int, max_outcomes: Optional[int] = None) -> Optional[np.ndarray]:
+        """Точные ожидаемые очки player за каждое легальное действие на пятой улице (в порядке legal_actions).
+
+        Если доска соперника заполнена, исход детерминирован. Если player ходит первым, перебираются все
+        сдачи 3 карт соперника из неизвестных player карт, и соперник отвечает лучшим из своих 6 вариантов
+        (сброс x порядок двух карт), видя итоговую доску player. Подсчет - по правилам _calculate_final_returns.
+        Возвращает None вне пятой улицы обычной руки или если перебор больше max_outcomes досок.
+        """
+        if self._phase not in (STREET_FIFTH_PLACE_P1, STREET_FIFTH_PLACE_P2) or self._is_fantasy_hand or player != self._current_player: return None
+        legal_actions = self.legal_actions(player); opponent = 1 - player; opp_board = self._board[opponent]
+        opp_free_slots = [slot for slot, card in enumerate(opp_board) if card == -1]
+        if opp_free_slots and len(opp_free_slots) != 2: return None
+        my_evals = []
+        for action in legal_actions:
+            child = self.clone(); child.apply_action(action); my_evals.append(child.board_evals(player))
+        my_evals = np.array(my_evals, dtype=np.int64)
+        if not opp_free_slots:
+            opp_evals = np.array(self.board_evals(opponent), dtype=np.int64)[None, None, :]
+        else:
+            known = cards_to_mask(self._board[player] + opp_board + self._current_cards[player] + self._discards[player])
+            opp_deals = np.array(list(itertools.combinations(mask_to_cards(FULL_DECK_MASK ^ known), 3)), dtype=np.int64)
+            if max_outcomes is not None and len(opp_deals) * 6 * len(legal_actions) > max_outcomes: return None
+            # Варианты соперника: какую карту сбросить и в каком порядке положить две другие в свободные слоты
+            opp_boards = np.tile(np.array(opp_board, dtype=np.int64), (len(opp_deals), 6, 1)); option = 0
+            for discard_idx in range(3):
+                kept = [i for i in range(3) if i != discard_idx]
+                for first, second in (kept, kept[::-1]):
+                    opp_boards[:, option, opp_free_slots[0]] = opp_deals[:, first]; opp_boards[:, option, opp_free_slots[1]] = opp_deals[:, second]; option += 1
+            opp_evals = evaluate_boards_np(opp_boards)[None]
+        my_evals = my_evals[:, None, None, :]
+        diffs = showdown_diff_np(my_evals, opp_evals) if player == 0 else -showdown_diff_np(opp_evals, my_evals)
+        # Соперник минимизирует очки player (игра с нулевой суммой), затем среднее по равновероятным сдачам
+        return diffs.min(axis=2).mean(axis=1).astype(np.float64)
+
     def returns(self):
         # ... (Без изменений) ...
         if not self._game_over: return [0.0] * self._num_players
@@ -454,17 +898,109 @@ class OFCPineappleState(pyspiel.State):
         try: parts.append(f"Place:{self._cards_to_place_count[player]}|Discard:{self._cards_to_discard_count[player]}")
         except IndexError: parts.append("Place:?|Discard:?")
         return ";".join(parts)
+    def information_state_key(self, player: int) -> int:
+        """64-битный ключ инфостейта: равен для состояний с одинаковым information_state_string, но строится без строк."""
+        if player < 0 or player >= self._num_players: return ZOBRIST_PHASE[self._phase] ^ (ZOBRIST_GAME_OVER if self._game_over else 0)
+        zobrist = self._zobrist; opponent = 1 - player
+        key = zobrist[Z_BOARD + player] ^ zobrist[Z_HAND + player] ^ zobrist[Z_DISCARD + player]
+        if not self._opponent_board_hidden(): key ^= zobrist[Z_OPP_BOARD + opponent]
+        if self._opponent_hand_visible(player):
+            for card in self._current_cards[opponent]: key ^= ZOBRIST_OPP_HAND[card]
+        return key ^ self._information_state_key_tail(player)
+
+    def _opponent_board_hidden(self) -> bool: return PHASE_FANTASY_SETUP <= self._phase <= PHASE_FANTASY_SHOWDOWN
+    def _opponent_hand_visible(self, player: int) -> bool: return (self._phase == STREET_FIRST_DEAL_P2 and player == 0) or (self._phase == STREET_FIRST_PLACE_P1 and player == 1)
+
+    def _information_state_key_tail(self, player: int) -> int:
+        """Некарточная часть ключа: игрок, фаза, счетчики и статус Fantasy."""
+        key = ZOBRIST_PLAYER[player] ^ ZOBRIST_PHASE[self._phase] ^ ZOBRIST_PLACE_COUNT[self._cards_to_place_count[player]] ^ ZOBRIST_DISCARD_COUNT[self._cards_to_discard_count[player]]
+        if self._opponent_board_hidden(): key ^= ZOBRIST_OPP_HIDDEN
+        if self._is_fantasy_hand:
+            key ^= ZOBRIST_FANTASY_HAND
+            if self._current_fantasy_player is not None: key ^= ZOBRIST_CUR_FANTASY[self._current_fantasy_player]
+            if self._current_normal_player is not None: key ^= ZOBRIST_CUR_NORMAL[self._current_normal_player]
+        else:
+            for p in self._next_fantasy_players: key ^= ZOBRIST_NEXT_FANTASY[p]
+        return key
+
+    def canonical_suit_permutation(self, player: int) -> Tuple[int, ...]:
+        """Перестановка мастей (perm[старая] = новая), приводящая видимые игроку карты к каноническому виду.
+
+        Масти упорядочиваются по убыванию сигнатуры - рангов карт масти в каждом видимом слоте и каждой видимой
+        руке/сбросе. Масти с равными сигнатурами неразличимы, поэтому порядок среди них не влияет на результат.
+        """
+        # (зона, упорядочена ли она): на досках важен слот карты, в руках и сбросах - только ранг
+        opponent = 1 - player; zones = [(self._board[player], True), (self._current_cards[player], False), (self._discards[player], False)]
+        if not self._opponent_board_hidden(): zones.append((self._board[opponent], True))
+        if self._opponent_hand_visible(player): zones.append((self._current_cards[opponent], False))
+        signatures = [[] for _ in range(NUM_SUITS)]
+        for zone_idx, (zone, is_ordered) in enumerate(zones):
+            for position, card in enumerate(zone):
+                if card != -1: signatures[card % NUM_SUITS].append((zone_idx, position if is_ordered else 0, card // NUM_SUITS))
+        for suit_signature in signatures: suit_signature.sort()
+        order = sorted(range(NUM_SUITS), key=lambda suit: signatures[suit], reverse=True)
+        perm = [0] * NUM_SUITS
+        for new_suit, old_suit in enumerate(order): perm[old_suit] = new_suit
+        return tuple(perm)
+
+    def canonical_information_state_key(self, player: int) -> int:
+        """Ключ инфостейта после канонической перемаркировки мастей: общий для всех изоморфных инфостейтов."""
+        if player < 0 or player >= self._num_players: return self.information_state_key(player)
+        card_map = SUIT_PERMUTATION_CARD_MAPS[self.canonical_suit_permutation(player)]; opponent = 1 - player; key = 0
+        for slot_idx, card in enumerate(self._board[player]):
+            if card != -1: key ^= ZOBRIST_BOARD[slot_idx * NUM_CARDS + card_map[card]]
+        for card in self._current_cards[player]: key ^= ZOBRIST_HAND[card_map[card]]
+        for card in self._discards[player]: key ^= ZOBRIST_DISCARD[card_map[card]]
+        if not self._opponent_board_hidden():
+            for slot_idx, card in enumerate(self._board[opponent]):
+                if card != -1: key ^= ZOBRIST_OPP_BOARD[slot_idx * NUM_CARDS + card_map[card]]
+        if self._opponent_hand_visible(player):
+            for card in self._current_cards[opponent]: key ^= ZOBRIST_OPP_HAND[card_map[card]]
+        return key ^ self._information_state_key_tail(player)
+
+    def canonical_actions(self, player: int) -> Tuple[Any, ...]:
+        """Канонические представления легальных действий (в порядке legal_actions(player)).
+
+        Карты перемаркированы той же перестановкой мастей, что и canonical_information_state_key, а пары
+        (карта, слот/ряд) отсортированы, поэтому изоморфные действия изоморфных инфостейтов совпадают.
+        Действие Fantasy F представлено номером той же расстановки для перемаркированной и заново отсортированной руки.
+        """
+        if player != self._current_player: return ()
+        if self._cached_canonical_actions is None and self._phase == PHASE_FANTASY_F_PLACE:
+            card_map = SUIT_PERMUTATION_CARD_MAPS[self.canonical_suit_permutation(player)]; mapped = [card_map[card] for card in self._current_cards[player]]
+            positions = [sorted(mapped).index(card) for card in mapped]; legal_actions = self.legal_actions(player)
+            if positions == sorted(positions): self._cached_canonical_actions = tuple(legal_actions)
+            else: self._cached_canonical_actions = tuple(fantasy_action_ids(len(mapped), self._row_actions, positions).tolist())
+        if self._cached_canonical_actions is None:
+            card_map = SUIT_PERMUTATION_CARD_MAPS[self.canonical_suit_permutation(player)]; canonical = []
+            for action_tuple in (self._action_tuple(player, action_id) for action_id in self.legal_actions(player)):
+                if len(action_tuple) == 2 and isinstance(action_tuple[0], tuple) and isinstance(action_tuple[0][0], tuple):
+                    canonical.append((tuple(sorted((card_map[c], s) for c, s in action_tuple[0])), card_map[action_tuple[1]]))
+                else: canonical.append(tuple(sorted((card_map[c], s) for c, s in action_tuple)))
+            self._cached_canonical_actions = tuple(canonical)
+        return self._cached_canonical_actions
+
+    def _recompute_zobrist(self):
+        """Пересчитывает карточные компоненты Zobrist-ключа с нуля (после материализации из компактного состояния)."""
+        zobrist = [0] * NUM_ZOBRIST_PARTS
+        for p in range(NUM_PLAYERS):
+            for slot_idx, card in enumerate(self._board[p]):
+                if card != -1: zobrist[Z_BOARD + p] ^= ZOBRIST_BOARD[slot_idx * NUM_CARDS + card]; zobrist[Z_OPP_BOARD + p] ^= ZOBRIST_OPP_BOARD[slot_idx * NUM_CARDS + card]
+            for card in self._current_cards[p]: zobrist[Z_HAND + p] ^= ZOBRIST_HAND[card]
+            for card in self._discards[p]: zobrist[Z_DISCARD + p] ^= ZOBRIST_DISCARD[card]
+        self._zobrist = zobrist
+
     def observation_string(self, player): return self.information_state_string(player)
     def clone(self):
-        # ИЗМЕНЕНО v15: Копируем новые переменные
-        cloned = type(self)(self.get_game()); cloned._num_players = self._num_players; cloned._current_player = self._current_player; cloned._dealer_button = self._dealer_button
-        cloned._next_player_to_act = self._next_player_to_act; cloned._player_to_deal_to = self._player_to_deal_to; cloned._phase = self._phase
-        cloned._fantasy_cards_count = self._fantasy_cards_count; cloned._game_over = self._game_over
-        cloned._deck = self._deck[:]; cloned._cards_to_place_count = self._cards_to_place_count[:]; cloned._cards_to_discard_count = self._cards_to_discard_count[:]
-        cloned._total_cards_placed = self._total_cards_placed[:]; cloned._cumulative_returns = self._cumulative_returns[:]; cloned._current_hand_returns = self._current_hand_returns[:]
-        cloned._board = copy.deepcopy(self._board); cloned._current_cards = copy.deepcopy(self._current_cards); cloned._discards = copy.deepcopy(self._discards)
-        cloned._is_fantasy_hand = self._is_fantasy_hand; cloned._next_fantasy_players = self._next_fantasy_players[:]; cloned._current_fantasy_player = self._current_fantasy_player; cloned._current_normal_player = self._current_normal_player
-        cloned._cached_legal_actions = None
+        # Быстрый путь: без __init__ (он тасует новую колоду и проходит _go_to_next_phase).
+        # Скаляры переносятся одним копированием __dict__, изменяемые списки копируются срезами.
+        # Руки, сбросы, очки и _next_fantasy_players никогда не меняются на месте, только присваиваются целиком
+        # (копирование при записи), поэтому разделяются между клонами, как и кортеж-кэш легальных действий;
+        # копируются только списки по игрокам, в которых они лежат.
+        cloned = _new_uninitialized_state(type(self), self.get_game()); cloned.__dict__.update(self.__dict__)
+        cloned._deck = self._deck[:]; cloned._board = [self._board[0][:], self._board[1][:]]; cloned._row_stats = self._row_stats[:]; cloned._zobrist = self._zobrist[:]
+        cloned._cards_to_place_count = self._cards_to_place_count[:]; cloned._cards_to_discard_count = self._cards_to_discard_count[:]; cloned._total_cards_placed = self._total_cards_placed[:]
+        cloned._current_cards = self._current_cards[:]; cloned._discards = self._discards[:]
         return cloned
 
     # ИСПРАВЛЕНО v10: Правильная реализация chance_outcomes
@@ -475,42 +1011,307 @@ class OFCPineappleState(pyspiel.State):
         prob = 1.0 / num_remaining_cards
         return [(card, prob) for card in self._deck]
 
-    def resample_from_infostate(self, player_id: int, probability_sampler) -> 'OFCPineappleState':
-        # ... (Без изменений) ...
+    def _num_cards_to_deal(self) -> int:
+        """Сколько карт сдается в текущей фазе сдачи (0 вне фаз сдачи)."""
+        if self._phase in [STREET_FIRST_DEAL_P1, STREET_FIRST_DEAL_P2, PHASE_FANTASY_N_DEAL_1]: return 5
+        if (self._phase >= STREET_SECOND_DEAL_P1 and self._phase <= STREET_FIFTH_PLACE_P2 and self._phase % 2 != 0) or \
+           (self._phase >= PHASE_FANTASY_N_DEAL_2 and self._phase <= PHASE_FANTASY_N_PLACE_5 and self._phase % 2 != 0): return 3
+        if self._phase == PHASE_FANTASY_F_DEAL: return self._fantasy_cards_count
+        return 0
+
+    def sample_chance_outcome(self, rng=None) -> int:
+        """Исход шанса без построения chance_outcomes: сдаваемые карты выбираются rng среди всей колоды
+        и переставляются в ее конец (частичное тасование Фишера-Йетса), откуда их снимет apply_action.
+        Поэтому повторно используемый мир (max_world_samples) сдает в каждой симуляции разные карты."""
+        if not self.is_chance_node() or not self._deck: raise ValueError(f"Нет исходов шанса в фазе {self._phase}")
+        rng = rng if rng is not None else np.random; deck = self._deck; size = len(deck)
+        for i in range(min(self._num_cards_to_deal(), size)):
+            j = rng.randint(size - i); last = size - 1 - i; deck[j], deck[last] = deck[last], deck[j]
+        return deck[-1]
+
+    def to_compact(self) -> 'OFCCompactState':
+        return OFCCompactState.from_state(self)
+
+    def __reduce__(self):
+        # Сериализация через компактное представление (нужна для передачи состояний в процессы-воркеры)
+        return (_rebuild_state, (dict(self.get_game().get_parameters()), self.to_compact(), list(self._deck)))
+
+    def known_mask(self, player: int) -> int:
+        """Карты, видимые игроку player (те же правила, что в information_state_string и OFCCompactState.known_mask)."""
+        opponent = 1 - player
+        known = cards_to_mask(self._board[player]) | cards_to_mask(self._current_cards[player]) | cards_to_mask(self._discards[player]) | cards_to_mask(self._board[opponent])
+        if (self._phase == STREET_FIRST_DEAL_P2 and player == 0) or (self._phase == STREET_FIRST_PLACE_P1 and player == 1): known |= cards_to_mask(self._current_cards[opponent])
+        return known
+
+    def hidden_counts(self, player: int) -> Tuple[int, int]:
+        """Число скрытых от player карт в руке и в сбросе соперника."""
+        return _hidden_counts(self._phase, player)
+
+    def determinize(self, player: int, unknown_cards: List[int]) -> 'OFCPineappleState':
+        """Клон, в котором скрытые карты соперника и колода взяты из unknown_cards (по порядку: рука, сброс, колода).
+        Доски, статистики рядов и Zobrist-ключи досок не пересчитываются: меняются только ключи руки и сброса соперника."""
+        opponent = 1 - player; hand_size, discard_count = _hidden_counts(self._phase, player); split = hand_size + discard_count
+        if split > len(unknown_cards): raise Exception(f"Ошибка в determinize: Не хватило неизвестных карт. Фаза: {self._phase}, Игрок: {player}, Неизвестно: {len(unknown_cards)}, Нужно опп.рука: {hand_size}, Нужно опп.сброс: {discard_count}")
+        world = self.clone()
+        world._current_cards[opponent] = sorted(unknown_cards[:hand_size]); world._discards[opponent] = sorted(unknown_cards[hand_size:split]); world._deck = list(unknown_cards[split:])
+        hand_key = 0; discard_key = 0
+        for card in world._current_cards[opponent]: hand_key ^= ZOBRIST_HAND[card]
+        for card in world._discards[opponent]: discard_key ^= ZOBRIST_DISCARD[card]
+        world._zobrist[Z_HAND + opponent] = hand_key; world._zobrist[Z_DISCARD + opponent] = discard_key
+        return world
+
+    def resample_from_infostate(self, player_id: int, probability_sampler, rng=None) -> 'OFCPineappleState':
+        """Сэмплирует мир, совместимый с инфостейтом player_id: неизвестные карты считаются на масках,
+        мир - клон состояния с замененными скрытыми картами (без конвертации в OFCCompactState и обратно)."""
         if not (0 <= player_id < self._num_players): raise ValueError(f"Неверный player_id: {player_id}")
-        opponent_id = 1 - player_id
-        known_cards: Set[int] = set()
-        known_cards.update(c for c in self._board[player_id] if c != -1); known_cards.update(c for c in self._current_cards[player_id] if c != -1); known_cards.update(c for c in self._discards[player_id] if c != -1)
-        known_cards.update(c for c in self._board[opponent_id] if c != -1)
-        if self._phase == STREET_FIRST_DEAL_P2 and player_id == 0: known_cards.update(c for c in self._current_cards[opponent_id] if c != -1)
-        elif self._phase == STREET_FIRST_PLACE_P1 and player_id == 1: known_cards.update(c for c in self._current_cards[opponent_id] if c != -1)
-        all_cards = set(range(NUM_CARDS)); unknown_cards_set = all_cards - known_cards; unknown_cards_list = list(unknown_cards_set)
-        rng = np.random.RandomState(); rng.shuffle(unknown_cards_list); unknown_cards_iter = iter(unknown_cards_list)
-        cloned_state = self.clone()
-        opponent_hand_size_needed = 0; opponent_discard_count_needed = 0; current_phase = self._phase
-        if opponent_id == 1: # Оппонент - P2
-            if current_phase in [STREET_SECOND_DEAL_P2, STREET_THIRD_DEAL_P2, STREET_FOURTH_DEAL_P2, STREET_FIFTH_DEAL_P2]: opponent_hand_size_needed = 3
-            if current_phase > STREET_SECOND_PLACE_P2: opponent_discard_count_needed += 1
-            if current_phase > STREET_THIRD_PLACE_P2: opponent_discard_count_needed += 1
-            if current_phase > STREET_FOURTH_PLACE_P2: opponent_discard_count_needed += 1
-            if current_phase > STREET_FIFTH_PLACE_P2: opponent_discard_count_needed += 1
-        else: # Оппонент - P1
-            if current_phase in [STREET_SECOND_DEAL_P1, STREET_THIRD_DEAL_P1, STREET_FOURTH_DEAL_P1, STREET_FIFTH_DEAL_P1]: opponent_hand_size_needed = 3
-            if current_phase > STREET_SECOND_PLACE_P1: opponent_discard_count_needed += 1
-            if current_phase > STREET_THIRD_PLACE_P1: opponent_discard_count_needed += 1
-            if current_phase > STREET_FOURTH_PLACE_P1: opponent_discard_count_needed += 1
-            if current_phase > STREET_FIFTH_PLACE_P1: opponent_discard_count_needed += 1
-        try:
-            cloned_state._current_cards[opponent_id] = [next(unknown_cards_iter) for _ in range(opponent_hand_size_needed)]
-            cloned_state._discards[opponent_id] = [next(unknown_cards_iter) for _ in range(opponent_discard_count_needed)] # Заменяем сброс
-            cloned_state._deck = list(unknown_cards_iter)
-        except StopIteration: raise Exception(f"Ошибка в resample_from_infostate: Не хватило неизвестных карт. Фаза: {current_phase}, Игрок: {player_id}, Известно: {len(known_cards)}, Неизвестно: {len(unknown_cards_set)}, Нужно опп.рука: {opponent_hand_size_needed}, Нужно опп.сброс: {opponent_discard_count_needed}")
-        return cloned_state
+        rng = rng if rng is not None else np.random
+        return self.determinize(player_id, rng.permutation(mask_to_cards(FULL_DECK_MASK ^ self.known_mask(player_id))).tolist())
+
+    def world_pool(self, player_id: int, num_worlds: int, rng=None) -> 'OFCWorldPool':
+        """num_worlds миров инфостейта player_id одной выборкой (см. OFCWorldPool)."""
+        return OFCWorldPool(self, player_id, num_worlds, rng)
 
     def __str__(self):
         player = self.current_player(); player_to_show = player if player >= 0 else 0
         return self.information_state_string(player_to_show)
 
+# --- Числовые наблюдения ---
+# Все признаки бинарные, поэтому наблюдение строится как список плоских индексов единиц, которые set_from
+# пишет в свой тензор. fill_batch списков не строит: плоские индексы единиц всех состояний пишутся в
+# переиспользуемый буфер наблюдателя (столбцы берутся из таблиц __init__) и ставятся в out одним np.put.
+# Инфостейт OFC (как и information_state_string) определяется текущими досками, рукой и сбросами,
+# поэтому при perfect_recall тензор тот же.
+NUM_OBS_PHASES = PHASE_FANTASY_SHOWDOWN + 1
+OBS_FLAG_FANTASY_HAND = 0; OBS_FLAG_IS_FANTASY_PLAYER = 1; OBS_FLAG_OPP_FANTASY_PLAYER = 2; OBS_FLAG_NEXT_FANTASY = 3; OBS_FLAG_OPP_NEXT_FANTASY = 4; OBS_FLAG_OPP_BOARD_HIDDEN = 5; NUM_OBS_FLAGS = 6
+MAX_OBS_ONES = 1 + NUM_CARDS + 1 + NUM_OBS_FLAGS # игрок, каждая карта не более одного раза, фаза и флаги
+
+class OFCPineappleObserver(object):
+    """Наблюдатель в интерфейсе PyObserver: бинарный тензор с точки зрения игрока.
+
+    Части (если входят в iig_obs_type): player (2), board (2, 3, 52) - карты по рядам, сначала свои, затем
+    соперника; phase (44), flags (6) - статус Fantasy и скрытость доски соперника; opponent_hand (52) - рука
+    соперника, когда она видна; hand (52) и discards (52) - своя рука и свои сбросы. params: {"dtype": ...}.
+    """
+
+    def __init__(self, iig_obs_type, params):
+        params = dict(params or {}); dtype = np.dtype(params.pop("dtype", np.float32))
+        if params: raise ValueError(f"Неподдерживаемые параметры наблюдения: {params}")
+        pieces = [("player", (NUM_PLAYERS,))]
+        if iig_obs_type.public_info:
+            pieces += [("board", (NUM_PLAYERS, NUM_ROWS, NUM_CARDS)), ("phase", (NUM_OBS_PHASES,)), ("flags", (NUM_OBS_FLAGS,)), ("opponent_hand", (NUM_CARDS,))]
+        if iig_obs_type.private_info == pyspiel.PrivateInfoType.SINGLE_PLAYER:
+            pieces += [("hand", (NUM_CARDS,)), ("discards", (NUM_CARDS,))]
+        self.size = sum(int(np.prod(shape)) for _, shape in pieces)
+        self.tensor = np.zeros(self.size, dtype); self.dict = {}; self._offsets = {}; index = 0
+        for name, shape in pieces:
+            size = int(np.prod(shape)); self.dict[name] = self.tensor[index:index + size].reshape(shape); self._offsets[name] = index; index += size
+        # Таблица fill_batch: _board_columns[отн. игрок][слот] + карта - столбец карты на доске
+        self._batch_capacity = 0; self._batch_ids = array('q'); self._batch_id_array = np.zeros(0, np.int64)
+        if "board" in self._offsets:
+            self._board_columns = [[self._offsets["board"] + (rel_player * NUM_ROWS + row) * NUM_CARDS for row in SLOT_ROW] for rel_player in range(NUM_PLAYERS)]
+
+    def _flag_mask(self, state: 'OFCPineappleState', player: int, opp_hidden: bool) -> int:
+        """Битовая маска флагов OBS_FLAG_*."""
+        opponent = 1 - player; fantasy_player = state._current_fantasy_player; next_fantasy = state._next_fantasy_players
+        return ((state._is_fantasy_hand << OBS_FLAG_FANTASY_HAND) | ((fantasy_player == player) << OBS_FLAG_IS_FANTASY_PLAYER)
+                | ((fantasy_player == opponent) << OBS_FLAG_OPP_FANTASY_PLAYER) | ((player in next_fantasy) << OBS_FLAG_NEXT_FANTASY)
+                | ((opponent in next_fantasy) << OBS_FLAG_OPP_NEXT_FANTASY) | (opp_hidden << OBS_FLAG_OPP_BOARD_HIDDEN))
+
+    def _feature_indices(self, state: 'OFCPineappleState', player: int) -> List[int]:
+        """Индексы единичных признаков в плоском тензоре."""
+        offsets = self._offsets; opponent = 1 - player; indices = [offsets["player"] + player]
+        if "board" in offsets:
+            board_offset = offsets["board"]; opp_hidden = state._opponent_board_hidden()
+            for rel_player, p in enumerate((player, opponent)):
+                if p == opponent and opp_hidden: continue
+                for slot_idx, card in enumerate(state._board[p]):
+                    if card != -1: indices.append(board_offset + (rel_player * NUM_ROWS + SLOT_ROW[slot_idx]) * NUM_CARDS + card)
+            indices.append(offsets["phase"] + state._phase); flags_offset = offsets["flags"]
+            flag_mask = self._flag_mask(state, player, opp_hidden); indices.extend(flags_offset + flag for flag in range(NUM_OBS_FLAGS) if flag_mask >> flag & 1)
+            if state._opponent_hand_visible(player): indices.extend(offsets["opponent_hand"] + card for card in state._current_cards[opponent])
+        if "hand" in offsets:
+            indices.extend(offsets["hand"] + card for card in state._current_cards[player])
+            indices.extend(offsets["discards"] + card for card in state._discards[player])
+        return indices
+
+    def set_from(self, state: 'OFCPineappleState', player: int):
+        """Заполняет tensor (и представления dict) наблюдением player."""
+        self.tensor.fill(0); self.tensor[self._feature_indices(state, player)] = 1
+
+    def fill_batch(self, states: List['OFCPineappleState'], players, out: np.ndarray) -> np.ndarray:
+        """Заполняет первые len(states) строк буфера out (N, size) наблюдениями; players - игрок или список игроков."""
+        num_states = len(states)
+        if out.ndim != 2 or out.shape[1] != self.size or out.shape[0] < num_states or not out.flags.c_contiguous: raise ValueError(f"Ожидается C-непрерывный буфер (>= {num_states}, {self.size}), получено {out.shape}")
+        if isinstance(players, int): players = itertools.repeat(players, num_states)
+        if num_states > self._batch_capacity: self._grow_batch_buffers(num_states)
+        # Плоские индексы единиц (строка * size + столбец) пишутся в буфер _batch_ids, который разделяет память с _batch_id_array
+        offsets = self._offsets; size = self.size; ids = self._batch_ids; num_ids = 0; base = 0; player_column = offsets["player"]
+        has_board = "board" in offsets; has_hand = "hand" in offsets
+        if has_board: own_columns, opp_columns = self._board_columns; phase_column = offsets["phase"]; flags_column = offsets["flags"]; opp_hand_column = offsets["opponent_hand"]
+        if has_hand: hand_column = offsets["hand"]; discards_column = offsets["discards"]
+        for state, player in zip(states, players):
+            opponent = 1 - player; ids[num_ids] = base + player_column + player; num_ids += 1
+            if has_board:
+                opp_hidden = state._opponent_board_hidden()
+                for column, card in zip(own_columns, state._board[player]):
+                    if card >= 0: ids[num_ids] = base + column + card; num_ids += 1
+                if not opp_hidden:
+                    for column, card in zip(opp_columns, state._board[opponent]):
+                        if card >= 0: ids[num_ids] = base + column + card; num_ids += 1
+                ids[num_ids] = base + phase_column + state._phase; num_ids += 1
+                flag_mask = self._flag_mask(state, player, opp_hidden); flag = 0
+                while flag_mask:
+                    if flag_mask & 1: ids[num_ids] = base + flags_column + flag; num_ids += 1
+                    flag_mask >>= 1; flag += 1
+                if state._opponent_hand_visible(player):
+                    for card in state._current_cards[opponent]: ids[num_ids] = base + opp_hand_column + card; num_ids += 1
+            if has_hand:
+                for card in state._current_cards[player]: ids[num_ids] = base + hand_column + card; num_ids += 1
+                for card in state._discards[player]: ids[num_ids] = base + discards_column + card; num_ids += 1
+            base += size
+        out[:num_states].fill(0); np.put(out, self._batch_id_array[:num_ids], 1)
+        return out
+
+    def _grow_batch_buffers(self, capacity: int):
+        # Старый массив отпускается до замены буфера: array нельзя менять, пока на него смотрит np.frombuffer
+        self._batch_capacity = capacity; self._batch_id_array = None
+        self._batch_ids = array('q', bytes(8 * capacity * MAX_OBS_ONES)); self._batch_id_array = np.frombuffer(self._batch_ids, np.int64)
+
+    def string_from(self, state: 'OFCPineappleState', player: int) -> str:
+        return state.information_state_string(player)
+
+# --- Компактное представление состояния ---
+# Индексы масок в OFCCompactState.masks: ряды игрока p - p * NUM_ROWS + ряд, далее руки, сбросы и колода.
+MASK_HAND = NUM_PLAYERS * NUM_ROWS; MASK_DISCARD = MASK_HAND + NUM_PLAYERS; MASK_DECK = MASK_DISCARD + NUM_PLAYERS; NUM_MASKS = MASK_DECK + 1
+NO_CARD = 0xFF
+_OPPONENT_HAND_DEAL_PHASES = { 1: [STREET_SECOND_DEAL_P2, STREET_THIRD_DEAL_P2, STREET_FOURTH_DEAL_P2, STREET_FIFTH_DEAL_P2], 0: [STREET_SECOND_DEAL_P1, STREET_THIRD_DEAL_P1, STREET_FOURTH_DEAL_P1, STREET_FIFTH_DEAL_P1] }
+_OPPONENT_PLACE_PHASES = { 1: [STREET_SECOND_PLACE_P2, STREET_THIRD_PLACE_P2, STREET_FOURTH_PLACE_P2, STREET_FIFTH_PLACE_P2], 0: [STREET_SECOND_PLACE_P1, STREET_THIRD_PLACE_P1, STREET_FOURTH_PLACE_P1, STREET_FIFTH_PLACE_P1] }
+
+def _hidden_counts(phase: int, player: int) -> Tuple[int, int]:
+    opponent = 1 - player; hand_size = 3 if phase in _OPPONENT_HAND_DEAL_PHASES[opponent] else 0
+    return hand_size, sum(1 for place_phase in _OPPONENT_PLACE_PHASES[opponent] if phase > place_phase)
+
+class OFCCompactState(object):
+    """Компактный бэкенд состояния: 52-битные маски рядов, рук, сбросов и колоды плюс массив из 26 слотов.
+
+    Занимает несколько сотен байт, копируется двумя копиями буферов (masks и slots) и используется
+    для детерминизации: известные/неизвестные карты, сдача и пересэмплирование - битовые операции.
+    Порядок карт в руках и сбросах не хранится (в OFCPineappleState они отсортированы).
+    """
+    __slots__ = ("masks", "slots", "counts", "phase", "current_player", "player_to_deal_to", "next_player_to_act", "dealer_button",
+                 "game_over", "is_fantasy_hand", "next_fantasy_players", "current_fantasy_player", "current_normal_player",
+                 "fantasy_cards_count", "cumulative_returns", "current_hand_returns")
+
+    @classmethod
+    def from_state(cls, state: 'OFCPineappleState') -> 'OFCCompactState':
+        compact = cls.__new__(cls); masks = array('Q', bytes(8 * NUM_MASKS)); slots = bytearray(NUM_PLAYERS * TOTAL_CARDS_PLACED)
+        for p in range(NUM_PLAYERS):
+            board = state._board[p]; base = p * TOTAL_CARDS_PLACED
+            for slot_idx, card in enumerate(board):
+                if card == -1: slots[base + slot_idx] = NO_CARD
+                else: slots[base + slot_idx] = card; masks[p * NUM_ROWS + SLOT_ROW[slot_idx]] |= 1 << card
+            masks[MASK_HAND + p] = cards_to_mask(state._current_cards[p]); masks[MASK_DISCARD + p] = cards_to_mask(state._discards[p])
+        masks[MASK_DECK] = cards_to_mask(state._deck)
+        compact.masks = masks; compact.slots = slots; compact.counts = bytearray(state._cards_to_place_count + state._cards_to_discard_count)
+        compact.phase = state._phase; compact.current_player = state._current_player; compact.player_to_deal_to = state._player_to_deal_to
+        compact.next_player_to_act = state._next_player_to_act; compact.dealer_button = state._dealer_button; compact.game_over = state._game_over
+        compact.is_fantasy_hand = state._is_fantasy_hand; compact.next_fantasy_players = tuple(state._next_fantasy_players)
+        compact.current_fantasy_player = state._current_fantasy_player; compact.current_normal_player = state._current_normal_player
+        compact.fantasy_cards_count = state._fantasy_cards_count; compact.cumulative_returns = tuple(state._cumulative_returns); compact.current_hand_returns = tuple(state._current_hand_returns)
+        return compact
+
+    def copy(self) -> 'OFCCompactState':
+        cls = type(self); compact = cls.__new__(cls)
+        for name in cls.__slots__: setattr(compact, name, getattr(self, name))
+        compact.masks = self.masks[:]; compact.slots = self.slots[:]; compact.counts = self.counts[:]
+        return compact
+
+    def board_mask(self, player: int) -> int: return self.masks[player * NUM_ROWS] | self.masks[player * NUM_ROWS + 1] | self.masks[player * NUM_ROWS + 2]
+
+    def known_mask(self, player: int) -> int:
+        """Карты, видимые игроку player (те же правила, что в information_state_string)."""
+        opponent = 1 - player; masks = self.masks
+        known = self.board_mask(player) | masks[MASK_HAND + player] | masks[MASK_DISCARD + player] | self.board_mask(opponent)
+        if (self.phase == STREET_FIRST_DEAL_P2 and player == 0) or (self.phase == STREET_FIRST_PLACE_P1 and player == 1): known |= masks[MASK_HAND + opponent]
+        return known
+
+    def unknown_mask(self, player: int) -> int: return FULL_DECK_MASK ^ self.known_mask(player)
+
+    def hidden_counts(self, player: int) -> Tuple[int, int]:
+        """Число скрытых от player карт в руке и в сбросе соперника."""
+        return _hidden_counts(self.phase, player)
+
+    def determinize(self, player: int, unknown_cards: List[int]) -> 'OFCCompactState':
+        """Мир, в котором скрытые карты соперника и колода взяты из unknown_cards (по порядку: рука, сброс, колода)."""
+        opponent = 1 - player; hand_size, discard_count = self.hidden_counts(player)
+        if hand_size + discard_count > len(unknown_cards): raise Exception(f"Ошибка в determinize: Не хватило неизвестных карт. Фаза: {self.phase}, Игрок: {player}, Неизвестно: {len(unknown_cards)}, Нужно опп.рука: {hand_size}, Нужно опп.сброс: {discard_count}")
+        world = self.copy(); masks = world.masks
+        masks[MASK_HAND + opponent] = cards_to_mask(unknown_cards[:hand_size])
+        masks[MASK_DISCARD + opponent] = cards_to_mask(unknown_cards[hand_size:hand_size + discard_count])
+        masks[MASK_DECK] = cards_to_mask(unknown_cards[hand_size + discard_count:])
+        return world
+
+    def resample(self, player: int, rng=None) -> 'OFCCompactState':
+        rng = rng if rng is not None else np.random
+        return self.determinize(player, rng.permutation(mask_to_cards(self.unknown_mask(player))).tolist())
+
+    def deal(self, player: int, cards: List[int]):
+        card_mask = cards_to_mask(cards)
+        if card_mask & ~self.masks[MASK_DECK]: raise ValueError(f"Карты {cards_to_strings(cards)} отсутствуют в колоде")
+        self.masks[MASK_DECK] ^= card_mask; self.masks[MASK_HAND + player] |= card_mask
+
+    def place(self, player: int, card: int, slot_idx: int):
+        pos = player * TOTAL_CARDS_PLACED + slot_idx
+        if self.slots[pos] != NO_CARD: raise ValueError(f"Слот {slot_idx} уже занят!")
+        self.slots[pos] = card; self.masks[player * NUM_ROWS + SLOT_ROW[slot_idx]] |= 1 << card; self.masks[MASK_HAND + player] &= ~(1 << card)
+
+    def discard(self, player: int, card: int):
+        bit = 1 << card; self.masks[MASK_HAND + player] &= ~bit; self.masks[MASK_DISCARD + player] |= bit
+
+    def to_state(self, game, deck_order: Optional[List[int]] = None) -> 'OFCPineappleState':
+        """Материализует полноценное OFCPineappleState. deck_order - порядок колоды (по умолчанию случайный)."""
+        state = _new_uninitialized_state(OFCPineappleState, game); masks = self.masks; slots = self.slots
+        state._num_players = NUM_PLAYERS; state._dealer_button = self.dealer_button; state._next_player_to_act = self.next_player_to_act
+        state._current_player = self.current_player; state._player_to_deal_to = self.player_to_deal_to; state._phase = self.phase
+        if deck_order is None: deck_order = mask_to_cards(masks[MASK_DECK]); np.random.shuffle(deck_order)
+        state._deck = list(deck_order)
+        state._board = [[-1 if card == NO_CARD else card for card in slots[p * TOTAL_CARDS_PLACED:(p + 1) * TOTAL_CARDS_PLACED]] for p in range(NUM_PLAYERS)]
+        state._current_cards = [mask_to_cards(masks[MASK_HAND + p]) for p in range(NUM_PLAYERS)]; state._discards = [mask_to_cards(masks[MASK_DISCARD + p]) for p in range(NUM_PLAYERS)]
+        state._cards_to_place_count = list(self.counts[:NUM_PLAYERS]); state._cards_to_discard_count = list(self.counts[NUM_PLAYERS:])
+        state._total_cards_placed = [sum(1 for card in slots[p * TOTAL_CARDS_PLACED:(p + 1) * TOTAL_CARDS_PLACED] if card != NO_CARD) for p in range(NUM_PLAYERS)]
+        state._game_over = self.game_over; state._cumulative_returns = list(self.cumulative_returns); state._current_hand_returns = list(self.current_hand_returns)
+        state._cached_legal_action_ids = None; state._cached_canonical_actions = None; state._is_fantasy_hand = self.is_fantasy_hand; state._next_fantasy_players = list(self.next_fantasy_players)
+        state._current_fantasy_player = self.current_fantasy_player; state._current_normal_player = self.current_normal_player
+        state._fantasy_cards_count = self.fantasy_cards_count; state._row_actions = game.row_actions
+        state._recompute_zobrist(); state._recompute_row_stats()
+        return state
+
+class OFCWorldPool(object):
+    """Пул из K миров, совместимых с инфостейтом игрока player в состоянии state.
+
+    Все миры сэмплируются одной векторной выборкой: permutations (K, U) - порядки U неизвестных
+    игроку карт, разложенные как в OFCPineappleState.determinize (рука соперника, его сбросы, колода).
+    Состояние мира строится лениво в world(k): клон state, в котором заменены только скрытые
+    карты соперника и колода, - без пересборки досок, статистик рядов и кэша легальных действий.
+    """
+    def __init__(self, state: 'OFCPineappleState', player: int, num_worlds: int, rng=None):
+        if not (0 <= player < NUM_PLAYERS): raise ValueError(f"Неверный player_id: {player}")
+        if num_worlds <= 0: raise ValueError(f"Размер пула должен быть положительным: {num_worlds}")
+        rng = rng if rng is not None else np.random
+        unknown_cards = np.array(mask_to_cards(FULL_DECK_MASK ^ state.known_mask(player)), dtype=np.int64)
+        self.state = state; self.player = player; self.hand_size, self.discard_count = state.hidden_counts(player)
+        if self.hand_size + self.discard_count > len(unknown_cards): raise ValueError(f"Не хватает неизвестных карт: {len(unknown_cards)}, нужно {self.hand_size + self.discard_count}")
+        self.permutations = unknown_cards[np.argsort(rng.random_sample((num_worlds, len(unknown_cards))), axis=1)]
+
+    def __len__(self) -> int: return len(self.permutations)
+
+    def world(self, k: int) -> 'OFCPineappleState':
+        """Состояние k-го мира (новый объект при каждом вызове)."""
+        return self.state.determinize(self.player, self.permutations[k].tolist())
+
+def _rebuild_state(game_params: Dict[str, Any], compact: 'OFCCompactState', deck_order: List[int]) -> 'OFCPineappleState':
+    return compact.to_state(pyspiel.load_game(_GAME_TYPE.short_name, game_params), deck_order=deck_order)
+
 # --- Регистрация игры ---
 # ... (Без изменений) ...
 try:
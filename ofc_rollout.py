@@ -0,0 +1,225 @@
+# Оценщик листьев ISMCTS для OFC Pineapple: доигрывание руки дешевой эвристической политикой.
+# Политика раскладывает карты так, чтобы не сфолить: верхний ряд не должен обгонять средний, средний - нижний,
+# пока у нижнего не осталось места, чтобы догнать. Доигрывание идет на компактном состоянии: силы рядов
+# поддерживаются инкрементально в плоском списке статистик (как OFCPineappleState._row_stats), буферы
+# статистик и колоды выделяются один раз на поток (оценщик можно звать из нескольких потоков, например, из-под
+# обертки с releases_gil для tree-параллельного ISMCTS).
+
+import threading
+from typing import List, Tuple
+import numpy as np
+
+import ofc_pineapple as ofc
+
+# Статистики ряда в рабочем буфере: число карт, сумма CARD_RANK_KEY, OR CARD_RANK_BIT, AND CARD_SUIT_BIT
+NUM_STATS = 4
+_EMPTY_ROW_STATS = [0, 0, 0, ofc.ALL_SUITS_MASK]
+_POW5 = [5 ** r for r in range(ofc.NUM_RANKS)]
+
+# Веса эвристики (в единицах оценки ряда: категория руки + старший ранг / 13)
+FOUL_PENALTY = 20.0 # Верхний ряд сильнее нижнего, а у нижнего не осталось места, чтобы догнать
+ORDER_PENALTY = 3.0 # Верхний ряд сильнее нижнего, но нижний еще может догнать (за единицу разницы / корень из числа свободных слотов)
+ROW_WEIGHTS = (0.2, 0.5, 0.8) # Ценность силы рядов (топ, середина, низ) - заготовка под роялти
+FLUSH_DRAW_BONUS = 1.0 # Одномастный незаполненный средний/нижний ряд (умножается на долю заполнения)
+FANTASY_PAIR_BONUS = 2.0 # Пара дам и выше на топе
+
+
+def row_estimate(row: int, count: int, rank_key: int, rank_bits: int, suit_mask: int) -> float:
+    """Оценка силы (частичного) ряда: категория руки плюс старший значимый ранг / 13; пустой ряд - -1.
+
+    Заполненный ряд оценивается точно (стриты и флеши учитываются), незаполненный - по кратностям рангов.
+    """
+    if count == 0: return -1.0
+    if count == ofc.ROW_SIZES[row]:
+        strength = ofc.finalize_row_strength(row, rank_key, rank_bits, suit_mask)
+        return ofc.hand_category(strength) + ofc.hand_primary_rank(strength) / ofc.NUM_RANKS
+    first = second = 0; group_rank = 0; bits = rank_bits
+    while bits: # Ранги от старшего к младшему; при равной кратности группа - старший ранг
+        rank = bits.bit_length() - 1; bits ^= 1 << rank; multiplicity = rank_key // _POW5[rank] % 5
+        if multiplicity > first: second = first; first = multiplicity; group_rank = rank
+        elif multiplicity > second: second = multiplicity
+    if first >= 4: category = ofc.FOUR_OF_A_KIND
+    elif first == 3: category = ofc.FULL_HOUSE if second >= 2 else ofc.THREE_OF_A_KIND
+    elif first == 2: category = ofc.TWO_PAIR if second == 2 else ofc.PAIR
+    else: category = ofc.HIGH_CARD
+    return category + group_rank / ofc.NUM_RANKS
+
+
+# Оценки рядов по ключу (rank_key, ряд, флеш): rank_key однозначно задает мультимножество рангов
+_ESTIMATE_CACHE = {}
+def _cached_row_estimate(row: int, count: int, rank_key: int, rank_bits: int, suit_mask: int) -> float:
+    key = (rank_key * ofc.NUM_ROWS + row) * 2 + (count == ofc.ROW_SIZES[row] and suit_mask != 0)
+    estimate = _ESTIMATE_CACHE.get(key)
+    if estimate is None: estimate = _ESTIMATE_CACHE[key] = row_estimate(row, count, rank_key, rank_bits, suit_mask)
+    return estimate
+
+
+def _row_after(stats: List[int], i: int, row: int, cards=()) -> Tuple[int, float, int]:
+    """(число карт, оценка, маска мастей) ряда со статистиками stats[i:i + NUM_STATS] после добавления cards."""
+    count = stats[i]; rank_key = stats[i + 1]; rank_bits = stats[i + 2]; suit_mask = stats[i + 3]
+    for card in cards: count += 1; rank_key += ofc.CARD_RANK_KEY[card]; rank_bits |= ofc.CARD_RANK_BIT[card]; suit_mask &= ofc.CARD_SUIT_BIT[card]
+    return count, _cached_row_estimate(row, count, rank_key, rank_bits, suit_mask), suit_mask
+
+
+def _board_value(top: Tuple[int, float, int], middle: Tuple[int, float, int], bottom: Tuple[int, float, int]) -> float:
+    """Эвристическая ценность доски по рядам в виде _row_after."""
+    top_estimate = top[1]; middle_count, middle_estimate, middle_suits = middle; bottom_count, bottom_estimate, bottom_suits = bottom
+    value = ROW_WEIGHTS[0] * top_estimate + ROW_WEIGHTS[1] * middle_estimate + ROW_WEIGHTS[2] * bottom_estimate
+    for upper, lower, lower_room in ((top_estimate, middle_estimate, ofc.MIDDLE_ROW_SIZE - middle_count), (middle_estimate, bottom_estimate, ofc.BOTTOM_ROW_SIZE - bottom_count)):
+        if upper > lower: value -= FOUL_PENALTY if upper - lower >= lower_room else ORDER_PENALTY * (upper - lower) / lower_room ** 0.5
+    if 2 <= middle_count < ofc.MIDDLE_ROW_SIZE and middle_suits: value += FLUSH_DRAW_BONUS * middle_count / ofc.MIDDLE_ROW_SIZE
+    if 2 <= bottom_count < ofc.BOTTOM_ROW_SIZE and bottom_suits: value += FLUSH_DRAW_BONUS * bottom_count / ofc.BOTTOM_ROW_SIZE
+    if top_estimate >= ofc.PAIR + ofc.FANTASY_TRIGGER_RANK / ofc.NUM_RANKS: value += FANTASY_PAIR_BONUS
+    return value
+
+
+def board_value(stats: List[int], player: int) -> float:
+    """Эвристическая ценность (частичной) доски player по статистикам рядов."""
+    base = player * ofc.NUM_ROWS * NUM_STATS
+    return _board_value(*[_row_after(stats, base + row * NUM_STATS, row) for row in range(ofc.NUM_ROWS)])
+
+
+def _add_card(stats: List[int], i: int, card: int):
+    stats[i] += 1; stats[i + 1] += ofc.CARD_RANK_KEY[card]; stats[i + 2] |= ofc.CARD_RANK_BIT[card]; stats[i + 3] &= ofc.CARD_SUIT_BIT[card]
+
+
+class OFCRolloutEvaluator(object):
+    """Оценщик для ISMCTSBot: evaluate доигрывает руку эвристической политикой, prior - softmax ее оценок.
+
+    evaluate возвращает накопленные очки плюс средний результат num_rollouts доигрываний текущей руки
+    (колода перемешивается перед каждым). Поддерживает evaluate_batch/prior_batch пакетной оценки листьев.
+    """
+
+    def __init__(self, num_rollouts: int = 1, prior_temperature: float = 1.0, random_state=None):
+        self._num_rollouts = num_rollouts
+        self._prior_temperature = prior_temperature
+        self._random_state = random_state or np.random.RandomState()
+        self._local = threading.local()
+
+    # --- Интерфейс оценщика ---
+    def evaluate(self, state) -> np.ndarray:
+        compact = state if isinstance(state, ofc.OFCCompactState) else state.to_compact()
+        returns = np.array(compact.cumulative_returns, dtype=np.float64)
+        if compact.game_over: return returns
+        self._load_stats(compact); total = 0.0
+        for _ in range(self._num_rollouts): total += self.rollout(compact)
+        diff = total / self._num_rollouts
+        returns[0] += diff; returns[1] -= diff
+        return returns
+
+    def prior(self, state) -> List[Tuple[int, float]]:
+        # Fantasy F: около миллиона расстановок, prior - по лучшим расстановкам солвера
+        fantasy_priors = ofc.fantasy_prior(state)
+        if fantasy_priors: return fantasy_priors
+        player = state.current_player(); legal_actions = state.legal_actions(player)
+        if not legal_actions: return []
+        compact = state.to_compact(); stats = self._load_stats(compact)
+        row_actions = state.get_game().row_actions; hand = ofc.mask_to_cards(compact.masks[ofc.MASK_HAND + player])
+        values = []; cache = {}
+        for action in legal_actions:
+            targets, discard_idx = ofc.decode_action(action, row_actions)
+            # Слоты одного ряда взаимозаменяемы для эвристики
+            rows = targets if row_actions else tuple(ofc.SLOT_ROW[slot] for slot in targets)
+            key = (discard_idx, rows); value = cache.get(key)
+            if value is None:
+                cards = hand[:discard_idx] + hand[discard_idx + 1:] if discard_idx >= 0 else hand
+                value = cache[key] = self._placement_value(stats, player, cards, rows)
+            values.append(value)
+        values = np.array(values) / max(self._prior_temperature, 1e-9)
+        probs = np.exp(values - values.max()); probs /= probs.sum()
+        return list(zip(legal_actions, probs.tolist()))
+
+    def evaluate_batch(self, states) -> List[np.ndarray]: return [self.evaluate(state) for state in states]
+    def prior_batch(self, states) -> List[List[Tuple[int, float]]]: return [self.prior(state) for state in states]
+
+    # --- Доигрывание ---
+    def _buffers(self) -> Tuple[List[int], List[int], List[int]]:
+        """Рабочие буферы текущего потока: (статистики, начальные статистики, колода)."""
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            size = ofc.NUM_PLAYERS * ofc.NUM_ROWS * NUM_STATS; buffers = self._local.buffers = ([0] * size, [0] * size, [])
+        return buffers
+
+    def _load_stats(self, compact: 'ofc.OFCCompactState') -> List[int]:
+        """Статистики рядов досок compact в начальные статистики потока (точка старта каждого доигрывания);
+        возвращает рабочий буфер статистик с их копией."""
+        work_stats, stats, _ = self._buffers(); slots = compact.slots
+        for p in range(ofc.NUM_PLAYERS):
+            for row in range(ofc.NUM_ROWS):
+                i = (p * ofc.NUM_ROWS + row) * NUM_STATS; stats[i:i + NUM_STATS] = _EMPTY_ROW_STATS
+            for slot_idx in range(ofc.TOTAL_CARDS_PLACED):
+                card = slots[p * ofc.TOTAL_CARDS_PLACED + slot_idx]
+                if card != ofc.NO_CARD: _add_card(stats, (p * ofc.NUM_ROWS + ofc.SLOT_ROW[slot_idx]) * NUM_STATS, card)
+        work_stats[:] = stats
+        return work_stats
+
+    def rollout(self, compact: 'ofc.OFCCompactState') -> float:
+        """Доигрывает текущую руку из compact (статистики уже загружены _load_stats); очки P0 - P1 за руку."""
+        stats, initial_stats, deck = self._buffers(); stats[:] = initial_stats; masks = compact.masks
+        deck[:] = ofc.mask_to_cards(masks[ofc.MASK_DECK]); self._random_state.shuffle(deck)
+        placed = [sum(stats[(p * ofc.NUM_ROWS + row) * NUM_STATS] for row in range(ofc.NUM_ROWS)) for p in range(ofc.NUM_PLAYERS)]
+        hands = [ofc.mask_to_cards(masks[ofc.MASK_HAND + p]) for p in range(ofc.NUM_PLAYERS)]
+        if compact.is_fantasy_hand: order = (compact.current_normal_player, compact.current_fantasy_player)
+        else: order = (compact.next_player_to_act, 1 - compact.next_player_to_act)
+        while True:
+            # Обычная рука: первый игрок ходит, пока он не впереди второго; в Fantasy N доигрывает раньше F
+            first, second = order
+            if compact.is_fantasy_hand: player = first if placed[first] < ofc.TOTAL_CARDS_PLACED else second
+            else: player = first if placed[first] <= placed[second] and placed[first] < ofc.TOTAL_CARDS_PLACED else second
+            if placed[player] >= ofc.TOTAL_CARDS_PLACED: break
+            hand = hands[player]
+            if not hand:
+                if compact.is_fantasy_hand and player == compact.current_fantasy_player: num_cards = compact.fantasy_cards_count
+                else: num_cards = 5 if placed[player] == 0 else 3
+                hand = sorted(deck.pop() for _ in range(num_cards))
+            placed[player] += self._place_hand(stats, player, hand); hands[player] = []
+        evals = []
+        for p in range(ofc.NUM_PLAYERS):
+            base = p * ofc.NUM_ROWS * NUM_STATS
+            evals.append(tuple(ofc.finalize_row_strength(row, *stats[base + row * NUM_STATS + 1:base + (row + 1) * NUM_STATS]) for row in range(ofc.NUM_ROWS)))
+        return float(ofc.showdown_diff(evals[0], evals[1]))
+
+    def _place_hand(self, stats: List[int], player: int, hand: List[int]) -> int:
+        """Раскладывает руку эвристикой (изменяя stats) и возвращает число положенных карт."""
+        base = player * ofc.NUM_ROWS * NUM_STATS
+        if len(hand) == 3: # Улицы 2-5: лучший из вариантов (сброс, ряды двух карт)
+            current = [_row_after(stats, base + row * NUM_STATS, row) for row in range(ofc.NUM_ROWS)]
+            free_rows = [row for row in range(ofc.NUM_ROWS) if current[row][0] < ofc.ROW_SIZES[row]]
+            with_card = {(card, row): _row_after(stats, base + row * NUM_STATS, row, (card,)) for card in hand for row in free_rows}
+            best_value = None; best = None
+            for discard_idx in range(3):
+                first, second = [card for i, card in enumerate(hand) if i != discard_idx]
+                for row_a in free_rows:
+                    for row_b in free_rows:
+                        rows = current[:]
+                        if row_a == row_b:
+                            if current[row_a][0] + 2 > ofc.ROW_SIZES[row_a]: continue
+                            rows[row_a] = _row_after(stats, base + row_a * NUM_STATS, row_a, (first, second))
+                        else: rows[row_a] = with_card[first, row_a]; rows[row_b] = with_card[second, row_b]
+                        value = _board_value(*rows)
+                        if best_value is None or value > best_value: best_value = value; best = ((first, row_a), (second, row_b))
+            for card, row in best: _add_card(stats, base + row * NUM_STATS, card)
+            return 2
+        # Улица 1 и Fantasy F: жадно по одной карте - сначала карты парных рангов, затем от старших к младшим
+        rank_counts = [0] * ofc.NUM_RANKS
+        for card in hand: rank_counts[ofc.card_rank(card)] += 1
+        cards = sorted(hand, key=lambda card: (-rank_counts[ofc.card_rank(card)], -card))
+        num_to_place = min(len(cards), ofc.TOTAL_CARDS_PLACED - sum(stats[base + row * NUM_STATS] for row in range(ofc.NUM_ROWS)))
+        if len(cards) > num_to_place: cards = cards[:num_to_place] # Fantasy F: сбрасываются младшие непарные карты
+        for card in cards: self._place_card(stats, player, card)
+        return num_to_place
+
+    def _place_card(self, stats: List[int], player: int, card: int):
+        base = player * ofc.NUM_ROWS * NUM_STATS; best_value = None; best_row = None
+        current = [_row_after(stats, base + row * NUM_STATS, row) for row in range(ofc.NUM_ROWS)]
+        for row in range(ofc.NUM_ROWS):
+            if current[row][0] >= ofc.ROW_SIZES[row]: continue
+            rows = current[:]; rows[row] = _row_after(stats, base + row * NUM_STATS, row, (card,))
+            value = _board_value(*rows)
+            if best_value is None or value > best_value: best_value = value; best_row = row
+        _add_card(stats, base + best_row * NUM_STATS, card)
+
+    def _placement_value(self, stats: List[int], player: int, cards, rows) -> float:
+        """Ценность доски player после раскладки cards по rows."""
+        base = player * ofc.NUM_ROWS * NUM_STATS
+        return _board_value(*[_row_after(stats, base + row * NUM_STATS, row, [card for card, card_row in zip(cards, rows) if card_row == row]) for row in range(ofc.NUM_ROWS)])
@@ -0,0 +1,122 @@
+"""Tests for ISMCTSBot on OFC Pineapple."""
+
+import time
+
+import numpy as np
+import pyspiel
+import pytest
+
+import ismcts
+import ofc_pineapple as ofc
+
+
+def _first_street_state(seed=0):
+  np.random.seed(seed)
+  state = pyspiel.load_game("ofc_pineapple", {"row_actions": True}).new_initial_state()
+  while state.is_chance_node(): state.apply_action(state.sample_chance_outcome())
+  return state
+
+
+class _DealRecorder(object):
+  """Zero evaluator that records the second player's first-street hands reaching the leaves."""
+
+  def __init__(self):
+    self.hands = []
+
+  def evaluate(self, state):
+    if state._phase == ofc.STREET_FIRST_PLACE_P2:
+      self.hands.append(tuple(state._current_cards[state.current_player()]))
+    return [0.0] * ofc.NUM_PLAYERS
+
+  def prior(self, state):
+    legal = state.legal_actions()
+    return [(action, 1.0 / len(legal)) for action in legal]
+
+
+def test_reused_world_deals_varied_cards():
+  # Один мир на весь поиск: будущие сдачи все равно должны различаться между симуляциями
+  recorder = _DealRecorder()
+  bot = ismcts.ISMCTSBot(_first_street_state().get_game(), recorder, 2.0, 300, max_world_samples=1,
+                         random_state=np.random.RandomState(0), exact_endgame_max_outcomes=None)
+  bot.run_search(_first_street_state())
+  assert len(recorder.hands) > 20
+  assert len(set(recorder.hands)) > len(recorder.hands) // 2
+
+
+def test_sample_chance_outcome_is_dealt():
+  state = _first_street_state()
+  state.apply_action(state.legal_actions()[0])
+  deck = set(state._deck)
+  outcome = state.sample_chance_outcome(np.random.RandomState(1))
+  player = state._player_to_deal_to
+  state.apply_action(outcome)
+  assert outcome in state._current_cards[player]
+  assert set(state._current_cards[player]) <= deck and len(state._current_cards[player]) == 5
+
+
+class _RemoteRolloutEvaluator(object):
+  """OFCRolloutEvaluator behind a simulated evaluation server: the wait releases the GIL."""
+
+  releases_gil = True
+
+  def __init__(self):
+    import ofc_rollout
+    self._evaluator = ofc_rollout.OFCRolloutEvaluator(random_state=np.random.RandomState(0))
+
+  def evaluate(self, state):
+    time.sleep(0.0005)
+    return self._evaluator.evaluate(state)
+
+  def prior(self, state):
+    return self._evaluator.prior(state)
+
+
+def test_tree_parallel_with_rollout_evaluator(capsys):
+  # Потоки оценивают листья одним оценщиком вне блокировки дерева
+  state = _first_street_state(1)
+  for eval_batch_size in (1, 4):
+    bot = ismcts.ISMCTSBot(state.get_game(), _RemoteRolloutEvaluator(), 2.0, 200,
+                           random_state=np.random.RandomState(0), num_tree_threads=4, eval_batch_size=eval_batch_size,
+                           exact_endgame_max_outcomes=None)
+    policy = bot.run_search(state)
+    assert "Ошибка" not in capsys.readouterr().out
+    assert bot._root_node.total_visits == 200
+    assert sum(node.total_virtual_losses for node in bot._nodes.values()) == 0
+    assert abs(sum(prob for _, prob in policy) - 1.0) < 1e-9
+
+
+def test_tree_parallel_rejects_pure_python_evaluator():
+  import ofc_rollout
+  with pytest.raises(ValueError):
+    ismcts.ISMCTSBot(_first_street_state().get_game(), ofc_rollout.OFCRolloutEvaluator(), 2.0, 10, num_tree_threads=2)
+
+
+def test_root_parallel_tasks_do_not_share_trees():
+  # Один процесс пула может выполнить две задачи одного поиска: статистики не должны суммироваться
+  state = _first_street_state(2)
+  bot = ismcts.ISMCTSBot(state.get_game(), _DealRecorder(), 2.0, 50, reuse_tree=True, num_workers=2,
+                         exact_endgame_max_outcomes=None)
+  ismcts._init_root_parallel_worker([], bot._worker_config(), None)
+  for seed in (1, 2):
+    statistics, simulations, _, _ = ismcts._root_parallel_search(state, 50, seed)
+    assert simulations == 50 and statistics[4] == 50
+
+
+class _BoundedTableBot(ismcts.ISMCTSBot):
+  """Checks the node table bound and the root after every simulation batch."""
+
+  def _run_batch(self, state, sim_count, num_simulations):
+    super()._run_batch(state, sim_count, num_simulations)
+    assert len(self._nodes) <= self._max_nodes
+    assert any(node is self._root_node for node in self._nodes.values())
+
+
+@pytest.mark.parametrize("eval_batch_size", [1, 4])
+def test_node_table_stays_under_max_nodes(eval_batch_size):
+  state = _first_street_state(3)
+  bot = _BoundedTableBot(state.get_game(), _DealRecorder(), 2.0, 300, max_nodes=40, eval_batch_size=eval_batch_size,
+                         random_state=np.random.RandomState(0), exact_endgame_max_outcomes=None)
+  bot.run_search(state)
+  info = bot.last_search_info
+  assert info.simulations == 300 and info.evicted_nodes > 0 and info.num_nodes <= 40
+  assert bot._root_node.total_visits == 300
@@ -0,0 +1,47 @@
+"""Дифференциальные тесты OFCBatch против OFCPineappleState (row_actions=True)."""
+
+import numpy as np
+import pyspiel
+import pytest
+
+import ofc_batch
+import ofc_pineapple as ofc
+
+NUM_GAMES = 150
+
+
+def _reference_state(game, deck, dealer_button):
+    """OFCPineappleState перед первой сдачей с заданными колодой и кнопкой дилера."""
+    state = game.new_initial_state()
+    state._dealer_button = dealer_button; state._next_player_to_act = state._player_to_deal_to = (dealer_button + 1) % ofc.NUM_PLAYERS
+    state._deck = [int(card) for card in deck]
+    return state
+
+
+@pytest.mark.parametrize("dealer_button", [0, 1])
+def test_batch_matches_state(dealer_button):
+    rng = np.random.RandomState(dealer_button); game = pyspiel.load_game("ofc_pineapple", {"row_actions": True})
+    batch = ofc_batch.OFCBatch(NUM_GAMES, rng, dealer_button=dealer_button)
+    states = [_reference_state(game, deck, dealer_button) for deck in batch.decks]
+    while not batch.is_showdown():
+        for state in states:
+            assert state.is_chance_node() == batch.is_deal_phase()
+            assert (state._player_to_deal_to if state.is_chance_node() else state.current_player()) == batch.current_player()
+        if batch.is_deal_phase():
+            for state in states: state.apply_action(state._deck[-1])
+            batch.deal()
+        else:
+            rows, discard_idx = batch.random_actions(rng)
+            for i, state in enumerate(states):
+                action = ofc.encode_action(rows[i].tolist(), -1 if discard_idx is None else int(discard_idx[i]), True)
+                assert action in state.legal_actions()
+                state.apply_action(action)
+            batch.apply(rows, discard_idx)
+        for i, state in enumerate(states):
+            assert state._phase == batch.phase
+            for p in range(ofc.NUM_PLAYERS):
+                assert state._board[p] == batch.boards[i, p].tolist()
+                assert state._discards[p] == batch.discards[i, p, :batch.discard_counts[p]].tolist()
+    diffs = batch.showdown()
+    for i, state in enumerate(states):
+        assert diffs[i] == ofc.showdown_diff(ofc.evaluate_board(state._board[0]), ofc.evaluate_board(state._board[1]))
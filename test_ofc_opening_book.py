@@ -0,0 +1,57 @@
+"""Тесты книги дебютов первой улицы."""
+
+import numpy as np
+import pyspiel
+
+import ofc_opening_book as book_lib
+import ofc_pineapple as ofc
+
+
+def _placements(state, policy):
+    """Политика как {frozenset((карта, цель)): вероятность} - не зависит от порядка карт в руке."""
+    hand = state._current_cards[state.current_player()]; placements = {}
+    for action, prob in policy:
+        targets, discard_idx = ofc.decode_action(action, state._row_actions)
+        assert discard_idx == -1 and len(targets) == len(hand)
+        placements[frozenset(zip(hand, targets))] = prob
+    return placements
+
+
+def test_canonical_hands_are_fixed_points_in_colex_order():
+    hands = book_lib.canonical_hands()
+    assert len(hands) == 134459
+    indices = [book_lib.hand_index(hand) for hand in hands.tolist()]
+    assert indices == sorted(indices)
+    for hand in hands[::997].tolist(): assert book_lib.canonical_hand(hand) == tuple(hand)
+
+
+def test_tiny_book_lookup_is_suit_permutation_invariant(tmp_path):
+    """Крошечная книга в tmp: строка считается поиском, открывается через memmap и находится под перестановкой мастей."""
+    path = str(tmp_path / "book"); game = pyspiel.load_game("ofc_pineapple", {"row_actions": True})
+    assert book_lib.build_opening_book(path, num_simulations=16, stop=0, verbose=False) == 0
+    hand = [49, 44, 22, 1, 7] # разные подписи у всех мастей: перестановка меняет руку
+    canonical = book_lib.canonical_hand(hand); row = int(np.load(f"{path}/index.npy")[book_lib.hand_index(canonical)])
+    assert book_lib.build_opening_book(path, num_simulations=16, start=row, stop=row + 1, top_k=4, verbose=False) == 1
+    assert book_lib.build_opening_book(path, num_simulations=16, start=row, stop=row + 1, verbose=False) == 0 # строка уже посчитана
+
+    book = book_lib.OFCOpeningBook(path)
+    assert all(isinstance(array, np.memmap) for array in (book.index, book.actions, book.probs))
+    canonical_state = book_lib.first_street_state(game, list(canonical))
+    expected = _placements(canonical_state, book.lookup(canonical_state))
+    assert expected and abs(sum(expected.values()) - 1) < 1e-6
+    for perm in [(1, 0, 3, 2), (3, 2, 1, 0), (2, 3, 0, 1)]:
+        card_map = ofc.SUIT_PERMUTATION_CARD_MAPS[perm]; inverse = {card_map[card]: card for card in range(ofc.NUM_CARDS)}
+        state = book_lib.first_street_state(game, sorted(card_map[card] for card in hand))
+        policy = book.lookup(state)
+        assert policy and all(action in state.legal_actions() for action, _ in policy)
+        # Сводим к канонической руке: карта -> исходная масть -> каноническая масть
+        to_canonical = ofc.SUIT_PERMUTATION_CARD_MAPS[book_lib.canonical_suit_permutation(hand)]
+        got = {frozenset((to_canonical[inverse[card]], target) for card, target in placement): prob
+               for placement, prob in _placements(state, policy).items()}
+        assert got.keys() == expected.keys()
+        assert all(abs(got[key] - expected[key]) < 1e-6 for key in expected)
+
+    other = book_lib.first_street_state(game, [0, 4, 8, 12, 16]) # строка не посчитана
+    assert book.lookup(other) is None
+    canonical_state.apply_action(canonical_state.legal_actions()[0])
+    assert book.lookup(canonical_state) is None # не первая улица P1
@@ -0,0 +1,236 @@
+"""Тесты правил и утилит ofc_pineapple."""
+
+import itertools
+import math
+
+import numpy as np
+import pyspiel
+import pytest
+
+import ofc_pineapple as ofc
+
+
+def test_solve_fantasyland_arrangements_are_valid():
+    rng = np.random.RandomState(0)
+    for _ in range(3):
+        cards = rng.permutation(ofc.NUM_CARDS)[:ofc.FANTASY_HAND_SIZE].tolist()
+        solutions = ofc.solve_fantasyland(cards, top_n=3)
+        assert [score for score, *_ in solutions] == sorted((score for score, *_ in solutions), reverse=True)
+        for _, top, middle, bottom, discarded in solutions:
+            assert sorted(top + middle + bottom + discarded) == sorted(cards) and len(discarded) == 1
+            assert not ofc.is_dead_hand(*ofc.evaluate_board(list(top + middle + bottom)))
+
+
+def _brute_force_fantasyland(cards):
+    """Все живые расстановки перебором: ключи (очки, силы низа, середины и топа) по убыванию."""
+    keys = []
+    for bottom in itertools.combinations(cards, 5):
+        rest = [card for card in cards if card not in bottom]
+        for middle in itertools.combinations(rest, 5):
+            for top in itertools.combinations([card for card in rest if card not in middle], 3):
+                evals = ofc.evaluate_board(list(top + middle + bottom))
+                if ofc.is_dead_hand(*evals): continue
+                repeat = ofc.hand_category(evals[0]) == ofc.THREE_OF_A_KIND or ofc.hand_category(evals[1]) >= ofc.FULL_HOUSE or ofc.hand_category(evals[2]) >= ofc.FOUR_OF_A_KIND
+                keys.append((ofc.board_royalties(evals) + ofc.FANTASY_REPEAT_BONUS * repeat, evals[2], evals[1], evals[0]))
+    return sorted(keys, reverse=True)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_solve_fantasyland_matches_brute_force(seed):
+    """Отсечения не теряют лучших расстановок: ключи top_n совпадают с полным перебором 13 карт."""
+    cards = np.random.RandomState(seed).permutation(ofc.NUM_CARDS)[:ofc.TOTAL_CARDS_PLACED].tolist()
+    solutions = ofc.solve_fantasyland(cards, top_n=5)
+    keys = [(score, ofc.evaluate_row5(*bottom), ofc.evaluate_row5(*middle), ofc.evaluate_row3(*top)) for score, top, middle, bottom, _ in solutions]
+    assert keys == _brute_force_fantasyland(cards)[:5]
+
+
+def _fantasy_f_state(seed, row_actions=True):
+    """Состояние PHASE_FANTASY_F_PLACE: P0 в Fantasy, P1 уже разложил свою руку случайными ходами."""
+    np.random.seed(seed); rng = np.random.RandomState(seed)
+    state = pyspiel.load_game("ofc_pineapple", {"row_actions": row_actions}).new_initial_state()
+    state._next_fantasy_players = [0]; state._phase = ofc.PHASE_FANTASY_SETUP; state._go_to_next_phase()
+    while state._phase != ofc.PHASE_FANTASY_F_PLACE:
+        if state.is_chance_node(): state.apply_action(0)
+        else: legal = state.legal_actions(); state.apply_action(legal[rng.randint(len(legal))])
+    return state
+
+
+@pytest.mark.parametrize("row_actions", [True, False])
+def test_fantasy_legal_actions_are_complete(row_actions):
+    state = _fantasy_f_state(0, row_actions); legal = state.legal_actions()
+    assert len(legal) == ofc.FANTASY_HAND_SIZE * ofc.NUM_FANTASY_PARTITIONS and legal == sorted(set(legal))
+    solver_actions = [action for _, action in state.fantasy_solver_actions(top_n=3)]
+    prior = ofc.fantasy_prior(state, top_n=3)
+    assert [action for action, _ in prior] == solver_actions and np.isclose(sum(prob for _, prob in prior), 1.0)
+    legal_set = set(legal); assert all(action in legal_set for action in solver_actions)
+    for action in (legal[0], legal[len(legal) // 2], solver_actions[0]): # любая расстановка применима, а не только солверные
+        child = state.clone(); child.apply_action(action)
+        assert -1 not in child._board[0] and len(child._discards[0]) == 1 and sorted(child._board[0] + child._discards[0]) == state._current_cards[0]
+
+
+def _relabeled(state, card_map):
+    """Изоморфное состояние: все карты перемаркированы card_map (руки и сбросы остаются отсортированными)."""
+    relabeled = state.clone()
+    for p in range(ofc.NUM_PLAYERS):
+        relabeled._board[p] = [card_map[card] if card != -1 else -1 for card in state._board[p]]
+        relabeled._current_cards[p] = sorted(card_map[card] for card in state._current_cards[p]); relabeled._discards[p] = sorted(card_map[card] for card in state._discards[p])
+    relabeled._deck = [card_map[card] for card in state._deck]; relabeled._recompute_zobrist(); relabeled._recompute_row_stats(); relabeled._clear_cache()
+    return relabeled
+
+
+def _relabeled_action(state, relabeled, action, card_map, row_actions):
+    """Номер того же действия (те же карты в те же цели) для перемаркированной руки."""
+    player = state.current_player(); hand = state._current_cards[player]; relabeled_hand = relabeled._current_cards[player]
+    targets, discard_idx = ofc.decode_action(action, row_actions)
+    cards = hand[:discard_idx] + hand[discard_idx + 1:] if discard_idx >= 0 else hand; target_of = {card_map[card]: target for card, target in zip(cards, targets)}
+    discarded = card_map[hand[discard_idx]] if discard_idx >= 0 else None
+    return ofc.encode_action([target_of[card] for card in relabeled_hand if card != discarded], relabeled_hand.index(discarded) if discarded is not None else -1, row_actions)
+
+
+@pytest.mark.parametrize("perm", [(1, 0, 2, 3), (3, 2, 1, 0)])
+def test_fantasy_canonical_actions_match_across_suit_permutations(perm):
+    """Одна и та же расстановка в изоморфных состояниях получает одно каноническое действие."""
+    state = _fantasy_f_state(1); card_map = ofc.SUIT_PERMUTATION_CARD_MAPS[perm]; relabeled = _relabeled(state, card_map)
+    assert relabeled.canonical_information_state_key(0) == state.canonical_information_state_key(0)
+    offset = ofc.ACTION_LAYOUTS[True].fantasy_offset; canonical = state.canonical_actions(0); relabeled_canonical = relabeled.canonical_actions(0)
+    for action in np.random.RandomState(0).randint(offset, offset + len(canonical), size=200).tolist():
+        assert canonical[action - offset] == relabeled_canonical[_relabeled_action(state, relabeled, action, card_map, True) - offset]
+
+
+@pytest.mark.parametrize("num_cards", [ofc.TOTAL_CARDS_PLACED - 1, ofc.FANTASY_HAND_SIZE + 1])
+def test_solve_fantasyland_rejects_hand_size(num_cards):
+    with pytest.raises(ValueError):
+        ofc.solve_fantasyland(list(range(num_cards)))
+
+
+def test_clone_is_independent_of_original():
+    """Клон разделяет руки и сбросы с оригиналом (копирование при записи): ходы в клоне не меняют оригинал."""
+    np.random.seed(0); rng = np.random.RandomState(0)
+    state = pyspiel.load_game("ofc_pineapple", {"row_actions": True}).new_initial_state()
+    while state._phase != ofc.STREET_SECOND_PLACE_P1:
+        if state.is_chance_node(): state.apply_action(0)
+        else: legal = state.legal_actions(); state.apply_action(legal[rng.randint(len(legal))])
+    snapshot = str(state), [hand[:] for hand in state._current_cards], [pile[:] for pile in state._discards], state.information_state_string(0)
+    cloned = state.clone()
+    while not cloned.is_terminal() and cloned._phase != ofc.STREET_FIFTH_PLACE_P2:
+        if cloned.is_chance_node(): cloned.apply_action(0)
+        else: legal = cloned.legal_actions(); cloned.apply_action(legal[rng.randint(len(legal))])
+    assert (str(state), state._current_cards, state._discards, state.information_state_string(0)) == snapshot
+    assert str(cloned) != snapshot[0]
+
+
+@pytest.mark.parametrize("public_info", [True, False])
+def test_fill_batch_matches_set_from(public_info):
+    np.random.seed(1); rng = np.random.RandomState(1); game = pyspiel.load_game("ofc_pineapple", {"row_actions": True})
+    states, players = [], []
+    for _ in range(10):
+        state = game.new_initial_state()
+        while state._phase <= ofc.STREET_FIFTH_PLACE_P2:
+            if state.is_chance_node(): state.apply_action(0)
+            else: legal = state.legal_actions(); state.apply_action(legal[rng.randint(len(legal))])
+            states.append(state.clone()); players.append(int(rng.randint(ofc.NUM_PLAYERS)))
+    observer = game.make_py_observer(pyspiel.IIGObservationType(public_info=public_info, perfect_recall=False))
+    out = np.full((len(states) + 1, observer.size), 7, np.float32)
+    for batch in (states, states[:5]): # второй, меньший пакет переиспользует буферы наблюдателя
+        observer.fill_batch(batch, players[:len(batch)], out)
+        for i, (state, player) in enumerate(zip(batch, players)):
+            observer.set_from(state, player); np.testing.assert_array_equal(out[i], observer.tensor)
+
+
+def _expected_placements(state, player, row_actions):
+    """Все размещения руки player перебором (карта, слот/ряд) - эталон для legal_actions."""
+    hand = state._current_cards[player]; board = state._board[player]; placements = set()
+    free_slots = [slot for slot, card in enumerate(board) if card == -1]; free_per_row = [sum(board[slot] == -1 for slot in row_slots) for row_slots in ofc.ROW_SLOTS]
+    targets = lambda n: [rows for rows in itertools.product(range(ofc.NUM_ROWS), repeat=n) if all(rows.count(r) <= free_per_row[r] for r in range(ofc.NUM_ROWS))] if row_actions else list(itertools.permutations(free_slots, n))
+    if len(hand) == 5: return {tuple(zip(hand, t)) for t in targets(5)}
+    for discard_idx, discard in enumerate(hand):
+        cards = hand[:discard_idx] + hand[discard_idx + 1:]; placements.update((tuple(zip(cards, t)), discard) for t in targets(2))
+    return placements
+
+
+@pytest.mark.parametrize("row_actions", [False, True])
+def test_legal_actions_cover_exactly_the_feasible_placements(row_actions):
+    layout = ofc.ACTION_LAYOUTS[row_actions]; rng = np.random.RandomState(0)
+    sampled = rng.randint(0, layout.place2_offset, 2000).tolist() + rng.randint(layout.fantasy_offset, layout.num_actions, 2000).tolist()
+    for action_id in sampled + list(range(layout.place2_offset, layout.fantasy_offset)):
+        assert ofc.encode_action(*ofc.decode_action(action_id, row_actions), row_actions) == action_id
+    assert layout.num_actions == layout.fantasy_offset + ofc.FANTASY_HAND_SIZE * 286 * 252
+    np.random.seed(2); state = pyspiel.load_game("ofc_pineapple", {"row_actions": row_actions}).new_initial_state()
+    while state._phase <= ofc.STREET_FIFTH_PLACE_P2:
+        if state.is_chance_node(): state.apply_action(0); continue
+        player = state.current_player(); legal = state.legal_actions()
+        assert legal == sorted(set(legal))
+        assert {state._action_tuple(player, action_id) for action_id in legal} == _expected_placements(state, player, row_actions)
+        state.apply_action(legal[rng.randint(len(legal))])
+
+
+def test_resample_from_infostate_keeps_infostate_and_zobrist():
+    """Мир - клон с замененными скрытыми картами: инфостейт игрока тот же, Zobrist-ключ совпадает с пересчитанным."""
+    np.random.seed(2); rng = np.random.RandomState(2); state = pyspiel.load_game("ofc_pineapple", {"row_actions": True}).new_initial_state()
+    while state._phase <= ofc.STREET_FIFTH_PLACE_P2:
+        if state.is_chance_node(): state.apply_action(0); continue
+        player = state.current_player(); world = state.resample_from_infostate(player, None, rng)
+        assert world.information_state_string(player) == state.information_state_string(player)
+        assert sorted(world._deck + world._current_cards[1 - player] + world._discards[1 - player]) == ofc.mask_to_cards(ofc.FULL_DECK_MASK ^ state.known_mask(player))
+        zobrist = world._zobrist[:]; world._recompute_zobrist(); assert world._zobrist == zobrist
+        legal = state.legal_actions(); state.apply_action(legal[rng.randint(len(legal))])
+
+
+def test_information_state_key_matches_information_state_string():
+    """Zobrist-ключ инфостейта и information_state_string взаимно однозначны на многих состояниях (включая миры одного инфостейта)."""
+    np.random.seed(3); rng = np.random.RandomState(3); game = pyspiel.load_game("ofc_pineapple", {"row_actions": True})
+    key_to_string, string_to_key = {}, {}
+    for _ in range(20):
+        state = game.new_initial_state()
+        while state._phase <= ofc.STREET_FIFTH_PLACE_P2:
+            states = [state] + ([state.resample_from_infostate(state.current_player(), None, rng) for _ in range(2)] if not state.is_chance_node() else [])
+            for candidate in states:
+                for player in range(ofc.NUM_PLAYERS):
+                    key = candidate.information_state_key(player); string = candidate.information_state_string(player)
+                    assert key_to_string.setdefault(key, string) == string and string_to_key.setdefault(string, key) == key
+            if state.is_chance_node(): state.apply_action(0)
+            else: legal = state.legal_actions(); state.apply_action(legal[rng.randint(len(legal))])
+    assert len(key_to_string) >= 500
+
+
+@pytest.mark.parametrize("row_actions", [True, False])
+def test_canonical_keys_and_actions_are_suit_permutation_invariant(row_actions):
+    """Для всех 24 перестановок мастей: канонический ключ инфостейта тот же, а каждое действие и его образ
+    при перестановке имеют одно каноническое представление (для обоих игроков и на всех улицах 2-5)."""
+    np.random.seed(4); rng = np.random.RandomState(4); state = pyspiel.load_game("ofc_pineapple", {"row_actions": row_actions}).new_initial_state()
+    while state._phase != ofc.STREET_SECOND_DEAL_P1: # первая улица - без перебора огромного числа действий в режиме слотов
+        if state.is_chance_node(): state.apply_action(0)
+        else: legal = state.legal_actions(); state.apply_action(legal[rng.randint(len(legal))])
+    while state._phase <= ofc.STREET_FIFTH_PLACE_P2:
+        if state.is_chance_node(): state.apply_action(0); continue
+        player = state.current_player(); canonical = dict(zip(state.legal_actions(), state.canonical_actions(player)))
+        for perm in ofc.SUIT_PERMUTATIONS:
+            card_map = ofc.SUIT_PERMUTATION_CARD_MAPS[perm]; relabeled = _relabeled(state, card_map)
+            for p in range(ofc.NUM_PLAYERS): assert relabeled.canonical_information_state_key(p) == state.canonical_information_state_key(p)
+            relabeled_canonical = dict(zip(relabeled.legal_actions(), relabeled.canonical_actions(player)))
+            for action, canonical_action in canonical.items():
+                assert relabeled_canonical[_relabeled_action(state, relabeled, action, card_map, row_actions)] == canonical_action
+        legal = state.legal_actions(); state.apply_action(legal[rng.randint(len(legal))])
+
+
+def test_exact_action_values_match_brute_force():
+    """exact_action_values на пятой улице первого игрока совпадает с перебором через сам движок: все сдачи
+    3 карт соперника из неизвестных карт, лучший ответ соперника среди его легальных действий, скалярный подсчет."""
+    np.random.seed(5); rng = np.random.RandomState(5); state = pyspiel.load_game("ofc_pineapple", {"row_actions": True}).new_initial_state()
+    while state._phase != ofc.STREET_FIFTH_PLACE_P1:
+        if state.is_chance_node(): state.apply_action(0)
+        else: legal = state.legal_actions(); state.apply_action(legal[rng.randint(len(legal))])
+    player = state.current_player(); opponent = 1 - player; sign = 1 if player == 0 else -1
+    unknown = ofc.mask_to_cards(ofc.FULL_DECK_MASK ^ ofc.cards_to_mask(state._board[0] + state._board[1] + state._current_cards[player] + state._discards[player]))
+    expected = []
+    for action in state.legal_actions():
+        child = state.clone(); child.apply_action(action); total = 0.0
+        for deal in itertools.combinations(unknown, 3):
+            world = child.clone(); world._deck = [card for card in unknown if card not in deal] + list(deal); world.apply_action(0)
+            responses = []
+            for response in world.legal_actions():
+                final = world.clone(); final.apply_action(response)
+                responses.append(sign * ofc.showdown_diff(ofc.evaluate_board(final._board[0]), ofc.evaluate_board(final._board[1])))
+            total += min(responses)
+        expected.append(total / math.comb(len(unknown), 3))
+    np.testing.assert_allclose(state.exact_action_values(player), expected)
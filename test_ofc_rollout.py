@@ -0,0 +1,49 @@
+"""Тесты OFCRolloutEvaluator."""
+
+import sys
+import threading
+import numpy as np
+import pyspiel
+
+import ofc_pineapple as ofc
+import ofc_rollout
+
+
+def _states(num_states, seed=0):
+    """Случайные состояния в фазах размещения обычной руки."""
+    np.random.seed(seed); rng = np.random.RandomState(seed); states = []
+    game = pyspiel.load_game("ofc_pineapple", {"row_actions": True})
+    while len(states) < num_states:
+        state = game.new_initial_state()
+        while state._phase < ofc.STREET_REGULAR_SHOWDOWN:
+            if state.is_chance_node(): state.apply_action(state.sample_chance_outcome(rng))
+            else: states.append(state.clone()); legal = state.legal_actions(); state.apply_action(legal[rng.randint(len(legal))])
+    return states[:num_states]
+
+
+def test_evaluate_is_thread_safe():
+    # Потоки ISMCTS (num_tree_threads > 1) зовут evaluate/prior одного оценщика одновременно
+    evaluator = ofc_rollout.OFCRolloutEvaluator(random_state=np.random.RandomState(0)); states = _states(40); errors = []
+    def worker():
+        try:
+            for _ in range(5):
+                for state in states:
+                    returns = evaluator.evaluate(state)
+                    assert np.isfinite(returns).all() and returns[0] == -returns[1]
+                    assert abs(sum(prob for _, prob in evaluator.prior(state)) - 1.0) < 1e-9
+        except Exception as e: errors.append(e)
+    interval = sys.getswitchinterval(); sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+    finally: sys.setswitchinterval(interval)
+    assert not errors, errors[:3]
+
+
+def test_rollout_fills_both_boards():
+    evaluator = ofc_rollout.OFCRolloutEvaluator(random_state=np.random.RandomState(1))
+    for state in _states(20, seed=1):
+        compact = state.to_compact(); evaluator._load_stats(compact); evaluator.rollout(compact)
+        stats = evaluator._buffers()[0]
+        assert [sum(stats[(p * ofc.NUM_ROWS + row) * ofc_rollout.NUM_STATS] for row in range(ofc.NUM_ROWS)) for p in range(ofc.NUM_PLAYERS)] == [ofc.TOTAL_CARDS_PLACED] * ofc.NUM_PLAYERS